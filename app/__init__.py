@@ -1,10 +1,121 @@
-from flask import Flask
+import os
+from flask import Flask, current_app
+from flask_jwt_extended import JWTManager
 from config import app_config
 from db import db
+from app import admission, metrics, pruning
 
+jwt = JWTManager()
 
-def create_app_and_register_db(config_name):
+
+def create_app(config_name):
+    """
+    Builds the todo api app with every extension, resource and command
+
+    Args:
+        config_name(str): configuration name(production e.g.)
+    Returns:
+        (Flask): flask app
+    """
     app = Flask(__name__)
     app.config.from_object(app_config[config_name])
     db.init_app(app)
+    jwt.init_app(app)
+    metrics.init_app(app)
+    pruning.init_app(app)
+    register_resources(app)
+    register_commands(app)
     return app
+
+
+def register_resources(app):
+    """Registers the jwt callbacks and api resources on given app"""
+    # imported here so importing the app package doesn't load them
+    from flask_restful import Api
+    from app import models, resources
+
+    def load_user(username):
+        """
+        Returns the cached user record. Misses are loaded from the primary:
+        a replica lagging behind a logout everywhere would hand back the old
+        token generation, which would then be cached for the whole TTL.
+        """
+        with metrics.phase('jwt'):
+            return models.user_cache.get(username)
+
+    @jwt.user_identity_loader
+    def user_identity(user):
+        return user.username
+
+    @jwt.user_claims_loader
+    def add_token_generation(user):
+        # tokens are issued for a User row just read from the primary, the
+        # cached generation may predate a logout everywhere in another worker
+        return {'generation': user.token_generation}
+
+    @jwt.token_in_blacklist_loader
+    def check_if_token_in_blacklist(decrypted_token):
+        jti = decrypted_token['jti']
+        config = current_app.config
+        claims = decrypted_token.get(config['JWT_USER_CLAIMS']) or {}
+        username = decrypted_token[config['JWT_IDENTITY_CLAIM']]
+        user = load_user(username)
+        # token issued after the cached user was loaded
+        if user is not None and \
+                claims.get('generation', 0) > user.token_generation:
+            models.user_cache.invalidate(username)
+            user = load_user(username)
+        # tokens issued before the user logged out everywhere
+        if user is None or \
+                claims.get('generation', 0) != user.token_generation:
+            return True
+        with metrics.phase('jwt'):
+            with db.reading(db.pick_replica()):
+                return models.revoked_tokens.is_revoked(jti)
+
+    @jwt.user_loader_callback_loader
+    def get_user_from_jwt(jwt_user):
+        return load_user(jwt_user)
+
+    # admission control runs before the jwt checks of the resources
+    api = Api(app, decorators=[admission.admit])
+    api.add_resource(resources.UserRegistration, '/registration')
+    api.add_resource(resources.UserLogin, '/login')
+    api.add_resource(resources.UserLogoutAccess, '/logout/access')
+    api.add_resource(resources.UserLogoutRefresh, '/logout/refresh')
+    api.add_resource(resources.UserLogoutAll, '/logout/all')
+    api.add_resource(resources.TokenRefresh, '/token/refresh')
+    api.add_resource(resources.TodoListResource, '/todos', endpoint='todos')
+    api.add_resource(resources.TodoBatchResource, '/todos/batch',
+                     endpoint='todo_batch')
+    api.add_resource(resources.TodoChangesResource, '/todos/changes',
+                     endpoint='todo_changes')
+    api.add_resource(resources.TodoExportResource, '/todos/export',
+                     endpoint='todo_export')
+    api.add_resource(resources.TodoImportResource, '/todos/import',
+                     endpoint='todo_import')
+    api.add_resource(resources.TodoSearchResource, '/todos/search',
+                     endpoint='todo_search')
+    api.add_resource(resources.TodoStatsResource, '/todos/stats',
+                     endpoint='todo_stats')
+    api.add_resource(resources.TodoResource, '/todos/<todo_id>',
+                     endpoint='todo')
+
+
+def register_commands(app):
+    """
+    Registers the maintenance commands on given app, and Flask-Migrate
+    (alembic takes a good part of the import time) only when the app is
+    loaded by the flask cli
+    """
+    from app import commands
+    app.cli.add_command(commands.rebuild_stats)
+    app.cli.add_command(commands.prune_revoked_tokens)
+    app.cli.add_command(commands.upgrade_if_needed)
+    app.cli.add_command(commands.export_todos)
+    app.cli.add_command(commands.import_todos)
+    app.cli.add_command(commands.compact_todo_changes)
+    app.cli.add_command(commands.archive_todos)
+    app.cli.add_command(commands.generate_data)
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        commands.init_migrate(app)
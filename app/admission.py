@@ -0,0 +1,201 @@
+"""
+Admission control in front of the api resources
+
+Every api request takes a token from the bucket of its client (the user
+of a valid access token, else the remote address) and endpoint class, so
+expensive endpoints (logins, registrations, list GETs) get budgets of
+their own; an empty bucket answers 429. A worker serves at most
+ADMISSION_MAX_IN_FLIGHT requests at once, requests which can not get a
+slot within ADMISSION_QUEUE_TIMEOUT are shed with 503, keeping the latency
+of the admitted ones bounded under overload. Outcomes are counted per
+endpoint class in todo_admission_requests_total.
+
+Buckets and slots live in each gunicorn worker process: a client spread
+over the workers gets up to GUNICORN_WORKERS times its rate limits, and
+each worker runs at most ADMISSION_MAX_IN_FLIGHT of its GUNICORN_THREADS
+threads' requests at once; the limit must stay below the thread count or
+the excess waits in gunicorn's accept queue, unseen and never shed. A
+streamed response keeps its slot until its body is sent. The identity of a
+verified access token is cached, so a client reusing its token doesn't
+pay for a second signature check per request.
+"""
+
+import os
+import threading
+import time
+from functools import wraps
+from flask import current_app, request
+from flask_jwt_extended import decode_token
+from app import metrics
+from app.cache import LRUCache
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst` tokens"""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def take(self, now):
+        """
+        Takes one token
+
+        Args:
+            now(float): time.monotonic()
+        Returns:
+            (float): 0 if a token was taken, else seconds until the next
+        """
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Rate limits and in-flight limit of one worker process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drops buckets, slots, token identities and counters"""
+        with self.lock:
+            self.buckets = None
+            self.identities = None
+            self.slots = None
+            self.pid = None
+            self.counters = {}
+
+    def stats(self):
+        """
+        Returns admission counters
+
+        Returns:
+            (dict): request counts keyed by (endpoint class, outcome),
+                outcome is one of accepted, rate_limited, shed
+        """
+        return dict(self.counters)
+
+    def setup(self):
+        """Creates buckets and slots, again after a fork"""
+        config = current_app.config
+        with self.lock:
+            if self.pid != os.getpid():
+                self.buckets = LRUCache(config['ADMISSION_MAX_CLIENTS'])
+                self.identities = LRUCache(
+                    config['ADMISSION_TOKEN_CACHE_SIZE'])
+                self.slots = threading.BoundedSemaphore(
+                    config['ADMISSION_MAX_IN_FLIGHT'])
+                self.pid = os.getpid()
+        return self.slots
+
+    @staticmethod
+    def endpoint_class():
+        """Returns the budget class of the current request"""
+        classes = current_app.config['ADMISSION_ENDPOINT_CLASSES']
+        return classes.get('%s %s' % (request.method, request.endpoint)) or \
+            classes.get(request.endpoint) or 'default'
+
+    def client_key(self):
+        """Returns the user of a valid access token, else remote address"""
+        authorization = request.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            encoded_token = authorization[len('Bearer '):]
+            identity = self.identities.get(encoded_token)
+            if identity is None:
+                try:
+                    token = decode_token(encoded_token)
+                except Exception:
+                    # refused later by the resource anyway
+                    return 'addr:%s' % request.remote_addr
+                identity = (token[current_app.config['JWT_IDENTITY_CLAIM']],
+                            token.get('exp'))
+                self.identities.set(encoded_token, identity)
+            username, expires_at = identity
+            if expires_at is None or expires_at > time.time():
+                return 'user:%s' % username
+        return 'addr:%s' % request.remote_addr
+
+    def count(self, endpoint_class, outcome):
+        key = (endpoint_class, outcome)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+        metrics.registry.inc('todo_admission_requests_total', {
+            'class': endpoint_class, 'outcome': outcome})
+
+    def take(self, endpoint_class):
+        """
+        Takes a token from the current client's bucket of given class
+
+        Returns:
+            (float): 0 if admitted, else seconds until the next token
+        """
+        rate, burst = current_app.config['ADMISSION_RATE_LIMITS'][
+            endpoint_class]
+        key = (self.client_key(), endpoint_class)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst, now)
+                self.buckets.set(key, bucket)
+            return bucket.take(now)
+
+    def admit(self, view):
+        """
+        Decorator admitting or refusing the requests of given api view,
+        does nothing unless ADMISSION_ENABLED
+
+        Args:
+            view(function): flask_restful resource view
+        """
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            config = current_app.config
+            if not config['ADMISSION_ENABLED']:
+                return view(*args, **kwargs)
+            slots = self.slots if self.pid == os.getpid() else self.setup()
+            endpoint_class = self.endpoint_class()
+            wait = self.take(endpoint_class)
+            if wait:
+                self.count(endpoint_class, 'rate_limited')
+                return overloaded(
+                    'Too many requests, retry later', 429, wait)
+            if not slots.acquire(timeout=config['ADMISSION_QUEUE_TIMEOUT']):
+                self.count(endpoint_class, 'shed')
+                return overloaded('Server is busy, retry later', 503,
+                                  config['ADMISSION_RETRY_AFTER'])
+            self.count(endpoint_class, 'accepted')
+            try:
+                response = view(*args, **kwargs)
+            except BaseException:
+                slots.release()
+                raise
+            if getattr(response, 'is_streamed', False):
+                # the body is generated after the view returns
+                response.call_on_close(slots.release)
+            else:
+                slots.release()
+            return response
+        return wrapper
+
+
+def overloaded(message, status, retry_after):
+    """Returns refused request response with Retry-After seconds"""
+    response = current_app.response_class(
+        '{"message": "%s"}\n' % message, status=status,
+        mimetype='application/json')
+    response.headers['Retry-After'] = str(max(int(retry_after + 0.999), 1))
+    return response
+
+
+controller = AdmissionController()
+admit = controller.admit
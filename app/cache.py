@@ -0,0 +1,128 @@
+"""In-process cache structures shared by the models"""
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class BloomFilter:
+    """
+    Probabilistic set membership with no false negatives.
+
+    Sized for `capacity` items at the given false positive rate; adding more
+    items than `capacity` keeps it correct but raises the false positive rate.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.size = int(math.ceil(
+            -self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(
+            int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _hashes(self, key):
+        """
+        Returns the two base hashes of given key (double hashing over blake2b)
+
+        Args:
+            key(str): item to hash
+        Returns:
+            (tuple): first hash, odd second hash
+        """
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        return (int.from_bytes(digest[:8], 'little'),
+                int.from_bytes(digest[8:], 'little') | 1)
+
+    def add(self, key):
+        """Adds given key to the filter"""
+        h1, h2 = self._hashes(key)
+        bits, size = self.bits, self.size
+        for i in range(self.hash_count):
+            position = (h1 + i * h2) % size
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        h1, h2 = self._hashes(key)
+        bits, size = self.bits, self.size
+        for i in range(self.hash_count):
+            position = (h1 + i * h2) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class LRUCache:
+    """Thread safe, size bounded mapping evicting least recently used keys"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Returns cached value of given key and marks it as recently used
+
+        Args:
+            key: cache key
+            default: returned when key is not cached
+        Returns:
+            cached value or default
+        """
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                return default
+            return self.data[key]
+
+    def set(self, key, value):
+        """Caches value for given key, evicting the oldest key if full"""
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Removes given key from the cache and returns its value"""
+        with self.lock:
+            return self.data.pop(key, default)
+
+    def clear(self):
+        """Removes all keys"""
+        with self.lock:
+            self.data.clear()
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+
+class TTLCache(LRUCache):
+    """LRUCache whose entries expire `ttl` seconds after being set"""
+
+    def __init__(self, maxsize, ttl):
+        super(TTLCache, self).__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        item = super(TTLCache, self).get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self.pop(key)
+            return default
+        return value
+
+    def set(self, key, value):
+        super(TTLCache, self).set(key, (time.monotonic() + self.ttl, value))
@@ -0,0 +1,166 @@
+"""Maintenance commands of the flask cli, e.g. `flask rebuild-stats`"""
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from app import synthetic, transfer
+from app.models import ArchivedTodo, RevokedTokenModel, TodoChange, \
+    TodoStats, User
+from db import db
+
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats():
+    """Recomputes the todo statistics of every user from scratch"""
+    TodoStats.rebuild()
+    click.echo('Rebuilt todo stats of %s users' % TodoStats.query.count())
+
+
+@click.command('prune-revoked-tokens')
+@click.option('--batch-size', type=int, help='rows deleted per transaction, '
+              'REVOKED_TOKEN_PRUNE_BATCH_SIZE by default')
+@with_appcontext
+def prune_revoked_tokens(batch_size):
+    """Deletes the revoked tokens which are past their expiry"""
+    config = current_app.config
+    deleted = RevokedTokenModel.prune(
+        batch_size or config['REVOKED_TOKEN_PRUNE_BATCH_SIZE'],
+        config['REVOKED_TOKEN_PRUNE_PAUSE'])
+    click.echo('Deleted %s expired revoked tokens' % deleted)
+
+
+@click.command('compact-todo-changes')
+@click.option('--retention', type=int, help='seconds deletions are kept, '
+              'TODO_CHANGES_RETENTION by default')
+@click.option('--batch-size', type=int, help='rows deleted per transaction, '
+              'TODO_CHANGES_COMPACT_BATCH_SIZE by default')
+@with_appcontext
+def compact_todo_changes(retention, batch_size):
+    """Deletes superseded todo changes and expired deletions"""
+    config = current_app.config
+    deleted = TodoChange.compact(
+        config['TODO_CHANGES_RETENTION'] if retention is None else retention,
+        batch_size or config['TODO_CHANGES_COMPACT_BATCH_SIZE'],
+        config['TODO_CHANGES_COMPACT_PAUSE'])
+    click.echo('Deleted %s todo changes' % deleted)
+
+
+@click.command('archive-todos')
+@click.option('--age', type=int, help='seconds since completion, '
+              'TODO_ARCHIVE_AGE by default')
+@click.option('--batch-size', type=int, help='rows moved per transaction, '
+              'TODO_ARCHIVE_BATCH_SIZE by default')
+@with_appcontext
+def archive_todos(age, batch_size):
+    """Moves the todos completed long ago to the todo archive"""
+    config = current_app.config
+    archived = ArchivedTodo.archive(
+        config['TODO_ARCHIVE_AGE'] if age is None else age,
+        batch_size or config['TODO_ARCHIVE_BATCH_SIZE'],
+        config['TODO_ARCHIVE_PAUSE'])
+    click.echo('Archived %s todos' % archived)
+
+
+def find_user(username):
+    """Returns the user with given username, fails the command if missing"""
+    user = User.find_by_username(username)
+    if user is None:
+        raise click.BadParameter("User %s doesn't exist" % username,
+                                 param_hint='USERNAME')
+    return user
+
+
+@click.command('export-todos')
+@click.argument('username')
+@click.argument('output', type=click.File('w'), default='-')
+@with_appcontext
+def export_todos(username, output):
+    """Writes the todos of USERNAME to OUTPUT as newline delimited json"""
+    from app.resources import todo_serializer
+    for chunk in transfer.export_lines(
+            find_user(username).id,
+            current_app.config['TODO_STREAM_BATCH_SIZE'], todo_serializer):
+        output.write(chunk)
+
+
+@click.command('import-todos')
+@click.argument('username')
+@click.argument('input', type=click.File('rb'), default='-')
+@click.option('--chunk-size', type=int, help='rows inserted per '
+              'transaction, TODO_IMPORT_CHUNK_SIZE by default')
+@with_appcontext
+def import_todos(username, input, chunk_size):
+    """
+    Creates a todo of USERNAME per newline delimited json line of INPUT,
+    e.g. the output of export-todos
+    """
+    config = current_app.config
+    progress = None
+    for progress in transfer.import_lines(
+            find_user(username).id, input,
+            chunk_size or config['TODO_IMPORT_CHUNK_SIZE'],
+            config['TODO_IMPORT_MAX_ERRORS']):
+        click.echo('Imported %s todos from %s lines' % (
+            progress['imported'], progress['lines']), err=True)
+    for error in progress['errors']:
+        click.echo('Line %s: %s' % (error['line'], error['message']),
+                   err=True)
+    click.echo('Imported %s todos, skipped %s invalid lines' % (
+        progress['imported'], progress['failed']))
+
+
+@click.command('generate-data')
+@click.option('--users', type=int, default=1000, show_default=True)
+@click.option('--todos', type=int, default=100000, show_default=True)
+@click.option('--revoked-tokens', type=int, default=10000,
+              show_default=True)
+@click.option('--password', default='password', show_default=True,
+              help='password of every generated user')
+@click.option('--seed', type=int, default=0, show_default=True)
+@click.option('--chunk-size', type=int, default=50000, show_default=True,
+              help='rows inserted per transaction')
+@with_appcontext
+def generate_data(users, todos, revoked_tokens, password, seed, chunk_size):
+    """Bulk loads synthetic users, todos and revoked tokens"""
+    inserted = synthetic.generate(users, todos, revoked_tokens, password,
+                                  seed, chunk_size)
+    click.echo('Generated %(users)s users, %(todos)s todos and '
+               '%(revoked_tokens)s revoked tokens' % inserted)
+
+
+def init_migrate(app):
+    """Registers Flask-Migrate on given app unless it already is"""
+    if 'migrate' not in app.extensions:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+
+def current_and_head_revisions():
+    """
+    Returns the schema revisions of the db and of the migrations directory
+
+    Returns:
+        (tuple): current revisions, head revisions
+    """
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    config = current_app.extensions['migrate'].migrate.get_config()
+    heads = set(ScriptDirectory.from_config(config).get_heads())
+    with db.engine.connect() as connection:
+        current = set(MigrationContext.configure(
+            connection).get_current_heads())
+    return current, heads
+
+
+@click.command('upgrade-if-needed')
+@with_appcontext
+def upgrade_if_needed():
+    """Upgrades the db schema to head unless it is already there"""
+    init_migrate(current_app._get_current_object())
+    current, heads = current_and_head_revisions()
+    if current == heads:
+        click.echo('Database schema is at head %s' % ', '.join(sorted(heads)))
+        return
+    from flask_migrate import upgrade
+    upgrade()
@@ -0,0 +1,158 @@
+"""
+Group commit of BaseModel.save/delete calls from concurrent requests
+
+The first writer to arrive becomes the leader of a group: it waits
+GROUP_COMMIT_WINDOW seconds for other writers to join, then applies every
+write of the group in a single transaction on its own session, so the
+group pays for one commit (one fsync on SQLite) instead of one each.
+Every writer blocks until its group is committed and gets its own result;
+if the group transaction fails the writes are retried one by one so only
+the failing write gets the error.
+"""
+
+import threading
+import time
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm.attributes import set_committed_value
+from db import db
+
+
+class Write:
+    """One pending write and its outcome"""
+
+    def __init__(self, apply):
+        self.apply = apply
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class GroupCommitter:
+    """Collects concurrent writes and commits them in groups"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commit_lock = threading.Lock()
+        self.pending = []
+        self.leader_waiting = False
+        self.counters = dict.fromkeys(('groups', 'writes', 'retries'), 0)
+
+    def stats(self):
+        """
+        Returns group commit counters
+
+        Returns:
+            (dict): groups: committed transactions, writes: applied
+                writes, retries: groups retried write by write
+        """
+        return dict(self.counters)
+
+    def submit(self, apply):
+        """
+        Queues given write and waits until its group is committed
+
+        Args:
+            apply(callable): applies the write to given session and
+                returns its result, called once or twice (retry)
+        Returns:
+            result of apply
+        Raises:
+            Exception: raised by apply or the commit of this write
+        """
+        write = Write(apply)
+        with self.lock:
+            self.pending.append(write)
+            lead = not self.leader_waiting
+            self.leader_waiting = True
+        if lead:
+            time.sleep(current_app.config['GROUP_COMMIT_WINDOW'])
+            with self.lock:
+                group, self.pending = self.pending, []
+                self.leader_waiting = False
+            # the next group gathers while this one commits
+            with self.commit_lock:
+                self.commit(group)
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    @staticmethod
+    def new_session():
+        # keep attributes loaded after commit, they are copied back
+        return db.session.session_factory(expire_on_commit=False)
+
+    def commit(self, group):
+        """Applies and commits given writes in one transaction"""
+        session = self.new_session()
+        try:
+            results = [write.apply(session) for write in group]
+            session.commit()
+            for write, result in zip(group, results):
+                write.result = result
+            self.counters['groups'] += 1
+        except Exception:
+            session.rollback()
+            self.counters['retries'] += 1
+            for write in group:
+                self.commit_one(write)
+        finally:
+            session.close()
+            self.counters['writes'] += len(group)
+            for write in group:
+                write.done.set()
+
+    def commit_one(self, write):
+        """Applies and commits given write in its own transaction"""
+        session = self.new_session()
+        try:
+            write.result = write.apply(session)
+            session.commit()
+            self.counters['groups'] += 1
+        except Exception as e:
+            session.rollback()
+            write.error = e
+        finally:
+            session.close()
+
+    def save(self, model):
+        """
+        Saves given model in the next group
+
+        Args:
+            model(BaseModel): new or changed model
+        Returns:
+            (BaseModel): given model, with db generated values loaded
+        """
+        if model in db.session:
+            db.session.expunge(model)
+
+        def apply(session):
+            merged = session.merge(model)
+            session.flush()
+            return merged
+
+        merged = self.submit(apply)
+        for attr in inspect(merged).mapper.column_attrs:
+            set_committed_value(model, attr.key, getattr(merged, attr.key))
+        return model
+
+    def delete(self, model):
+        """
+        Deletes given model in the next group
+
+        Args:
+            model(BaseModel): persistent model
+        """
+        if model in db.session:
+            db.session.expunge(model)
+
+        def apply(session):
+            session.delete(session.merge(model))
+            session.flush()
+
+        self.submit(apply)
+
+
+group_commit = GroupCommitter()
@@ -0,0 +1,240 @@
+"""
+Per request instrumentation exposed in Prometheus text format at /metrics
+
+Records request latency, the number of SQL statements and the time spent
+in them per endpoint, plus named phases (serialization, jwt callbacks)
+timed with `phase`. Nothing is hooked when METRICS_ENABLED is off.
+Every worker writes its counters to METRICS_DIR so /metrics served by any
+gunicorn worker reports the sum over all of them.
+"""
+
+import json
+import os
+import threading
+import time
+from flask import Response, current_app, g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Registry:
+    """Thread safe counters and histograms of one process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.flushed_at = 0
+
+    def inc(self, name, labels, value=1):
+        """Increments counter with given name and labels"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        """Records value in histogram with given name and labels"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {
+                    'buckets': list(buckets), 'counts': [0] * len(buckets),
+                    'sum': 0, 'count': 0}
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        """
+        Returns json serializable copy of all metrics
+
+        Returns:
+            (dict): counters and histograms as [name, labels, ...] lists
+        """
+        with self.lock:
+            return {
+                'counters': [[name, dict(labels), value] for
+                             (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, dict(labels),
+                     dict(histogram, counts=list(histogram['counts']))]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+    def flush(self, directory):
+        """Writes snapshot of this process to given directory"""
+        self.flushed_at = time.monotonic()
+        path = os.path.join(directory, '%s.json' % os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+
+registry = Registry()
+
+
+class phase:
+    """
+    Context manager adding the time spent in its block to the named phase
+    of the current request, no-op when metrics are disabled
+    """
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        phases = g.get('metrics_phases') if has_app_context() else None
+        if phases is not None:
+            phases[self.name] = phases.get(self.name, 0) + \
+                time.perf_counter() - self.start
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('metrics_query_start', []).append(
+        time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    elapsed = time.perf_counter() - conn.info['metrics_query_start'].pop()
+    queries = g.get('metrics_queries') if has_app_context() else None
+    if queries is not None:
+        queries.append((statement, elapsed))
+
+
+def before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_queries = []
+    g.metrics_phases = {}
+
+
+def after_request(response):
+    if 'metrics_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.metrics_start
+    endpoint = request.endpoint or 'unknown'
+    labels = {'endpoint': endpoint}
+    sql_time = sum(duration for _, duration in g.metrics_queries)
+    registry.inc('todo_http_requests_total', {
+        'endpoint': endpoint, 'method': request.method,
+        'status': str(response.status_code)})
+    registry.observe('todo_http_request_duration_seconds', labels, elapsed)
+    registry.observe('todo_sql_statements_per_request', labels,
+                     len(g.metrics_queries), COUNT_BUCKETS)
+    registry.observe('todo_sql_duration_seconds', labels, sql_time)
+    for name, duration in g.metrics_phases.items():
+        registry.observe('todo_phase_duration_seconds',
+                         dict(labels, phase=name), duration)
+
+    config = current_app.config
+    if elapsed > config['METRICS_SLOW_REQUEST_SECONDS']:
+        current_app.logger.warning(
+            'Slow request %s %s took %.3fs, %s queries in %.3fs:\n%s',
+            request.method, request.path, elapsed, len(g.metrics_queries),
+            sql_time, '\n'.join('%.4fs %s' % (duration, statement)
+                                for statement, duration in g.metrics_queries))
+    if config['METRICS_DIR'] and time.monotonic() - registry.flushed_at > \
+            config['METRICS_FLUSH_INTERVAL']:
+        registry.flush(config['METRICS_DIR'])
+    return response
+
+
+def collect(directory):
+    """
+    Sums snapshots of all processes in given directory
+
+    Args:
+        directory(str): METRICS_DIR, only this process if None
+    Returns:
+        (tuple): counters and histograms dicts keyed by (name, labels)
+    """
+    snapshots = [registry.snapshot()]
+    if directory:
+        registry.flush(directory)
+        snapshots = []
+        for filename in os.listdir(directory):
+            if filename.endswith('.json'):
+                with open(os.path.join(directory, filename)) as f:
+                    snapshots.append(json.load(f))
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, tuple(sorted(labels.items())))
+            total = histograms.setdefault(key, {
+                'buckets': histogram['buckets'],
+                'counts': [0] * len(histogram['buckets']),
+                'sum': 0, 'count': 0})
+            total['counts'] = [a + b for a, b in
+                               zip(total['counts'], histogram['counts'])]
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return counters, histograms
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % pair for pair in pairs)
+
+
+def metrics_view():
+    """Renders all metrics in Prometheus text format"""
+    counters, histograms = collect(current_app.config['METRICS_DIR'])
+    lines, typed = [], set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE %s counter' % name)
+        lines.append('%s%s %s' % (name, format_labels(labels), value))
+    for (name, labels), histogram in sorted(histograms.items()):
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE %s histogram' % name)
+        for bound, count in zip(histogram['buckets'], histogram['counts']):
+            lines.append('%s_bucket%s %s' % (
+                name, format_labels(labels, le=bound), count))
+        lines.append('%s_bucket%s %s' % (
+            name, format_labels(labels, le='+Inf'), histogram['count']))
+        lines.append('%s_sum%s %s' % (
+            name, format_labels(labels), histogram['sum']))
+        lines.append('%s_count%s %s' % (
+            name, format_labels(labels), histogram['count']))
+    return Response('\n'.join(lines) + '\n',
+                    mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """
+    Hooks request and SQL instrumentation into given app and serves
+    /metrics, does nothing unless METRICS_ENABLED
+
+    Args:
+        app(Flask): flask app
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+    if app.config['METRICS_DIR']:
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
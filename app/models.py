@@ -1,6 +1,15 @@
+import threading
+import time
+from collections import namedtuple
+from itertools import chain
 from db import db
-from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy import DDL, event, inspect
+from sqlalchemy.dialects import mysql, postgresql
+from app.cache import BloomFilter, LRUCache, TTLCache
+from app.group_commit import group_commit
+from app.passwords import HashingBusy, password_hasher
 
 
 class BaseModel:
@@ -10,27 +19,66 @@ class BaseModel:
 
     def delete(self):
         """Deletes this model from the db (through db.session)"""
+        if current_app.config['GROUP_COMMIT_ENABLED']:
+            return group_commit.delete(self)
         db.session.delete(self)
         db.session.commit()
 
     def save(self):
         """Adds this model to the db (through db.session)"""
+        if current_app.config['GROUP_COMMIT_ENABLED']:
+            return group_commit.save(self)
         db.session.add(self)
         db.session.commit()
         return self
 
+    @staticmethod
+    def flush_all(added=(), deleted=()):
+        """
+        Adds and deletes given models in the current transaction and
+        flushes them to the db without committing
+
+        Args:
+            added(list): models to add
+            deleted(list): models to delete
+        """
+        db.session.add_all(added)
+        for model in deleted:
+            db.session.delete(model)
+        db.session.flush()
+
+    @staticmethod
+    def commit():
+        """Commits the current transaction (through db.session)"""
+        db.session.commit()
+
     @classmethod
-    def get_items_by_user_id(cls, user_id):
+    def query_columns(cls, columns=None):
+        """
+        Returns a query of model objects, or of plain rows if columns given
+        so no ORM objects are built
+
+        Args:
+            cls(Todo): Todo class instance
+            columns(list): model columns to select
+        Returns:
+            (BaseQuery): query
+        """
+        return cls.query.with_entities(*columns) if columns else cls.query
+
+    @classmethod
+    def get_items_by_user_id(cls, user_id, columns=None):
         """
         Filters Todo objects with given user id
 
         Args:
             cls(Todo): Todo class instance
             user_id(int): logged_in user id
+            columns(list): select only these columns, see query_columns
         Returns:
             objects(Todo): Todo objects filtered by user_id
         """
-        return cls.query.filter_by(user_id=user_id).all()
+        return cls.query_columns(columns).filter(cls.user_id == user_id).all()
 
     @classmethod
     def get_item_by_user_id(cls, todo_id, user_id):
@@ -53,26 +101,65 @@ class User(db.Model, BaseModel):
     username = db.Column(db.String(80), index=True, unique=True,
                          nullable=False)
     password = db.Column(db.String(128))
+    # bumped by every flush changing the user's todos, see bump_todo_versions
+    todo_version = db.Column(db.Integer, nullable=False, default=0,
+                             server_default='0')
+    # claimed by the user's tokens, bumping it revokes all of them
+    token_generation = db.Column(db.Integer, nullable=False, default=0,
+                                 server_default='0')
+    # last TodoChange seq removed by compaction without a later change of
+    # the todo, changes since an older seq can't be replayed anymore
+    change_horizon = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
 
     def __repr__(self):
         return '<User %r>' % self.username
 
+    @classmethod
+    def get_todo_version(cls, user_id):
+        """
+        Returns todo_version of given user without loading the user
+
+        Args:
+            user_id(int): user id
+        Returns:
+            (int): version of the user's todo list
+        """
+        return db.session.query(cls.todo_version).filter(
+            cls.id == user_id).scalar()
+
+    @classmethod
+    def get_change_horizon(cls, user_id):
+        """
+        Returns change_horizon of given user without loading the user
+
+        Args:
+            cls(User): User class instance
+            user_id(int): user id
+        Returns:
+            (int): change_horizon, None if user doesn't exist
+        """
+        return db.session.query(cls.change_horizon).filter(
+            cls.id == user_id).scalar()
+
     @staticmethod
     def generate_password_hash(password):
         """
-        Generates sha256 hashed password with given clear text password
+        Generates hashed password with given clear text password, on the
+        password hashing pool (see app.passwords)
 
         Args:
              password(str): clear text password
         Returns:
-            (str): sha256 hashed password
+            (str): hashed password
         """
-        return generate_password_hash(password)
+        return password_hasher.hash(password)
 
     @staticmethod
     def verify_password(password, hashed_password):
         """
-        Verifies if given hashed & clear text passwords matches
+        Verifies if given hashed & clear text passwords matches, on the
+        password hashing pool (see app.passwords)
 
         Args:
              password(str): clear text password
@@ -80,7 +167,38 @@ class User(db.Model, BaseModel):
         Returns:
             bool: True if passwords matches else False
         """
-        return check_password_hash(hashed_password, password)
+        return password_hasher.verify(password, hashed_password)
+
+    def rehash_password(self, password):
+        """
+        Hashes given verified clear text password again if the stored hash
+        was made with outdated parameters. Best effort: it doesn't wait for
+        a hashing slot, a busy pool leaves the old hash for the next login.
+
+        Args:
+             password(str): clear text password
+        """
+        if password_hasher.needs_rehash(self.password):
+            try:
+                self.password = password_hasher.hash(password, timeout=0)
+            except HashingBusy:
+                return
+            self.save()
+
+    @classmethod
+    def bump_token_generation(cls, username):
+        """
+        Increments token_generation of given user, revoking every token
+        issued to the user so far
+
+        Args:
+             username(str): username
+        """
+        cls.query.filter_by(username=username).update(
+            {cls.token_generation: cls.token_generation + 1},
+            synchronize_session=False)
+        db.session.commit()
+        user_cache.invalidate(username)
 
     @classmethod
     def find_by_username(cls, username):
@@ -95,8 +213,84 @@ class User(db.Model, BaseModel):
         return cls.query.filter_by(username=username).first()
 
 
+# lightweight, session independent view of a User
+CachedUser = namedtuple('CachedUser', ('id', 'username', 'token_generation'))
+
+
+class UserCache:
+    """
+    Per process cache of CachedUser records keyed by username, used by the
+    jwt user loader instead of querying User on every request.
+    Entries expire after USER_CACHE_TTL seconds and are invalidated when
+    the user is inserted, updated or deleted in this process.
+    """
+
+    def __init__(self):
+        self.users = None
+
+    def clear(self):
+        """Drops all cached users"""
+        self.users = None
+
+    def get(self, username):
+        """
+        Returns cached user record of given username, loads it from the db
+        if it is not cached or expired
+
+        Args:
+             username(str): username
+        Returns:
+            (CachedUser): user record, None if user doesn't exist
+        """
+        if self.users is None:
+            config = current_app.config
+            self.users = TTLCache(config['USER_CACHE_SIZE'],
+                                  config['USER_CACHE_TTL'])
+        user = self.users.get(username)
+        if user is None:
+            found = User.find_by_username(username)
+            if found is None:
+                return None
+            user = CachedUser(found.id, found.username,
+                              found.token_generation)
+            self.users.set(username, user)
+        return user
+
+    def invalidate(self, username):
+        """Removes given username from the cache"""
+        if self.users is not None:
+            self.users.pop(username)
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, target):
+    """Drops changed user (old and new username) from the user cache"""
+    history = inspect(target).attrs.username.history
+    for username in set(history.deleted or ()) | {target.username}:
+        user_cache.invalidate(username)
+
+
 class Todo(db.Model, BaseModel):
     """Todo Model"""
+    __table_args__ = (
+        # keyset pagination and filter indexes, see filter_by_user_id
+        db.Index('ix_todo_user_id_created_at_id',
+                 'user_id', 'created_at', 'id'),
+        db.Index('ix_todo_user_id_is_done_due_date',
+                 'user_id', 'is_done', 'due_date'),
+        db.Index('ix_todo_user_id_due_date', 'user_id', 'due_date'),
+        # open todos (overdue) in created order, all todos in id order
+        db.Index('ix_todo_user_id_is_done_created_at_id',
+                 'user_id', 'is_done', 'created_at', 'id'),
+        db.Index('ix_todo_user_id_id', 'user_id', 'id'),
+        # ids of deleted, archived and logged todos are never reused
+        {'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     name = db.Column(db.String(140))
@@ -104,12 +298,846 @@ class Todo(db.Model, BaseModel):
     created_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     due_date = db.Column(db.Date, index=True, nullable=True)
     completed_date = db.Column(db.DateTime, index=True, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True,
+                           default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def apply(self, data):
+        """
+        Sets given parsed arguments on this todo, ignoring missing ones
+
+        Args:
+            data(dict): parsed todo_insert_parser/todo_update_parser arguments
+        """
+        for key, value in data.items():
+            if value is not None:
+                setattr(self, key, value)
+        # if is_done True set completed_date as now
+        if data.get('is_done'):
+            self.completed_date = datetime.utcnow()
+
+    @classmethod
+    def get_items_by_ids(cls, todo_ids, user_id):
+        """
+        Filters Todo objects with given ids and user id
+
+        Args:
+            cls(Todo): Todo class instance
+            todo_ids(list): Todo object ids
+            user_id(int): logged_in user id
+        Returns:
+            objects(list): Todo objects filtered by ids and user_id
+        """
+        if not todo_ids:
+            return []
+        return cls.query.filter(cls.id.in_(todo_ids),
+                                cls.user_id == user_id).all()
+
+    @classmethod
+    def including_archived(cls, user_id):
+        """
+        Returns an alias of Todo over the union of given user's todos and
+        archived todos, each side is read on its own user_id index
+
+        Args:
+            cls(Todo): Todo class instance
+            user_id(int): logged_in user id
+        Returns:
+            (AliasedClass): Todo alias, see filter_by_user_id source
+        """
+        keys = [column.key for column in cls.__table__.columns]
+        union = db.union_all(*(
+            db.select([table.c[key] for key in keys]).where(
+                table.c.user_id == user_id)
+            for table in (cls.__table__, ArchivedTodo.__table__)))
+        return db.aliased(cls, union.alias('todo_including_archived'))
+
+    @classmethod
+    def filter_by_user_id(cls, user_id, columns=None, is_done=None,
+                          due_after=None, due_before=None, overdue=False,
+                          source=None):
+        """
+        Returns query of Todo objects with given user id matching given
+        filters, every filter combination is served by a
+        (user_id, is_done, due_date) or (user_id, due_date) index, overdue
+        todos in created order by (user_id, is_done, created_at, id)
+
+        Args:
+            cls(Todo): Todo class instance
+            user_id(int): logged_in user id
+            columns(list): select only these columns, see query_columns
+            is_done(bool): only done/not done todos
+            due_after(date): only todos due on or after this date
+            due_before(date): only todos due on or before this date
+            overdue(bool): only not done todos due before today
+            source(AliasedClass): including_archived alias to query
+                instead of Todo
+        Returns:
+            (BaseQuery): query
+        """
+        if source is None:
+            todo, query = cls, cls.query_columns(columns)
+        else:
+            todo = source
+            query = db.session.query(*[
+                getattr(todo, column.key) for column in columns
+            ] if columns else [todo])
+        query = query.filter(todo.user_id == user_id)
+        if overdue:
+            # few open todos are not overdue yet: on sqlite the due date
+            # is only a hint, so (user_id, is_done, created_at, id) serves
+            # the created order instead of sorting every overdue todo
+            due = todo.due_date < date.today()
+            query = query.filter(todo.is_done == db.false(), db.func.likely(
+                due) if db.engine.dialect.name == 'sqlite' else due)
+        if is_done is not None:
+            query = query.filter(todo.is_done == is_done)
+        if due_after is not None:
+            query = query.filter(todo.due_date >= due_after)
+        if due_before is not None:
+            query = query.filter(todo.due_date <= due_before)
+        return query
+
+    # sort columns which may hold nulls, created_at is always set
+    NULLABLE_SORTS = ('due_date',)
+
+    @classmethod
+    def order_query(cls, query, sort, after=None, source=None):
+        """
+        Orders given query by sort column then id, seeking past given
+        position instead of offsetting so every page costs the same.
+        Null due dates sort before any date.
+
+        Args:
+            cls(Todo): Todo class instance
+            query(BaseQuery): Todo query
+            sort(str): column name, prefixed with - for descending order
+            after(tuple): (sort column value, id) of the last item of
+                previous page
+            source(AliasedClass): alias the query reads, see
+                filter_by_user_id
+        Returns:
+            (BaseQuery): ordered query
+        """
+        todo = cls if source is None else source
+        descending = sort.startswith('-')
+        column = getattr(todo, sort.lstrip('-'))
+        if after is not None:
+            value, todo_id = after
+            if value is None and descending:
+                seek = db.and_(column.is_(None), todo.id < todo_id)
+            elif value is None:
+                seek = db.or_(column.isnot(None),
+                              db.and_(column.is_(None), todo.id > todo_id))
+            elif descending and column.key in cls.NULLABLE_SORTS:
+                seek = db.or_(column < value, column.is_(None),
+                              db.and_(column == value, todo.id < todo_id))
+            elif descending:
+                seek = db.or_(column < value,
+                              db.and_(column == value, todo.id < todo_id))
+            else:
+                seek = db.or_(column > value,
+                              db.and_(column == value, todo.id > todo_id))
+            query = query.filter(seek)
+        if descending:
+            return query.order_by(column.desc().nullslast(), todo.id.desc())
+        return query.order_by(column.asc().nullsfirst(), todo.id)
+
+    @classmethod
+    def get_page_by_user_id(cls, user_id, limit, after=None, columns=None,
+                            sort='created_at', include_archived=False,
+                            **filters):
+        """
+        Returns one page of Todo objects with given user id
+
+        Args:
+            cls(Todo): Todo class instance
+            user_id(int): logged_in user id
+            limit(int): page size, None for all
+            after(tuple): position of previous page, see order_query
+            columns(list): select only these columns, see query_columns
+            sort(str): sort column, see order_query
+            include_archived(bool): also return archived todos
+            filters(dict): filters, see filter_by_user_id
+        Returns:
+            objects(list): Todo objects
+        """
+        source = cls.including_archived(user_id) if include_archived \
+            else None
+        query = cls.filter_by_user_id(user_id, columns, source=source,
+                                      **filters)
+        return cls.order_query(query, sort, after, source=source).limit(
+            limit).all()
+
+    @classmethod
+    def iter_items_by_user_id(cls, user_id, batch_size, columns=None,
+                              sort=None, include_archived=False, **filters):
+        """
+        Iterates Todo objects with given user id, loading batch_size rows
+        at a time instead of the whole result
+
+        Args:
+            cls(Todo): Todo class instance
+            user_id(int): logged_in user id
+            batch_size(int): rows fetched per round trip
+            columns(list): select only these columns, see query_columns
+            sort(str): sort column, see order_query, id order if None
+            include_archived(bool): also return archived todos
+            filters(dict): filters, see filter_by_user_id
+        Returns:
+            (iterator): Todo objects filtered by user_id
+        """
+        source = cls.including_archived(user_id) if include_archived \
+            else None
+        query = cls.filter_by_user_id(user_id, columns, source=source,
+                                      **filters)
+        if sort is None:
+            query = query.order_by((source or cls).id)
+        else:
+            query = cls.order_query(query, sort, source=source)
+        return query.yield_per(batch_size)
+
+    @classmethod
+    def insert_many(cls, user_id, items):
+        """
+        Inserts given todos of given user with one executemany and commits,
+        the ORM flush listeners don't see these rows so the TodoStats
+        counters and todo_version are updated here in the same transaction
+
+        Args:
+            cls(Todo): Todo class instance
+            user_id(int): owner user id
+            items(list): dicts of todo_import_parser arguments
+        """
+        now = datetime.utcnow()
+        rows = [{
+            'user_id': user_id,
+            'name': item['name'],
+            'is_done': bool(item['is_done']),
+            'due_date': item['due_date'],
+            'created_at': item['created_at'] or now,
+            'completed_date': item['completed_date'] or (
+                now if item['is_done'] else None),
+            'updated_at': now,
+        } for item in items]
+        connection = db.session.connection()
+        todos = cls.__table__
+        last_id = connection.execute(db.select([
+            db.func.coalesce(db.func.max(todos.c.id), 0)])).scalar()
+        connection.execute(todos.insert(), rows)
+        # ids grow, the rows above last_id are the ones just inserted
+        TodoChange.record_inserts(connection, user_id, last_id)
+        TodoStats.apply_deltas(connection, {user_id: (
+            len(rows), sum(1 for row in rows if row['is_done']))})
+        users = User.__table__
+        connection.execute(users.update().where(
+            users.c.id == user_id
+        ).values(todo_version=users.c.todo_version + 1))
+        db.session.commit()
+
+    @classmethod
+    def search(cls, user_id, terms, limit, offset=0, columns=None):
+        """
+        Returns one page of given user's Todo objects whose name has a
+        word starting with each given term, best match first. On SQLite
+        the todo_fts index is searched with prefix queries, its owner
+        column holds 'u<user_id>' so the user scope is part of the match;
+        other databases fall back to LIKE, see name_matches.
+        Matches are ranked by occurrences of the words per name length;
+        bm25 would also weight words by their frequency over all users'
+        todos, which costs a pass over every word's whole index.
+
+        Args:
+            cls(Todo): Todo class instance
+            user_id(int): logged_in user id
+            terms(list): words to search
+            limit(int): page size
+            offset(int): number of results of previous pages
+            columns(list): select only these columns, see query_columns
+        Returns:
+            objects(list): Todo objects
+        """
+        query = cls.query_columns(columns).filter(cls.user_id == user_id)
+        if db.engine.dialect.name == 'sqlite':
+            match = 'owner : "u%d" AND name : (%s)' % (user_id, ' AND '.join(
+                '"%s"*' % term.replace('"', '""') for term in terms))
+            query = query.join(todo_fts, todo_fts.c.rowid == cls.id).filter(
+                db.literal_column(todo_fts.name).op('MATCH')(match))
+        else:
+            query = query.filter(cls.name_matches(terms))
+        name = db.func.lower(cls.name)
+        occurrences = sum(
+            (db.func.length(name) - db.func.length(
+                db.func.replace(name, term.lower(), ''))) / len(term)
+            for term in terms)
+        score = occurrences * 1.0 / db.func.length(cls.name)
+        query = query.order_by(score.desc(), cls.id)
+        return query.offset(offset).limit(limit).all()
+
+    # characters besides spaces splitting todo names into words, the
+    # todo_fts tokenizer splits on every non alphanumeric character
+    WORD_SEPARATORS = '-_.,;:!?/\\()[]{}&+*#@\'"'
+
+    @classmethod
+    def name_matches(cls, terms):
+        """
+        Returns the LIKE condition of todo names having a word starting
+        with each given term, the todo_fts prefix match of databases
+        without it
+
+        Args:
+            cls(Todo): Todo class instance
+            terms(list): words to search
+        Returns:
+            (BooleanClauseList): condition
+        """
+        words = db.func.lower(cls.name)
+        for separator in cls.WORD_SEPARATORS:
+            words = db.func.replace(words, separator, ' ')
+        words = db.literal(' ') + words
+        # terms are \w+ words, fts reads one with _ as a phrase
+        return db.and_(*(words.like('%% %s%%' % term.lower().replace('_', ' '))
+                         for term in terms))
+
+
+# contentless FTS5 index of todo names kept in sync by triggers, sqlite only
+todo_fts = db.table('todo_fts', db.column('rowid'))
+TODO_FTS_DDL = (
+    "CREATE VIRTUAL TABLE todo_fts USING fts5(name, owner, content='')",
+    "CREATE TRIGGER todo_fts_insert AFTER INSERT ON todo BEGIN "
+    "INSERT INTO todo_fts (rowid, name, owner) "
+    "VALUES (new.id, new.name, 'u' || new.user_id); END",
+    "CREATE TRIGGER todo_fts_delete AFTER DELETE ON todo BEGIN "
+    "INSERT INTO todo_fts (todo_fts, rowid, name, owner) "
+    "VALUES ('delete', old.id, old.name, 'u' || old.user_id); END",
+    "CREATE TRIGGER todo_fts_update AFTER UPDATE OF name, user_id ON todo "
+    "BEGIN INSERT INTO todo_fts (todo_fts, rowid, name, owner) "
+    "VALUES ('delete', old.id, old.name, 'u' || old.user_id); "
+    "INSERT INTO todo_fts (rowid, name, owner) "
+    "VALUES (new.id, new.name, 'u' || new.user_id); END",
+)
+for statement in TODO_FTS_DDL:
+    event.listen(Todo.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Todo.__table__, 'before_drop', DDL(
+    'DROP TABLE IF EXISTS todo_fts').execute_if(dialect='sqlite'))
+
+
+class ArchivedTodo(db.Model, BaseModel):
+    """
+    Completed todos moved out of the todo table by archive once they are
+    old enough, so the todo table and its indexes only grow with the
+    active todos. Rows keep their todo id and are read only.
+    """
+    __tablename__ = 'todo_archive'
+    __table_args__ = (
+        # each side of Todo.including_archived is read in sort order
+        db.Index('ix_todo_archive_user_id_created_at_id',
+                 'user_id', 'created_at', 'id'),
+        db.Index('ix_todo_archive_user_id_due_date_id',
+                 'user_id', 'due_date', 'id'),
+        db.Index('ix_todo_archive_user_id_id', 'user_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    name = db.Column(db.String(140))
+    is_done = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime)
+    due_date = db.Column(db.Date, nullable=True)
+    completed_date = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False,
+                            default=datetime.utcnow)
+
+    @classmethod
+    def archive(cls, age, batch_size, pause=0):
+        """
+        Moves the todos completed more than age seconds ago to the
+        archive, batch_size rows per transaction. The moved todos still
+        count in TodoStats and make no TodoChange, their users'
+        todo_version is bumped.
+
+        Args:
+            cls(ArchivedTodo): ArchivedTodo class instance
+            age(int): seconds since completion before a todo is archived
+            batch_size(int): rows moved per transaction
+            pause(float): seconds to sleep between batches
+        Returns:
+            (int): number of archived todos
+        """
+        todos, archive, users = \
+            Todo.__table__, cls.__table__, User.__table__
+        keys = [column.key for column in todos.columns]
+        completed_before = datetime.utcfromtimestamp(time.time() - age)
+        archived = after_id = 0
+        while True:
+            rows = db.session.query(Todo.id, Todo.user_id).filter(
+                Todo.is_done == db.true(),
+                Todo.completed_date < completed_before,
+                Todo.id > after_id
+            ).order_by(Todo.id).limit(batch_size).all()
+            if rows:
+                after_id = rows[-1].id
+                ids = [row.id for row in rows]
+                db.session.execute(archive.insert().from_select(
+                    keys + ['archived_at'],
+                    db.select([todos.c[key] for key in keys] + [
+                        db.literal(datetime.utcnow())
+                    ]).where(todos.c.id.in_(ids))))
+                db.session.execute(todos.delete().where(todos.c.id.in_(ids)))
+                db.session.execute(users.update().where(users.c.id.in_(
+                    {row.user_id for row in rows})).values(
+                    todo_version=users.c.todo_version + 1))
+            db.session.commit()
+            archived += len(rows)
+            if len(rows) < batch_size:
+                return archived
+            time.sleep(pause)
+
+
+@event.listens_for(db.session, 'after_flush')
+def bump_todo_versions(session, flush_context):
+    """
+    Bumps todo_version of the users whose todos are inserted, updated or
+    deleted by this flush, in the same transaction
+    """
+    changed = [obj for obj in chain(session.new, session.deleted)
+               if isinstance(obj, Todo)]
+    changed.extend(obj for obj in session.dirty
+                   if isinstance(obj, Todo) and session.is_modified(obj))
+    user_ids = {todo.user_id for todo in changed}
+    if user_ids:
+        users = User.__table__
+        session.connection().execute(users.update().where(
+            users.c.id.in_(user_ids)
+        ).values(todo_version=users.c.todo_version + 1))
+
+
+class TodoStats(db.Model, BaseModel):
+    """
+    Per user todo counters, kept up to date by update_todo_stats in the
+    transaction changing the todos so reading them costs one row; they
+    include the archived todos
+    """
+    __tablename__ = 'todo_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        primary_key=True, autoincrement=False)
+    total = db.Column(db.Integer, nullable=False, default=0,
+                      server_default='0')
+    done = db.Column(db.Integer, nullable=False, default=0,
+                     server_default='0')
+
+    @classmethod
+    def get_by_user_id(cls, user_id):
+        """
+        Returns todo statistics of given user, overdue todos depend on the
+        current date so they are counted on the (user_id, is_done,
+        due_date) index instead of being stored
+
+        Args:
+            cls(TodoStats): TodoStats class instance
+            user_id(int): logged_in user id
+        Returns:
+            (dict): total, open, done, overdue counts and completion_rate
+        """
+        stats = cls.query.get(user_id)
+        total, done = (stats.total, stats.done) if stats else (0, 0)
+        overdue = Todo.filter_by_user_id(
+            user_id, [db.func.count(Todo.id)], overdue=True).scalar()
+        return {
+            'total': total,
+            'open': total - done,
+            'done': done,
+            'overdue': overdue,
+            'completion_rate': done / total if total else 0.0,
+        }
+
+    @classmethod
+    def upsert(cls, dialect):
+        """
+        Returns the statement adding its total and done parameters to the
+        row of its user_id parameter, inserting the row if missing, so
+        concurrent first todos of a user can't both insert it
+
+        Args:
+            cls(TodoStats): TodoStats class instance
+            dialect(str): name of the connection's dialect
+        Returns:
+            (Executable): statement
+        """
+        stats = cls.__table__
+        if dialect == 'postgresql':
+            statement = postgresql.insert(stats)
+            return statement.on_conflict_do_update(
+                index_elements=[stats.c.user_id], set_={
+                    'total': stats.c.total + statement.excluded.total,
+                    'done': stats.c.done + statement.excluded.done})
+        if dialect == 'mysql':
+            statement = mysql.insert(stats)
+            return statement.on_duplicate_key_update(
+                total=stats.c.total + statement.inserted.total,
+                done=stats.c.done + statement.inserted.done)
+        # sqlite 3.24+ upsert, which sqlalchemy 1.3 has no construct for
+        return db.text(
+            'INSERT INTO todo_stats (user_id, total, done) '
+            'VALUES (:user_id, :total, :done) ON CONFLICT (user_id) '
+            'DO UPDATE SET total = total + excluded.total, '
+            'done = done + excluded.done')
+
+    @classmethod
+    def apply_deltas(cls, connection, deltas):
+        """
+        Adds given counter changes to the stats rows, creating missing rows
+
+        Args:
+            cls(TodoStats): TodoStats class instance
+            connection(Connection): connection of the current transaction
+            deltas(dict): (total, done) changes keyed by user id
+        """
+        rows = [{'user_id': user_id, 'total': total, 'done': done}
+                for user_id, (total, done) in deltas.items() if total or done]
+        if rows:
+            connection.execute(cls.upsert(connection.dialect.name), rows)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Recomputes the counters of every user from the todo and
+        todo_archive tables
+        """
+        stats = cls.__table__
+        todos = db.union_all(*(
+            db.select([table.c.user_id, table.c.is_done]).where(
+                table.c.user_id.isnot(None))
+            for table in (Todo.__table__, ArchivedTodo.__table__))).alias()
+        done = db.func.sum(db.case([(todos.c.is_done == db.true(), 1)],
+                                   else_=0))
+        counts = db.select([
+            todos.c.user_id, db.func.count(), db.func.coalesce(done, 0)
+        ]).group_by(todos.c.user_id)
+        db.session.execute(stats.delete())
+        db.session.execute(stats.insert().from_select(
+            ['user_id', 'total', 'done'], counts))
+        db.session.commit()
+
+
+@event.listens_for(db.session, 'after_flush')
+def update_todo_stats(session, flush_context):
+    """
+    Applies the todos inserted, updated or deleted by this flush to the
+    TodoStats counters, in the same transaction
+    """
+    deltas = {}
+
+    def add(user_id, total, done):
+        current = deltas.get(user_id, (0, 0))
+        deltas[user_id] = (current[0] + total, current[1] + done)
+
+    for obj in session.new:
+        if isinstance(obj, Todo):
+            add(obj.user_id, 1, int(bool(obj.is_done)))
+    for obj in session.deleted:
+        if isinstance(obj, Todo):
+            committed = inspect(obj).committed_state
+            add(committed.get('user_id', obj.user_id), -1,
+                -int(bool(committed.get('is_done', obj.is_done))))
+    for obj in session.dirty:
+        if isinstance(obj, Todo) and session.is_modified(obj):
+            committed = inspect(obj).committed_state
+            if 'user_id' not in committed and 'is_done' not in committed:
+                continue
+            add(committed.get('user_id', obj.user_id), -1,
+                -int(bool(committed.get('is_done', obj.is_done))))
+            add(obj.user_id, 1, int(bool(obj.is_done)))
+    deltas.pop(None, None)
+    TodoStats.apply_deltas(session.connection(), deltas)
+
+
+class TodoChange(db.Model, BaseModel):
+    """
+    Per user append only log of todo changes, written by
+    record_todo_changes in the transaction changing the todos. Clients
+    replay the changes after the last seq they have seen instead of
+    reloading their list, compact drops the changes which are superseded
+    by a later change of the same todo and the expired deletions.
+    """
+    __tablename__ = 'todo_change'
+    __table_args__ = (
+        db.Index('ix_todo_change_user_id_seq', 'user_id', 'seq'),
+        db.Index('ix_todo_change_user_id_todo_id_seq',
+                 'user_id', 'todo_id', 'seq'),
+        # seqs of deleted rows are never reused
+        {'sqlite_autoincrement': True},
+    )
+    seq = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'),
+                        nullable=False)
+    # not a foreign key, deletions outlive their todo
+    todo_id = db.Column(db.Integer, nullable=False)
+    # create, update or delete
+    op = db.Column(db.String(6), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False,
+                           default=datetime.utcnow)
+
+    @classmethod
+    def record(cls, connection, changes):
+        """
+        Appends given changes to the log
+
+        Args:
+            cls(TodoChange): TodoChange class instance
+            connection(Connection): connection of the current transaction
+            changes(list): (user_id, todo_id, op) tuples
+        """
+        now = datetime.utcnow()
+        connection.execute(cls.__table__.insert(), [
+            {'user_id': user_id, 'todo_id': todo_id, 'op': op,
+             'created_at': now} for user_id, todo_id, op in changes])
+
+    @classmethod
+    def record_inserts(cls, connection, user_id, after_id):
+        """
+        Appends create changes of given user's todos with greater ids than
+        given one, for rows inserted without the ORM
+
+        Args:
+            cls(TodoChange): TodoChange class instance
+            connection(Connection): connection of the current transaction
+            user_id(int): owner user id
+            after_id(int): greatest todo id before the inserts
+        """
+        todos = Todo.__table__
+        inserted = db.select([
+            todos.c.user_id, todos.c.id, db.literal('create'),
+            db.literal(datetime.utcnow())
+        ]).where(db.and_(todos.c.user_id == user_id,
+                         todos.c.id > after_id)).order_by(todos.c.id)
+        connection.execute(cls.__table__.insert().from_select(
+            ['user_id', 'todo_id', 'op', 'created_at'], inserted))
+
+    @classmethod
+    def last_seq(cls, user_id):
+        """
+        Returns the seq of given user's latest change, 0 if none
+
+        Args:
+            cls(TodoChange): TodoChange class instance
+            user_id(int): user id
+        """
+        return db.session.query(db.func.max(cls.seq)).filter(
+            cls.user_id == user_id).scalar() or 0
+
+    @classmethod
+    def get_since(cls, user_id, since, limit, columns):
+        """
+        Returns given user's changes after given seq, with the current
+        state of the changed todos, archived ones included
+
+        Args:
+            cls(TodoChange): TodoChange class instance
+            user_id(int): logged_in user id
+            since(int): last seq seen by the client
+            limit(int): max number of changes
+            columns(list): Todo columns to select
+        Returns:
+            (list): rows of seq, op, todo_id and given columns, which are
+                None if the todo doesn't exist anymore, seq ordered
+        """
+        # a todo id is either in todo or in todo_archive
+        selected = [db.func.coalesce(
+            column, getattr(ArchivedTodo, column.key)).label(column.key)
+            for column in columns]
+        return db.session.query(cls.seq, cls.op, cls.todo_id, *selected) \
+            .outerjoin(Todo, db.and_(Todo.id == cls.todo_id,
+                                     Todo.user_id == cls.user_id)) \
+            .outerjoin(ArchivedTodo, db.and_(
+                ArchivedTodo.id == cls.todo_id,
+                ArchivedTodo.user_id == cls.user_id)) \
+            .filter(cls.user_id == user_id, cls.seq > since) \
+            .order_by(cls.seq).limit(limit).all()
+
+    @classmethod
+    def compact(cls, retention, batch_size, pause=0):
+        """
+        Deletes the changes superseded by a later change of the same todo
+        and the deletions older than retention seconds, moving the users'
+        change_horizon past the latter; batch_size rows per transaction
+
+        Args:
+            cls(TodoChange): TodoChange class instance
+            retention(int): seconds deletions are kept
+            batch_size(int): rows deleted per transaction
+            pause(float): seconds to sleep between batches
+        Returns:
+            (int): number of deleted rows
+        """
+        later = db.aliased(cls)
+        superseded = db.session.query(cls.seq).filter(
+            db.exists().where(db.and_(later.user_id == cls.user_id,
+                                      later.todo_id == cls.todo_id,
+                                      later.seq > cls.seq)))
+        expired = db.session.query(cls.seq, cls.user_id).filter(
+            cls.op == 'delete',
+            cls.created_at < datetime.utcfromtimestamp(
+                time.time() - retention))
+        deleted = 0
+        for query in (superseded, expired):
+            last_seq = 0
+            while True:
+                rows = query.filter(cls.seq > last_seq).order_by(
+                    cls.seq).limit(batch_size).all()
+                if rows:
+                    last_seq = rows[-1][0]
+                    cls.query.filter(cls.seq.in_(
+                        [row[0] for row in rows])).delete(
+                        synchronize_session=False)
+                if query is expired:
+                    horizons = {}
+                    for seq, user_id in rows:
+                        horizons[user_id] = max(seq, horizons.get(user_id, 0))
+                    users = User.__table__
+                    for user_id, seq in horizons.items():
+                        db.session.execute(users.update().where(db.and_(
+                            users.c.id == user_id,
+                            users.c.change_horizon < seq
+                        )).values(change_horizon=seq))
+                db.session.commit()
+                deleted += len(rows)
+                if len(rows) < batch_size:
+                    break
+                time.sleep(pause)
+        return deleted
+
+
+@event.listens_for(db.session, 'after_flush')
+def record_todo_changes(session, flush_context):
+    """
+    Appends the todos inserted, updated or deleted by this flush to the
+    TodoChange log, in the same transaction, and remembers their users
+    for todo_change_notifier
+    """
+    changes = [(obj.user_id, obj.id, 'create') for obj in session.new
+               if isinstance(obj, Todo)]
+    changes.extend((inspect(obj).committed_state.get('user_id', obj.user_id),
+                    obj.id, 'delete') for obj in session.deleted
+                   if isinstance(obj, Todo))
+    changes.extend((obj.user_id, obj.id, 'update') for obj in session.dirty
+                   if isinstance(obj, Todo) and session.is_modified(obj))
+    changes = [change for change in changes if change[0] is not None]
+    if changes:
+        TodoChange.record(session.connection(), changes)
+        session.info.setdefault('todo_change_users', set()).update(
+            change[0] for change in changes)
+
+
+class TodoChangeNotifier:
+    """
+    Wakes up the change streams of this process when the todos of their
+    user are committed by this process; changes committed by other
+    processes are picked up by polling
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.versions = {}
+        self.streams = 0
+
+    def open_stream(self, max_streams):
+        """
+        Counts a new change stream of this process
+
+        Args:
+            max_streams(int): max number of streams open at once
+        Returns:
+            (bool): False if max_streams are already open
+        """
+        with self.condition:
+            if self.streams >= max_streams:
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        """Counts a closed change stream, see open_stream"""
+        with self.condition:
+            self.streams -= 1
+
+    def version(self, user_id):
+        """Returns the number of commits notified for given user"""
+        return self.versions.get(user_id, 0)
+
+    def notify(self, user_ids):
+        """Wakes up the waiters of given users"""
+        with self.condition:
+            for user_id in user_ids:
+                self.versions[user_id] = self.version(user_id) + 1
+            self.condition.notify_all()
+
+    def wait(self, user_id, version, timeout):
+        """
+        Waits for a commit of given user's todos
+
+        Args:
+            user_id(int): user id
+            version(int): version read before the last change query
+            timeout(float): max seconds to wait
+        Returns:
+            (bool): True if notified, False on timeout
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.version(user_id) != version, timeout)
+
+
+todo_change_notifier = TodoChangeNotifier()
+
+
+@event.listens_for(db.session, 'after_commit')
+def notify_todo_changes(session):
+    user_ids = session.info.pop('todo_change_users', None)
+    if user_ids:
+        todo_change_notifier.notify(user_ids)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_todo_changes(session):
+    session.info.pop('todo_change_users', None)
 
 
 class RevokedTokenModel(db.Model, BaseModel):
     """Revoked Token Model"""
     id = db.Column(db.Integer, primary_key=True)
-    jti = db.Column(db.String(120))
+    jti = db.Column(db.String(120), index=True)
+    # exp of the token, the row is useless afterwards, see prune
+    expires_at = db.Column(db.DateTime, index=True, nullable=True)
+
+    @classmethod
+    def from_token(cls, token):
+        """
+        Builds revoked token of given decoded json token
+
+        Args:
+            cls(RevokedTokenModel): RevokedTokenModel class instance
+            token(dict): decoded json token
+        Returns:
+            (RevokedTokenModel): unsaved revoked token, never expiring if
+                the token has no exp
+        """
+        expires_at = datetime.utcfromtimestamp(token['exp']) \
+            if 'exp' in token else None
+        return cls(jti=token['jti'], expires_at=expires_at)
+
+    @classmethod
+    def not_expired(cls):
+        """
+        Returns filter excluding expired revoked tokens
+
+        Args:
+            cls(RevokedTokenModel): RevokedTokenModel class instance
+        Returns:
+            filter expression
+        """
+        return db.or_(cls.expires_at.is_(None),
+                      cls.expires_at > datetime.utcnow())
 
     @classmethod
     def is_jti_blacklisted(cls, jti):
@@ -123,5 +1151,194 @@ class RevokedTokenModel(db.Model, BaseModel):
             (bool): True if given json token blacklisted else False
 
         """
-        query = cls.query.filter_by(jti=jti).first()
+        query = cls.query.filter(cls.jti == jti, cls.not_expired()).first()
         return bool(query)
+
+    @classmethod
+    def prune(cls, batch_size, pause=0):
+        """
+        Deletes expired revoked tokens, batch_size rows per transaction so
+        the write lock is only held briefly
+
+        Args:
+            cls(RevokedTokenModel): RevokedTokenModel class instance
+            batch_size(int): rows deleted per transaction
+            pause(float): seconds to sleep between batches
+        Returns:
+            (int): number of deleted rows
+        """
+        deleted = 0
+        while True:
+            ids = [row_id for row_id, in db.session.query(cls.id).filter(
+                cls.expires_at <= datetime.utcnow()).limit(batch_size)]
+            if ids:
+                cls.query.filter(cls.id.in_(ids)).delete(
+                    synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
+            if len(ids) < batch_size:
+                return deleted
+            time.sleep(pause)
+
+
+class RevokedTokenCache:
+    """
+    Revocation check layer in front of RevokedTokenModel.
+
+    A bloom filter holding every revoked jti answers the common "not revoked"
+    case without any SQL, a bounded LRU keeps confirmed revocations and only
+    bloom filter hits missing from the LRU are confirmed against the db.
+    The filter is warmed from the db on first use, updated in process by the
+    logout resources and synced with rows revoked by other workers every
+    REVOKED_TOKEN_SYNC_INTERVAL seconds.
+
+    Ids are allocated before commit, so a revocation may commit after rows
+    with greater ids were synced (concurrent transactions on PostgreSQL or
+    MySQL). Missing ids below the synced ones are kept as gaps and looked
+    up again on every sync until they show up or are older than
+    REVOKED_TOKEN_SYNC_GAP_TIMEOUT seconds (rolled back or pruned).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drops cached state, next check warms the cache again"""
+        with self.lock:
+            self.bloom = None
+            self.confirmed = None
+            self.last_id = 0
+            # unseen ids below last_id: monotonic time they were missed
+            self.gaps = {}
+            self.synced_at = 0
+            self.counters = dict.fromkeys(
+                ('bloom_negative', 'cache_hit', 'db_hit', 'db_miss'), 0)
+
+    def stats(self):
+        """
+        Returns hit/miss counters
+
+        Returns:
+            (dict): bloom_negative: answered by the bloom filter without SQL,
+                cache_hit: confirmed revocation served from the LRU,
+                db_hit: revocation confirmed by the db,
+                db_miss: bloom filter false positive resolved by the db
+        """
+        with self.lock:
+            return dict(self.counters)
+
+    def count(self, name):
+        """Increments given counter of stats, checks run in many threads"""
+        with self.lock:
+            self.counters[name] += 1
+
+    def warm(self):
+        """Builds the bloom filter from the unexpired revoked tokens"""
+        config = current_app.config
+        count = RevokedTokenModel.query.filter(
+            RevokedTokenModel.not_expired()).count()
+        bloom = BloomFilter(
+            max(config['REVOKED_TOKEN_BLOOM_CAPACITY'], count * 2),
+            config['REVOKED_TOKEN_BLOOM_ERROR_RATE'])
+        last_id = db.session.query(
+            db.func.max(RevokedTokenModel.id)).scalar() or 0
+        # transactions still open may hold any of the latest ids
+        window = range(max(last_id - config['REVOKED_TOKEN_SYNC_GAP_WINDOW'],
+                           0) + 1, last_id + 1)
+        seen = set()
+        rows = db.session.query(
+            RevokedTokenModel.id, RevokedTokenModel.jti
+        ).filter(RevokedTokenModel.not_expired(),
+                 RevokedTokenModel.id <= last_id)
+        for row_id, jti in rows.yield_per(10000):
+            bloom.add(jti)
+            if row_id in window:
+                seen.add(row_id)
+        now = time.monotonic()
+        with self.lock:
+            self.bloom = bloom
+            self.confirmed = LRUCache(config['REVOKED_TOKEN_CACHE_SIZE'])
+            self.last_id = last_id
+            # expired rows are among these, the next sync finds them
+            self.gaps = {row_id: now for row_id in window
+                         if row_id not in seen}
+            self.synced_at = now
+
+    def sync(self):
+        """Adds tokens revoked by other processes since the last sync"""
+        if not self.lock.acquire(blocking=False):
+            return  # another thread is already syncing
+        try:
+            config = current_app.config
+            now = self.synced_at = time.monotonic()
+            query = db.session.query(RevokedTokenModel.id,
+                                     RevokedTokenModel.jti)
+            rows = query.filter(RevokedTokenModel.id > self.last_id) \
+                .order_by(RevokedTokenModel.id).all()
+            gaps = list(self.gaps)
+            for start in range(0, len(gaps), 500):
+                rows.extend(query.filter(RevokedTokenModel.id.in_(
+                    gaps[start:start + 500])))
+            for row_id, jti in rows:
+                self.bloom.add(jti)
+                self.gaps.pop(row_id, None)
+                if row_id > self.last_id:
+                    for missing in range(max(
+                            self.last_id + 1,
+                            row_id - config['REVOKED_TOKEN_SYNC_GAP_WINDOW']),
+                            row_id):
+                        self.gaps[missing] = now
+                    self.last_id = row_id
+            timeout = config['REVOKED_TOKEN_SYNC_GAP_TIMEOUT']
+            self.gaps = {row_id: missed_at for row_id, missed_at
+                         in self.gaps.items() if now - missed_at < timeout}
+            overfilled = self.bloom.count > self.bloom.capacity
+        finally:
+            self.lock.release()
+        if overfilled:
+            self.warm()
+
+    def add(self, jti):
+        """
+        Marks given json token as revoked in this process
+
+        Args:
+            jti(str): json token
+        """
+        if self.bloom is None:
+            return  # warm() will load it from the db
+        self.bloom.add(jti)
+        self.confirmed.set(jti, True)
+
+    def is_revoked(self, jti):
+        """
+        Checks if given json token revoked, hitting the db only on bloom
+        filter matches which are not cached yet
+
+        Args:
+            jti(str): json token
+        Returns:
+            (bool): True if given json token revoked else False
+        """
+        if self.bloom is None:
+            self.warm()
+        elif time.monotonic() - self.synced_at > \
+                current_app.config['REVOKED_TOKEN_SYNC_INTERVAL']:
+            self.sync()
+
+        if jti not in self.bloom:
+            self.count('bloom_negative')
+            return False
+        if self.confirmed.get(jti):
+            self.count('cache_hit')
+            return True
+        if RevokedTokenModel.is_jti_blacklisted(jti):
+            self.count('db_hit')
+            self.confirmed.set(jti, True)
+            return True
+        self.count('db_miss')
+        return False
+
+
+revoked_tokens = RevokedTokenCache()
@@ -1,7 +1,16 @@
 """Argument Parser objects"""
 
-from flask_restful import reqparse
-from datetime import datetime
+import base64
+import binascii
+import json
+import re
+from flask import request
+from flask_restful import abort
+from datetime import date, datetime, timezone
+
+ISO_DATE = re.compile(r'(\d{4})-(\d{2})-(\d{2})', re.ASCII)
+BOOLEANS = {'true': True, '1': True, 'on': True,
+            'false': False, '0': False, 'off': False}
 
 
 def valid_date(value, name):
@@ -17,42 +26,422 @@ def valid_date(value, name):
         ValueError: If given date string's format is not correct
     """
     try:
+        # strptime is slow, it is left to the unusual formats it accepts
+        match = ISO_DATE.fullmatch(value)
+        if match:
+            return datetime(*map(int, match.groups()))
         return datetime.strptime(value, "%Y-%m-%d")
-    except ValueError:
+    except (ValueError, TypeError):
         raise ValueError("The parameter '{}' is not valid date(%Y-%m-%d). "
                          "Your input is: {}".format(name, value))
 
 
-authentication_parser = reqparse.RequestParser()
-authentication_parser.add_argument(
-    'username', help='username can not be blank', required=True)
-authentication_parser.add_argument(
-    'password', help='password can not be blank', required=True)
+def valid_day(value, name):
+    """
+    Validation function for date input compared with Date columns
+
+    Args:
+        value(date): date string
+        name(str): parameter name(due_after e.g.)
+    Returns:
+        (date): parsed date string
+    Raises:
+        ValueError: If given date string's format is not correct
+    """
+    return valid_date(value, name).date()
+
+
+def valid_timestamp(value, name):
+    """
+    Validation function for ISO 8601 timestamp input
+
+    Args:
+        value(str): timestamp string, as exported by GET /todos/export
+        name(str): parameter name(created_at e.g.)
+    Returns:
+        (datetime): parsed timestamp, naive UTC if an offset was given
+    Raises:
+        ValueError: If given timestamp string's format is not correct
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        raise ValueError("The parameter '{}' is not valid ISO 8601 timestamp. "
+                         "Your input is: {}".format(name, value))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def valid_boolean(value, name):
+    """
+    Validation function for boolean input
+
+    Args:
+        value(bool|int|str): json boolean, json number 1/0, or true/false,
+            1/0, on/off string
+        name(str): parameter name(is_done e.g.)
+    Returns:
+        (bool): parsed boolean
+    Raises:
+        ValueError: If given value is not a boolean
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    try:
+        return BOOLEANS[value.lower()]
+    except (KeyError, AttributeError):
+        raise ValueError("The parameter '{}' is not a boolean. "
+                         "Your input is: {}".format(name, value))
+
+
+def valid_limit(value, name):
+    """
+    Validation function for page size input
+
+    Args:
+        value(str): page size string
+        name(str): parameter name(limit e.g.)
+    Returns:
+        (int): page size
+    Raises:
+        ValueError: If given value is not a positive integer
+    """
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise ValueError("The parameter '{}' is not a positive integer. "
+                         "Your input is: {}".format(name, value))
+    return limit
+
+
+def valid_seq(value, name):
+    """
+    Validation function for change log position input
+
+    Args:
+        value(str): seq string
+        name(str): parameter name(since e.g.)
+    Returns:
+        (int): seq
+    Raises:
+        ValueError: If given value is not a non negative integer
+    """
+    try:
+        seq = int(value)
+    except ValueError:
+        seq = -1
+    if seq < 0:
+        raise ValueError("The parameter '{}' is not a non negative integer. "
+                         "Your input is: {}".format(name, value))
+    return seq
+
+
+def encode_cursor(sort, value, todo_id):
+    """
+    Builds opaque pagination cursor pointing after given keyset position
+
+    Args:
+        sort(str): sort parameter of the page
+        value(date): sort column value of the last item of the page
+        todo_id(int): id of the last item of the page
+    Returns:
+        (str): url safe cursor
+    """
+    position = json.dumps(
+        [sort, value.isoformat() if value is not None else None, todo_id])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def valid_cursor(value, name):
+    """
+    Validation function for pagination cursor input
+
+    Args:
+        value(str): cursor built by encode_cursor
+        name(str): parameter name(cursor e.g.)
+    Returns:
+        (tuple): sort parameter, (sort column value, id) keyset position
+    Raises:
+        ValueError: If given cursor is not valid
+    """
+    try:
+        sort, position, todo_id = json.loads(base64.urlsafe_b64decode(value))
+        if position is None:
+            pass
+        elif sort.lstrip('-') == 'created_at':
+            position = datetime.fromisoformat(position)
+        elif sort.lstrip('-') == 'due_date':
+            position = date.fromisoformat(position)
+        else:
+            raise ValueError(sort)
+        return sort, (position, int(todo_id))
+    except (ValueError, TypeError, AttributeError, binascii.Error):
+        raise ValueError("The parameter '{}' is not a valid cursor. "
+                         "Your input is: {}".format(name, value))
+
+
+def encode_offset_cursor(offset):
+    """
+    Builds opaque pagination cursor for ranked results, which have no
+    stable keyset position
+
+    Args:
+        offset(int): number of results of previous pages
+    Returns:
+        (str): url safe cursor
+    """
+    return base64.urlsafe_b64encode(
+        json.dumps(['offset', offset]).encode()).decode()
+
+
+def valid_offset_cursor(value, name):
+    """
+    Validation function for ranked results cursor input
+
+    Args:
+        value(str): cursor built by encode_offset_cursor
+        name(str): parameter name(cursor e.g.)
+    Returns:
+        (int): offset
+    Raises:
+        ValueError: If given cursor is not valid
+    """
+    try:
+        kind, offset = json.loads(base64.urlsafe_b64decode(value))
+        if kind != 'offset' or int(offset) < 0:
+            raise ValueError(kind)
+        return int(offset)
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("The parameter '{}' is not a valid cursor. "
+                         "Your input is: {}".format(name, value))
+
+
+def valid_search_query(value, name):
+    """
+    Validation function for search query input
+
+    Args:
+        value(str): search query
+        name(str): parameter name(q e.g.)
+    Returns:
+        (list): words of the query
+    Raises:
+        ValueError: If given query has no words
+    """
+    terms = re.findall(r'\w+', value or '')
+    if not terms:
+        raise ValueError("The parameter '{}' has no words. "
+                         "Your input is: {}".format(name, value))
+    return terms
+
+
+class Field:
+    """
+    Argument of a Schema
+
+    Args:
+        name(str): argument name
+        help(str): error message of a missing or invalid value
+        required(bool): missing value is an error
+        type(function): validation function called with value and name,
+            returns the parsed value, str if not given
+        default(object): value of a missing argument
+        choices(tuple): valid parsed values
+    """
+    __slots__ = ('name', 'help', 'required', 'type', 'default', 'choices')
+
+    def __init__(self, name, help, required=False, type=None, default=None,
+                 choices=None):
+        self.name = name
+        self.help = help
+        self.required = required
+        self.type = type
+        self.default = default
+        self.choices = choices
+
+    def parse(self, value):
+        """Returns parsed non null value, raises ValueError if invalid"""
+        if self.type is None:
+            value = str(value)
+        else:
+            value = self.type(value, self.name)
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(value)
+        return value
+
+
+class Schema:
+    """
+    Request argument parser replacing reqparse.RequestParser, which looks
+    up every argument in every request location; the sources are picked
+    once per request and each field is looked up once. Errors abort with
+    400 and {"message": {name: help}} like reqparse.
+
+    Args:
+        fields(Field): arguments
+        location(str): json to read the json body, then query string and
+            form values, args to read the query string only
+    """
+
+    def __init__(self, *fields, location='json'):
+        self.fields = fields
+        self.location = location
+
+    def parse_args(self, req=None):
+        """
+        Parses the arguments of given request
+
+        Args:
+            req(Request): flask request, the current one if not given
+        Returns:
+            (dict): parsed arguments, None for missing optional ones
+        Raises:
+            HTTPException: 400 with the help of the first invalid argument
+        """
+        req = req or request
+        if self.location == 'args':
+            return self.parse(req.args)
+        data = req.json
+        values = req.values
+        if not values:
+            # json body fast path
+            return self.parse(data if isinstance(data, dict) else {})
+        if not isinstance(data, dict) or not data:
+            return self.parse(values)
+        return self.parse(data, values)
+
+    def parse(self, *sources):
+        """
+        Parses given mappings, the first one having an argument wins
+
+        Args:
+            sources(dict): json objects or MultiDicts of arguments
+        Returns:
+            (dict): parsed arguments, None for missing optional ones
+        Raises:
+            HTTPException: 400 with the help of the first invalid argument
+        """
+        parsed = {}
+        for field in self.fields:
+            name = field.name
+            for source in sources:
+                if name in source:
+                    value = source[name]
+                    # json lists count as many values, first one is used
+                    if type(value) is list:
+                        if not value:
+                            continue
+                        value = value[0]
+                    break
+            else:
+                if field.required:
+                    abort(400, message={name: field.help})
+                parsed[name] = field.default
+                continue
+            if value is not None:
+                try:
+                    value = field.parse(value)
+                except Exception:
+                    abort(400, message={name: field.help})
+            parsed[name] = value
+        return parsed
+
+
+def parse_item(parser, item):
+    """
+    Parses given dict with given parser, as if it was the request json
+
+    Args:
+        parser(Schema): argument parser
+        item(dict): json object to parse
+    Returns:
+        (dict): parsed arguments
+    Raises:
+        HTTPException: 400 with the parser error message if item is invalid
+    """
+    return parser.parse(item)
+
+
+authentication_parser = Schema(
+    Field('username', 'username can not be blank', required=True),
+    Field('password', 'password can not be blank', required=True),
+)
 
 # insert argument parser, name is required field
-todo_insert_parser = reqparse.RequestParser()
-todo_insert_parser.add_argument(
-    'name', help='name can not be blank', required=True
+todo_insert_parser = Schema(
+    Field('name', 'name can not be blank', required=True),
+    Field('is_done', 'is_done should be boolean(true/false)',
+          type=valid_boolean),
+    Field('due_date', 'Due date should be %Y-%m-%d formatted',
+          type=valid_date),
 )
-todo_insert_parser.add_argument(
-    'is_done', help='is_done should be boolean(true/false)', required=False,
-    type=bool
+
+# update argument parser, name is not required
+todo_update_parser = Schema(
+    Field('name', 'name should be valid string'),
+    Field('is_done', 'is_done should be boolean(true/false)',
+          type=valid_boolean),
+    Field('due_date', 'due_date should be %Y-%m-%d formatted',
+          type=valid_date),
 )
-todo_insert_parser.add_argument(
-    'due_date', help='Due date should be %Y-%m-%d formatted', required=False,
-    type=valid_date
+
+# import line parser, timestamps of exported todos are kept
+todo_import_parser = Schema(
+    Field('name', 'name can not be blank', required=True),
+    Field('is_done', 'is_done should be boolean(true/false)',
+          type=valid_boolean),
+    Field('due_date', 'due_date should be %Y-%m-%d formatted',
+          type=valid_date),
+    Field('created_at', 'created_at should be ISO 8601 formatted',
+          type=valid_timestamp),
+    Field('completed_date', 'completed_date should be ISO 8601 formatted',
+          type=valid_timestamp),
 )
 
-# update argument parser, name is not required
-todo_update_parser = reqparse.RequestParser()
-todo_update_parser.add_argument(
-    'name', help='name should be valid string', required=False
+# list argument parser, enables keyset pagination when limit or cursor given
+todo_list_parser = Schema(
+    Field('limit', 'limit should be a positive integer', type=valid_limit),
+    Field('cursor', 'cursor should be a cursor returned by previous page',
+          type=valid_cursor),
+    Field('stream', 'stream should be boolean(true/false)',
+          type=valid_boolean, default=False),
+    Field('sort', 'sort should be one of created_at, -created_at, '
+          'due_date, -due_date',
+          choices=('created_at', '-created_at', 'due_date', '-due_date')),
+    Field('is_done', 'is_done should be boolean(true/false)',
+          type=valid_boolean),
+    Field('due_after', 'due_after should be %Y-%m-%d formatted',
+          type=valid_day),
+    Field('due_before', 'due_before should be %Y-%m-%d formatted',
+          type=valid_day),
+    Field('overdue', 'overdue should be boolean(true/false)',
+          type=valid_boolean, default=False),
+    Field('include_archived', 'include_archived should be boolean'
+          '(true/false)', type=valid_boolean, default=False),
+    location='args',
 )
-todo_update_parser.add_argument(
-    'is_done', help='is_done should be boolean(true/false)', required=False,
-    type=bool
+
+# search argument parser, results are ranked so pages are offset based
+todo_search_parser = Schema(
+    Field('q', 'q should contain at least one word', required=True,
+          type=valid_search_query),
+    Field('limit', 'limit should be a positive integer', type=valid_limit),
+    Field('cursor', 'cursor should be a cursor returned by previous page',
+          type=valid_offset_cursor, default=0),
+    location='args',
 )
-todo_update_parser.add_argument(
-    'due_date', help='due_date should be %Y-%m-%d formatted', required=False,
-    type=valid_date
+
+# change feed argument parser, since is the last seq seen by the client
+todo_changes_parser = Schema(
+    Field('since', 'since should be a seq returned by previous changes',
+          type=valid_seq, default=0),
+    Field('limit', 'limit should be a positive integer', type=valid_limit),
+    Field('stream', 'stream should be boolean(true/false)',
+          type=valid_boolean, default=False),
+    location='args',
 )
@@ -0,0 +1,110 @@
+"""Password hashing and verification off the request workers"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingBusy(Exception):
+    """No hashing slot freed up within PASSWORD_HASH_QUEUE_TIMEOUT"""
+
+
+class PasswordHasher:
+    """
+    Runs the deliberately slow password hashes on a per process pool of
+    PASSWORD_HASH_WORKERS processes (inline if 0), with at most
+    PASSWORD_HASH_CONCURRENCY hashes in flight so a login burst can not
+    take every thread of a gunicorn worker; the limits are per worker, the
+    whole app runs GUNICORN_WORKERS times as many. Hashes use
+    PASSWORD_HASH_METHOD, hashes made with other parameters are reported
+    by needs_rehash.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.slots = None
+        self.pid = None
+
+    def shutdown(self):
+        """Stops the process pool, next hash starts a new one"""
+        with self.lock:
+            if self.executor is not None and self.pid == os.getpid():
+                self.executor.shutdown()
+            self.executor = self.slots = self.pid = None
+
+    def _setup(self):
+        """Creates the pool and slots, again after a fork"""
+        config = current_app.config
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.slots = threading.BoundedSemaphore(
+                config['PASSWORD_HASH_CONCURRENCY'])
+            self.executor = ProcessPoolExecutor(
+                config['PASSWORD_HASH_WORKERS']
+            ) if config['PASSWORD_HASH_WORKERS'] else None
+            self.pid = os.getpid()
+
+    def _run(self, func, *args, timeout=None):
+        if self.pid != os.getpid():
+            self._setup()
+        if timeout is None:
+            timeout = current_app.config['PASSWORD_HASH_QUEUE_TIMEOUT']
+        if not self.slots.acquire(timeout=timeout):
+            raise HashingBusy()
+        try:
+            if self.executor is None:
+                return func(*args)
+            return self.executor.submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password, timeout=None):
+        """
+        Hashes given clear text password with PASSWORD_HASH_METHOD
+
+        Args:
+             password(str): clear text password
+             timeout(float): seconds to wait for a hashing slot, defaults
+                to PASSWORD_HASH_QUEUE_TIMEOUT
+        Returns:
+            (str): hashed password
+        Raises:
+            HashingBusy: if too many hashes are in flight
+        """
+        return self._run(generate_password_hash, password,
+                         current_app.config['PASSWORD_HASH_METHOD'],
+                         timeout=timeout)
+
+    def verify(self, password, hashed_password):
+        """
+        Verifies if given hashed & clear text passwords matches
+
+        Args:
+             password(str): clear text password
+             hashed_password(str): hashed password
+        Returns:
+            bool: True if passwords matches else False
+        Raises:
+            HashingBusy: if too many hashes are in flight
+        """
+        return self._run(check_password_hash, hashed_password, password)
+
+    @staticmethod
+    def needs_rehash(hashed_password):
+        """
+        Checks if given hash was made with other than PASSWORD_HASH_METHOD
+
+        Args:
+             hashed_password(str): hashed password
+        Returns:
+            bool: True if the password should be hashed again
+        """
+        method = hashed_password.split('$', 1)[0]
+        return method != current_app.config['PASSWORD_HASH_METHOD']
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,102 @@
+"""
+Periodic maintenance in each worker process: deletion of expired revoked
+tokens, compaction of the todo change log and archival of completed todos
+"""
+
+import os
+import threading
+from db import db
+
+
+class PeriodicTask:
+    """
+    Daemon thread calling a maintenance function every `interval` config
+    seconds. It is started by the first request so every forked worker
+    runs its own thread.
+
+    Args:
+        name(str): thread name
+        interval(str): config key of the seconds between two runs
+        task(function): called with the app config in an app context
+    """
+
+    def __init__(self, name, interval, task):
+        self.name = name
+        self.interval = interval
+        self.task = task
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    def start(self, app):
+        """Starts the thread of this process for given app, once"""
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.stopped.clear()
+            self.thread = threading.Thread(
+                target=self.run, args=(app,), name=self.name, daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def stop(self):
+        """Stops the thread after its current run"""
+        with self.lock:
+            self.stopped.set()
+            if self.thread is not None and self.pid == os.getpid():
+                self.thread.join()
+            self.thread = self.pid = None
+
+    def run(self, app):
+        config = app.config
+        while not self.stopped.wait(config[self.interval]):
+            with app.app_context():
+                try:
+                    self.task(config)
+                except Exception:
+                    app.logger.exception('%s failed', self.name)
+                finally:
+                    db.session.remove()
+
+
+def prune_revoked_tokens(config):
+    from app.models import RevokedTokenModel
+    RevokedTokenModel.prune(config['REVOKED_TOKEN_PRUNE_BATCH_SIZE'],
+                            config['REVOKED_TOKEN_PRUNE_PAUSE'])
+
+
+def compact_todo_changes(config):
+    from app.models import TodoChange
+    TodoChange.compact(config['TODO_CHANGES_RETENTION'],
+                       config['TODO_CHANGES_COMPACT_BATCH_SIZE'],
+                       config['TODO_CHANGES_COMPACT_PAUSE'])
+
+
+def archive_todos(config):
+    from app.models import ArchivedTodo
+    ArchivedTodo.archive(config['TODO_ARCHIVE_AGE'],
+                         config['TODO_ARCHIVE_BATCH_SIZE'],
+                         config['TODO_ARCHIVE_PAUSE'])
+
+
+pruner = PeriodicTask('revoked-token-pruner', 'REVOKED_TOKEN_PRUNE_INTERVAL',
+                      prune_revoked_tokens)
+compactor = PeriodicTask('todo-change-compactor',
+                         'TODO_CHANGES_COMPACT_INTERVAL', compact_todo_changes)
+archiver = PeriodicTask('todo-archiver', 'TODO_ARCHIVE_INTERVAL',
+                        archive_todos)
+
+
+def init_app(app):
+    """
+    Starts the periodic tasks with the first request of given app, each
+    one only if its interval is set (REVOKED_TOKEN_PRUNE_INTERVAL,
+    TODO_CHANGES_COMPACT_INTERVAL, TODO_ARCHIVE_INTERVAL)
+
+    Args:
+        app(Flask): flask app
+    """
+    for task in (pruner, compactor, archiver):
+        if app.config[task.interval]:
+            app.before_first_request(lambda task=task: task.start(app))
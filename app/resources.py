@@ -1,8 +1,24 @@
+import json
+import time
+import zlib
+from datetime import date
 import flask_jwt_extended as fjwte
-from datetime import datetime
-from flask_restful import Resource, fields, marshal_with, abort
-from app import parsers
-from app.models import User, RevokedTokenModel, Todo
+from flask import Response, current_app, request, stream_with_context
+from flask_restful import Resource, fields, abort
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import quote_etag
+from app import parsers, transfer
+from app.serializers import Serializer, serialize_with
+from app.models import User, RevokedTokenModel, Todo, ArchivedTodo, \
+    TodoChange, TodoStats, revoked_tokens, todo_change_notifier
+from app.passwords import HashingBusy
+from db import db
+
+
+def hashing_busy():
+    """Returns 503 response for requests waiting too long on a hash slot"""
+    return {'message': 'Too many logins in progress, retry later'}, 503, \
+        {'Retry-After': str(current_app.config['PASSWORD_HASH_RETRY_AFTER'])}
 
 
 class UserRegistration(Resource):
@@ -23,12 +39,14 @@ class UserRegistration(Resource):
                 'message': 'User %s already exists' % data['username']},\
                    409
 
-        new_user = User(username=data['username'],
-                        password=User.generate_password_hash(data['password'])
-                        )
+        try:
+            password = User.generate_password_hash(data['password'])
+        except HashingBusy:
+            return hashing_busy()
+        new_user = User(username=data['username'], password=password)
         new_user.save()
-        access_token = fjwte.create_access_token(identity=data['username'])
-        refresh_token = fjwte.create_refresh_token(identity=data['username'])
+        access_token = fjwte.create_access_token(identity=new_user)
+        refresh_token = fjwte.create_refresh_token(identity=new_user)
         return {
             'message': 'User %s is created' % data['username'],
             'access_token': access_token,
@@ -65,11 +83,16 @@ class UserLogin(Resource):
             return {
                 'message': 'User %s doesn\'t exist' % data['username']}
 
-        if User.verify_password(data['password'], current_user.password):
-            access_token = fjwte.create_access_token(identity=data['username'])
-            refresh_token = fjwte.create_refresh_token(
-                identity=data['username']
-            )
+        try:
+            verified = User.verify_password(data['password'],
+                                            current_user.password)
+        except HashingBusy:
+            return hashing_busy()
+
+        if verified:
+            current_user.rehash_password(data['password'])
+            access_token = fjwte.create_access_token(identity=current_user)
+            refresh_token = fjwte.create_refresh_token(identity=current_user)
             return {
                 'message': 'Logged in as %s' % current_user.username,
                 'access_token': access_token,
@@ -87,9 +110,9 @@ class UserLogoutAccess(Resource):
     """
     @fjwte.jwt_required
     def post(self):
-        jti = fjwte.get_raw_jwt()['jti']
-        revoked_token = RevokedTokenModel(jti=jti)
+        revoked_token = RevokedTokenModel.from_token(fjwte.get_raw_jwt())
         revoked_token.save()
+        revoked_tokens.add(revoked_token.jti)
         return {'message': 'Access token has been revoked'}
 
 
@@ -101,12 +124,27 @@ class UserLogoutRefresh(Resource):
     """
     @fjwte.jwt_refresh_token_required
     def post(self):
-        jti = fjwte.get_raw_jwt()['jti']
-        revoked_token = RevokedTokenModel(jti=jti)
+        revoked_token = RevokedTokenModel.from_token(fjwte.get_raw_jwt())
         revoked_token.save()
+        revoked_tokens.add(revoked_token.jti)
         return {'message': 'Refresh token has been revoked'}
 
 
+class UserLogoutAll(Resource):
+    """
+    User Logout class for all tokens
+    Logs out attached user everywhere
+    Revokes every access and refresh token issued to the user
+    """
+    @fjwte.jwt_required
+    def post(self):
+        revoked_token = RevokedTokenModel.from_token(fjwte.get_raw_jwt())
+        revoked_token.save()
+        revoked_tokens.add(revoked_token.jti)
+        User.bump_token_generation(fjwte.get_jwt_identity())
+        return {'message': 'All tokens have been revoked'}
+
+
 class TokenRefresh(Resource):
     """
     Creates new access_token for user with given refresh_token
@@ -114,7 +152,7 @@ class TokenRefresh(Resource):
     """
     @fjwte.jwt_refresh_token_required
     def post(self):
-        current_user = fjwte.get_jwt_identity()
+        current_user = User.find_by_username(fjwte.get_jwt_identity())
         access_token = fjwte.create_access_token(identity=current_user)
         return {'access_token': access_token}
 
@@ -127,6 +165,131 @@ todo_fields = {  # marshall object, will be used for all Todo objects
     'due_date': fields.DateTime(dt_format='iso8601'),
     'completed_date': fields.DateTime(dt_format='iso8601'),
 }
+todo_serializer = Serializer(todo_fields)
+# columns read by todo_serializer, list endpoints select only these
+todo_columns = todo_serializer.columns(Todo)
+
+
+def todo_replica(user_id, version):
+    """
+    Picks a replica which has all todo writes of given user, so the user
+    reads their own writes
+
+    Args:
+        user_id(int): logged_in user id
+        version(int): user's todo_version on the primary
+    Returns:
+        (Engine): replica engine, None to read the primary
+    """
+    replica = db.pick_replica()
+    if replica is None:
+        return None
+    with db.reading(replica):
+        caught_up = (User.get_todo_version(user_id) or 0) >= version
+    return replica if caught_up else None
+
+
+def read_through(replica, items):
+    """Iterates given lazy query reading given replica"""
+    with db.reading(replica):
+        yield from items
+
+
+def serialize_changes(rows):
+    """
+    Serializes TodoChange.get_since rows, keeping the latest change of
+    each todo since they all carry its current state
+
+    Args:
+        rows(list): seq ordered change rows
+    Returns:
+        (list): seq, op, todo id and todo (None once deleted) per change
+    """
+    latest = {}
+    for row in rows:
+        latest.pop(row.todo_id, None)
+        latest[row.todo_id] = row
+    return [{
+        'seq': row.seq, 'op': row.op, 'id': row.todo_id,
+        'todo': todo_serializer(row) if row.id is not None else None,
+    } for row in latest.values()]
+
+
+def stream_changes(user_id, since, limit):
+    """
+    Streams given user's changes after given seq as server-sent events,
+    waking up on commits of this process and polling every
+    TODO_CHANGES_POLL_INTERVAL seconds for the others, until
+    TODO_CHANGES_STREAM_TIMEOUT; no db connection is held while waiting
+
+    Args:
+        user_id(int): logged_in user id
+        since(int): last seq seen by the client
+        limit(int): changes fetched per query
+    Returns:
+        (generator): text/event-stream chunks
+    """
+    config = current_app.config
+    deadline = time.monotonic() + config['TODO_CHANGES_STREAM_TIMEOUT']
+    yield 'retry: %d\n\n' % (config['TODO_CHANGES_POLL_INTERVAL'] * 1000)
+    while True:
+        version = todo_change_notifier.version(user_id)
+        rows = TodoChange.get_since(user_id, since, limit, todo_columns)
+        db.session.close()
+        if rows:
+            since = rows[-1].seq
+            yield ''.join('id: %s\nevent: change\ndata: %s\n\n' % (
+                change['seq'], json.dumps(change))
+                for change in serialize_changes(rows))
+            if len(rows) == limit:
+                continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if not todo_change_notifier.wait(
+                user_id, version,
+                min(remaining, config['TODO_CHANGES_POLL_INTERVAL'])):
+            yield ': keepalive\n\n'
+
+
+def not_modified(etag):
+    """
+    Answers conditional GET requests
+
+    Args:
+        etag(str): weak etag of the current representation
+    Returns:
+        (Response): 304 Not Modified if If-None-Match header matches
+            given etag, None otherwise
+    """
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag, weak=True)
+        return resp
+    return None
+
+
+def stream_json_array(items, serializer, batch_size):
+    """
+    Serializes given items as a json array chunk by chunk
+
+    Args:
+        items(iterator): objects to serialize
+        serializer(Serializer): serializer of the objects
+        batch_size(int): number of items per yielded chunk
+    Returns:
+        (generator): json text chunks
+    """
+    separator = '['
+    chunk = []
+    for item in items:
+        chunk.append(separator + json.dumps(serializer(item)))
+        separator = ','
+        if len(chunk) >= batch_size:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']' if separator == ',' else '[]')
+    yield ''.join(chunk)
 
 
 class TodoResource(Resource):
@@ -139,34 +302,46 @@ class TodoResource(Resource):
         self.reqparse = parsers.todo_update_parser
         super(TodoResource, self).__init__()
 
-    decorators = [fjwte.jwt_required, marshal_with(todo_fields)]
+    decorators = [fjwte.jwt_required]
 
     @staticmethod
-    def get_todo_by_user_id(todo_id):
+    def get_todo_by_user_id(todo_id, archived=False):
         """
         Filters given todo id and user id
 
         Args:
             todo_id(int): todo object id
+            archived(bool): look in the archived todos if not found
         Returns:
             object(todo): filtered todo object
         """
         current_user = fjwte.get_current_user()
         todo = Todo.get_item_by_user_id(todo_id, current_user.id)
+        if not todo and archived:
+            todo = ArchivedTodo.get_item_by_user_id(todo_id, current_user.id)
         if not todo:
             abort(404, message="Todo %s doesn't exist" % todo_id)
         return todo
 
+    @serialize_with(todo_serializer)
     def get(self, todo_id):
         """
-        Returns given Todo object
+        Returns given Todo object, archived or not, 304 if If-None-Match
+        header matches, read from a replica which has the user's writes
 
         Args:
             todo_id(int): todo object id
         Returns:
             object(todo)
         """
-        return self.get_todo_by_user_id(todo_id)
+        user_id = fjwte.get_current_user().id
+        with db.reading(todo_replica(user_id,
+                                     User.get_todo_version(user_id))):
+            todo = self.get_todo_by_user_id(todo_id, archived=True)
+        etag = '%s-%s' % (todo.id,
+                          (todo.updated_at or todo.created_at).isoformat())
+        return not_modified(etag) or (
+            todo, 200, {'ETag': quote_etag(etag, weak=True)})
 
     def delete(self, todo_id):
         """
@@ -179,6 +354,7 @@ class TodoResource(Resource):
         todo.delete()
         return '', 204
 
+    @serialize_with(todo_serializer)
     def put(self, todo_id):
         """
         Updates given Todo object
@@ -194,19 +370,13 @@ class TodoResource(Resource):
             object(todo)
         """
         todo = self.get_todo_by_user_id(todo_id)
-        data = self.reqparse.parse_args()
-        for key, value in data.items():
-            if value is not None:
-                setattr(todo, key, value)
-        # if is_done True set completed_date as now
-        if data.get('is_done'):
-            todo.completed_date = datetime.utcnow()
+        todo.apply(self.reqparse.parse_args())
         todo.save()
         return todo, 200
 
 
 class TodoListResource(Resource):
-    decorators = [fjwte.jwt_required, marshal_with(todo_fields)]
+    decorators = [fjwte.jwt_required]
 
     def __init__(self):
         self.reqparse = parsers.todo_insert_parser
@@ -214,14 +384,75 @@ class TodoListResource(Resource):
 
     def get(self):
         """
-        Returns given user's Todo objects
+        Returns given user's Todo objects, paginated if limit or cursor given
 
+        Params:
+            limit(int): page size
+            cursor(str): X-Next-Cursor header of previous page
+            stream(bool): stream the whole list with bounded memory
+            sort(str): created_at, due_date, prefixed with - for descending
+            is_done(bool): only done/not done todos
+            due_after(date): only todos due on or after this date
+            due_before(date): only todos due on or before this date
+            overdue(bool): only not done todos due before today
+            include_archived(bool): also list the archived todos
         Returns:
-            objects(list): Todo objects list
+            objects(list): Todo objects list, 304 if If-None-Match header
+                matches the user's todo version, without loading todos
         """
         current_user = fjwte.get_current_user()
-        return Todo.get_items_by_user_id(current_user.id)
+        args = parsers.todo_list_parser.parse_args()
+        version = User.get_todo_version(current_user.id)
+        etag = '%s-%s-%x' % (current_user.id, version,
+                             zlib.crc32(request.query_string))
+        if args['overdue']:
+            # todos become overdue without any write
+            etag += '-%s' % date.today().isoformat()
+        resp = not_modified(etag)
+        if resp:
+            return resp
+        headers = {'ETag': quote_etag(etag, weak=True)}
+        replica = todo_replica(current_user.id, version)
+        with db.reading(replica):
+            return self.list_todos(current_user, args, headers, replica)
 
+    @staticmethod
+    def list_todos(current_user, args, headers, replica):
+        """Returns the todo list response of given parsed arguments"""
+        filters = {key: args[key] for key in
+                   ('is_done', 'due_after', 'due_before', 'overdue',
+                    'include_archived')}
+        if args['limit'] is None and args['cursor'] is None:
+            batch_size = current_app.config['TODO_STREAM_BATCH_SIZE']
+            todos = Todo.iter_items_by_user_id(
+                current_user.id, batch_size, columns=todo_columns,
+                sort=args['sort'], **filters)
+            if args['stream']:
+                # the rows are fetched while streaming, after this returns
+                return Response(stream_with_context(stream_json_array(
+                    read_through(replica, todos), todo_serializer,
+                    batch_size
+                )), mimetype='application/json', headers=headers)
+            return todo_serializer.many(todos), 200, headers
+
+        sort, after = args['sort'] or 'created_at', None
+        if args['cursor'] is not None:
+            cursor_sort, after = args['cursor']
+            if cursor_sort != sort:
+                abort(400, message={'cursor': "cursor doesn't match sort"})
+        limit = min(args['limit'] or current_app.config['TODO_PAGE_SIZE'],
+                    current_app.config['TODO_PAGE_MAX_SIZE'])
+        # fetch one extra row to know if there is a next page
+        todos = Todo.get_page_by_user_id(current_user.id, limit + 1,
+                                         after=after, columns=todo_columns,
+                                         sort=sort, **filters)
+        if len(todos) > limit:
+            todos = todos[:limit]
+            headers['X-Next-Cursor'] = parsers.encode_cursor(
+                sort, getattr(todos[-1], sort.lstrip('-')), todos[-1].id)
+        return todo_serializer.many(todos), 200, headers
+
+    @serialize_with(todo_serializer)
     def post(self):
         """
         Creates Todo object
@@ -235,11 +466,265 @@ class TodoListResource(Resource):
         """
         data = self.reqparse.parse_args()
         new_todo = Todo(name=data['name'], user_id=fjwte.get_current_user().id)
-        for key, value in data.items():
-            if value is not None:
-                setattr(new_todo, key, value)
-        # if is_done True set completed_date as now
-        if data.get('is_done'):
-            new_todo.completed_date = datetime.utcnow()
+        new_todo.apply(data)
         new_todo.save()
         return new_todo, 201
+
+
+class TodoSearchResource(Resource):
+    """
+    Todo Search Resource class
+    Full text search over the names of the user's todos
+    """
+    decorators = [fjwte.jwt_required]
+
+    def get(self):
+        """
+        Returns given user's Todo objects whose name contains all words of
+        the query, best match first
+
+        Params:
+            q(str): search query
+            limit(int): page size
+            cursor(str): X-Next-Cursor header of previous page
+        Returns:
+            objects(list): Todo objects list
+        """
+        args = parsers.todo_search_parser.parse_args()
+        limit = min(args['limit'] or current_app.config['TODO_PAGE_SIZE'],
+                    current_app.config['TODO_PAGE_MAX_SIZE'])
+        # fetch one extra row to know if there is a next page
+        todos = Todo.search(fjwte.get_current_user().id, args['q'],
+                            limit + 1, offset=args['cursor'],
+                            columns=todo_columns)
+        headers = {}
+        if len(todos) > limit:
+            todos = todos[:limit]
+            headers['X-Next-Cursor'] = parsers.encode_offset_cursor(
+                args['cursor'] + limit)
+        return todo_serializer.many(todos), 200, headers
+
+
+class TodoChangesResource(Resource):
+    """
+    Todo Changes Resource class
+    Changes of the user's todos after a seq, as a json page or a
+    server-sent events stream
+    """
+    decorators = [fjwte.jwt_required]
+
+    def get(self):
+        """
+        Returns given user's todo changes after given seq, the latest one
+        per todo with the todo's current state; streamed as server-sent
+        events if stream given or text/event-stream accepted, resuming
+        after Last-Event-ID on reconnects
+
+        Params:
+            since(int): seq of the last change seen, 0 for all
+            limit(int): max number of changes of a page
+            stream(bool): stream the changes as they are committed
+        Returns:
+            seq(int): seq to pass as since next time
+            more(bool): more changes are waiting
+            changes(list): seq, op(create/update/delete), id and todo (None
+                once deleted) per changed todo
+            410 with the current seq if changes since given seq were
+                compacted, reload the list then follow the changes after
+                that seq
+            503 if TODO_CHANGES_MAX_STREAMS streams are already open
+        """
+        args = parsers.todo_changes_parser.parse_args()
+        user_id = fjwte.get_current_user().id
+        since = args['since']
+        stream = args['stream'] or \
+            request.accept_mimetypes.best == 'text/event-stream'
+        if stream and request.headers.get('Last-Event-ID', '').isdigit():
+            since = int(request.headers['Last-Event-ID'])
+        horizon = User.get_change_horizon(user_id)
+        if since < horizon:
+            # the latest change may be a compacted deletion
+            return {'message': 'Changes since %s are compacted, reload '
+                               'the todos' % since,
+                    'seq': max(TodoChange.last_seq(user_id), horizon)}, 410
+        page_size = current_app.config['TODO_CHANGES_PAGE_SIZE']
+        limit = min(args['limit'] or page_size, page_size)
+        if stream:
+            config = current_app.config
+            if not todo_change_notifier.open_stream(
+                    config['TODO_CHANGES_MAX_STREAMS']):
+                return {'message': 'Too many change streams, poll the '
+                                   'changes or retry later'}, 503, \
+                    {'Retry-After': str(config['TODO_CHANGES_POLL_INTERVAL'])}
+            resp = Response(stream_with_context(stream_changes(
+                user_id, since, limit)), mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache'})
+            resp.call_on_close(todo_change_notifier.close_stream)
+            return resp
+        # fetch one extra row to know if more changes are waiting
+        rows = TodoChange.get_since(user_id, since, limit + 1, todo_columns)
+        return {'seq': rows[limit - 1].seq if len(rows) > limit else (
+                    rows[-1].seq if rows else since),
+                'more': len(rows) > limit,
+                'changes': serialize_changes(rows[:limit])}
+
+
+class TodoExportResource(Resource):
+    """
+    Todo Export Resource class
+    Streams all todos of the user as newline delimited json
+    """
+    decorators = [fjwte.jwt_required]
+
+    def get(self):
+        """
+        Returns given user's Todo objects in id order, archived ones
+        included, one per line, memory use doesn't grow with the list size
+
+        Returns:
+            (Response): application/x-ndjson stream of Todo objects
+        """
+        return Response(stream_with_context(transfer.export_lines(
+            fjwte.get_current_user().id,
+            current_app.config['TODO_STREAM_BATCH_SIZE'], todo_serializer
+        )), mimetype='application/x-ndjson')
+
+
+class TodoImportResource(Resource):
+    """
+    Todo Import Resource class
+    Creates todos from a newline delimited json body, read line by line
+    """
+    decorators = [fjwte.jwt_required]
+
+    def post(self):
+        """
+        Creates a Todo object per line of the body, committing every
+        TODO_IMPORT_CHUNK_SIZE rows, invalid lines are reported and skipped
+
+        Params:
+            lines(NDJSON): objects with name, is_done, due_date and
+                created_at, completed_date timestamps (see GET /todos/export)
+        Returns:
+            lines(int): number of lines read
+            imported(int): number of todos created
+            failed(int): number of invalid lines
+            errors(list): line number and message of the first
+                TODO_IMPORT_MAX_ERRORS invalid lines
+        """
+        config = current_app.config
+        progress = None
+        for progress in transfer.import_lines(
+                fjwte.get_current_user().id, request.stream,
+                config['TODO_IMPORT_CHUNK_SIZE'],
+                config['TODO_IMPORT_MAX_ERRORS']):
+            current_app.logger.info('Imported %s todos from %s lines',
+                                    progress['imported'], progress['lines'])
+        return progress
+
+
+class TodoBatchResource(Resource):
+    """
+    Todo Batch Resource class
+    Applies many create, update and delete operations in one transaction
+    """
+    decorators = [fjwte.jwt_required]
+
+    @staticmethod
+    def get_todo_id(operation):
+        """Returns the id of given operation, None if it isn't valid"""
+        try:
+            return int(operation.get('id'))
+        except (TypeError, ValueError):
+            return None
+
+    def post(self):
+        """
+        Applies given operations, invalid operations are reported and
+        skipped, the valid ones are committed together
+
+        Params:
+            operations(list): objects with op(create/update/delete),
+                id(int) for update/delete and the todo fields for
+                create/update
+        Returns:
+            results(list): status and todo or message per operation
+        """
+        body = request.get_json(silent=True) or {}
+        operations = body.get('operations') if isinstance(body, dict) \
+            else None
+        if not isinstance(operations, list):
+            abort(400, message='operations should be a list')
+        max_operations = current_app.config['TODO_BATCH_MAX_OPERATIONS']
+        if len(operations) > max_operations:
+            abort(400, message='operations can not have more than %s items'
+                  % max_operations)
+
+        user_id = fjwte.get_current_user().id
+        todos = {todo.id: todo for todo in Todo.get_items_by_ids(
+            [self.get_todo_id(operation) for operation in operations
+             if isinstance(operation, dict)], user_id)}
+        added, deleted, results = [], [], []
+        for operation in operations:
+            if not isinstance(operation, dict):
+                operation = {}
+            op = operation.get('op')
+            if op not in ('create', 'update', 'delete'):
+                results.append({'status': 400, 'message':
+                                'op should be one of create, update, delete'})
+                continue
+            if op == 'create':
+                parser, todo = parsers.todo_insert_parser, Todo(
+                    user_id=user_id)
+            else:
+                todo_id = self.get_todo_id(operation)
+                if todo_id is None:
+                    results.append({'status': 400, 'message': {
+                        'id': 'id should be an integer'}})
+                    continue
+                todo = todos.get(todo_id)
+                if not todo:
+                    results.append({'status': 404, 'message':
+                                    "Todo %s doesn't exist" % todo_id})
+                    continue
+                parser = parsers.todo_update_parser
+            if op == 'delete':
+                deleted.append(todos.pop(todo.id))
+                results.append({'status': 204})
+                continue
+            try:
+                todo.apply(parsers.parse_item(parser, operation))
+            except HTTPException as e:
+                results.append({'status': 400,
+                                'message': e.data['message']})
+                continue
+            if op == 'create':
+                added.append(todo)
+            results.append({'status': 201 if op == 'create' else 200,
+                            'todo': todo})
+
+        Todo.flush_all(added, deleted)
+        # serialize before commit, it expires the flushed todos
+        for result in results:
+            if 'todo' in result:
+                result['todo'] = todo_serializer(result['todo'])
+        Todo.commit()
+        return {'results': results}
+
+
+class TodoStatsResource(Resource):
+    """
+    Todo Stats Resource class
+    Counts of the user's todos, read from the TodoStats counters
+    """
+    decorators = [fjwte.jwt_required]
+
+    def get(self):
+        """
+        Returns todo statistics of logged in user
+
+        Returns:
+            stats(dict): total, open, done, overdue counts and
+                completion_rate (done / total)
+        """
+        return TodoStats.get_by_user_id(fjwte.get_current_user().id)
@@ -0,0 +1,116 @@
+"""
+Synthetic data for query plan tests and benchmarks at scale: users, their
+todos and revoked tokens bulk loaded with executemany, see
+`flask generate-data`
+"""
+
+import random
+from datetime import datetime, timedelta
+from app.models import RevokedTokenModel, Todo, TodoStats, User
+from db import db
+
+WORDS = ('buy', 'milk', 'call', 'mom', 'pay', 'rent', 'fix', 'bike', 'read',
+         'book', 'walk', 'dog', 'clean', 'house', 'write', 'report', 'plan',
+         'trip', 'water', 'plants', 'email', 'boss', 'dentist')
+# todos are created over this period, the oldest first
+HISTORY = timedelta(days=730)
+
+
+def insert_chunks(table, rows, chunk_size):
+    """
+    Inserts given rows with one executemany and one transaction per chunk
+
+    Args:
+        table(Table): table
+        rows(iterator): dicts of column values
+        chunk_size(int): rows per transaction
+    Returns:
+        (int): number of inserted rows
+    """
+    inserted = 0
+    while True:
+        chunk = [row for _, row in zip(range(chunk_size), rows)]
+        if not chunk:
+            return inserted
+        db.session.execute(table.insert(), chunk)
+        db.session.commit()
+        inserted += len(chunk)
+
+
+def todo_rows(rng, user_ids, count, now):
+    """
+    Yields todos of given users. A few users own most todos (log-normal
+    weights), ids grow with created_at, older todos are more likely done,
+    half of them have a due date and some open ones are overdue.
+    """
+    weights = [rng.lognormvariate(0, 1.5) for _ in user_ids]
+    total, cum_weights = 0, []
+    for weight in weights:
+        total += weight
+        cum_weights.append(total)
+    # jitter within one spacing keeps created_at growing with the ids
+    spacing = HISTORY / count
+    for i in range(count):
+        created_at = now - HISTORY * (1 - i / count) - spacing * rng.random()
+        age_days = (now - created_at).days
+        is_done = rng.random() < (0.7 if age_days > 30 else 0.3)
+        completed_date = min(now, created_at + timedelta(
+            days=rng.expovariate(1 / 7))) if is_done else None
+        due_date = (created_at + timedelta(days=rng.randint(-3, 60))).date() \
+            if rng.random() < 0.5 else None
+        yield {
+            'user_id': rng.choices(user_ids, cum_weights=cum_weights)[0],
+            'name': ' '.join(rng.choice(WORDS)
+                             for _ in range(rng.randint(2, 5))),
+            'is_done': is_done,
+            'created_at': created_at,
+            'due_date': due_date,
+            'completed_date': completed_date,
+            'updated_at': completed_date or created_at,
+        }
+
+
+def revoked_token_rows(rng, count, now):
+    """Yields revoked tokens, mostly expired, a few never expiring"""
+    for _ in range(count):
+        expires_at = now + timedelta(days=rng.uniform(-30, 1)) \
+            if rng.random() < 0.95 else None
+        yield {'jti': '%032x' % rng.getrandbits(128),
+               'expires_at': expires_at}
+
+
+def generate(users, todos, revoked_tokens, password, seed=0,
+             chunk_size=50000):
+    """
+    Bulk loads users named user<n> sharing given password, todos spread
+    over them and revoked tokens, then rebuilds the TodoStats counters.
+    The same seed generates the same data. The rows are inserted without
+    the ORM, so they make no TodoChange.
+
+    Args:
+        users(int): number of users
+        todos(int): number of todos
+        revoked_tokens(int): number of revoked tokens
+        password(str): clear text password of every user
+        seed(int): random seed
+        chunk_size(int): rows inserted per transaction
+    Returns:
+        (dict): number of inserted users, todos and revoked tokens
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    first_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    hashed_password = User.generate_password_hash(password)
+    inserted = {'users': insert_chunks(User.__table__, (
+        {'username': 'user%s' % user_id, 'password': hashed_password}
+        for user_id in range(first_id, first_id + users)), chunk_size)}
+    user_ids = [user_id for user_id, in db.session.query(User.id).filter(
+        User.id >= first_id)]
+    inserted['todos'] = insert_chunks(
+        Todo.__table__, todo_rows(rng, user_ids, todos, now), chunk_size) \
+        if user_ids else 0
+    inserted['revoked_tokens'] = insert_chunks(
+        RevokedTokenModel.__table__,
+        revoked_token_rows(rng, revoked_tokens, now), chunk_size)
+    TodoStats.rebuild()
+    return inserted
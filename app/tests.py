@@ -1,7 +1,10 @@
 import os
+import shutil
+import sqlite3
 import unittest
 import json
 from db import db
+from app.cache import BloomFilter
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -15,6 +18,10 @@ class TodoTestCase(unittest.TestCase):
         import todo
         self.app = todo.app
         self.db = db
+        self.revoked_tokens = todo.models.revoked_tokens
+        self.revoked_tokens.clear()
+        self.user_cache = todo.models.user_cache
+        self.user_cache.clear()
         self.client = self.app.test_client()
         self.todo_item = {'name': 'test todo item'}
 
@@ -60,6 +67,67 @@ class TodoTestCase(unittest.TestCase):
         json_resp = json.loads(resp.data)
         self.assertEqual('User test is created', json_resp['message'])
 
+    def test_login_rehashes_outdated_password(self):
+        from app.models import User
+        with self.app.app_context():
+            old_hash = User.find_by_username('main_test_username').password
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        try:
+            resp = self.login('main_test_username', 'main_test_password')
+            self.assertEqual(resp.status_code, 200)
+            with self.app.app_context():
+                new_hash = User.find_by_username('main_test_username').password
+            self.assertNotEqual(old_hash, new_hash)
+            self.assertTrue(new_hash.startswith('pbkdf2:sha256:2000$'))
+            resp = self.login('main_test_username', 'main_test_password')
+            self.assertEqual(resp.status_code, 200)
+        finally:
+            self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+
+    def test_rehash_skipped_when_hashing_busy(self):
+        from app.models import User
+        from app.passwords import password_hasher
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        try:
+            with self.app.app_context():
+                user = User.find_by_username('main_test_username')
+                old_hash = user.password
+                password_hasher.hash('warm up')
+                for _ in range(self.app.config['PASSWORD_HASH_CONCURRENCY']):
+                    password_hasher.slots.acquire()
+                try:
+                    user.rehash_password('main_test_password')
+                finally:
+                    for _ in range(
+                            self.app.config['PASSWORD_HASH_CONCURRENCY']):
+                        password_hasher.slots.release()
+                self.assertEqual(old_hash, user.password)
+        finally:
+            self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+
+    def test_password_hashing_pool(self):
+        from app.passwords import password_hasher
+        config = self.app.config
+        config.update(PASSWORD_HASH_WORKERS=1)
+        password_hasher.shutdown()
+        try:
+            with self.app.app_context():
+                hashed = password_hasher.hash('secret')
+                self.assertTrue(password_hasher.verify('secret', hashed))
+                self.assertFalse(password_hasher.verify('other', hashed))
+            # no free hashing slot, login is shed with 503
+            config.update(PASSWORD_HASH_CONCURRENCY=0,
+                          PASSWORD_HASH_QUEUE_TIMEOUT=0)
+            password_hasher.shutdown()
+            resp = self.login('main_test_username', 'main_test_password')
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual('1', resp.headers['Retry-After'])
+        finally:
+            config.update(PASSWORD_HASH_WORKERS=0,
+                          PASSWORD_HASH_CONCURRENCY=4,
+                          PASSWORD_HASH_QUEUE_TIMEOUT=5)
+            password_hasher.shutdown()
+
     def test_create_todo(self):
         """Test API can create a todo (POST request)"""
         resp = self.client.post('/todos', data=self.todo_item)
@@ -80,6 +148,128 @@ class TodoTestCase(unittest.TestCase):
             self.assertIn(k['name'], (self.todo_item['name'],
                                       todo_item_2['name']))
 
+    def test_get_todos_paginated(self):
+        created_ids = []
+        for i in range(5):
+            resp = self.client.post('/todos', data={'name': 'item %s' % i})
+            created_ids.append(json.loads(resp.data)['id'])
+        ids, cursor, pages = [], None, 0
+        while True:
+            query = {'limit': 2}
+            if cursor:
+                query['cursor'] = cursor
+            resp = self.client.get('/todos', query_string=query)
+            self.assertEqual(resp.status_code, 200)
+            ids.extend(todo['id'] for todo in json.loads(resp.data))
+            pages += 1
+            cursor = resp.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+        self.assertEqual(3, pages)
+        self.assertEqual(created_ids, ids)
+
+        resp = self.client.get('/todos', query_string={'cursor': 'invalid'})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get('/todos', query_string={'limit': 0})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_get_todos_streamed(self):
+        resp = self.client.get('/todos', query_string={'stream': 'true'})
+        self.assertEqual([], json.loads(resp.data))
+        for i in range(3):
+            self.client.post('/todos', data={'name': 'item %s' % i,
+                                             'due_date': '2019-02-20'})
+        resp = self.client.get('/todos', query_string={'stream': 'true'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual('application/json', resp.mimetype)
+        self.assertEqual(json.loads(self.client.get('/todos').data),
+                         json.loads(resp.data))
+
+    def test_get_todos_filtered_and_sorted(self):
+        items = [('a', '2019-02-20', False), ('b', None, False),
+                 ('c', '2019-02-10', True), ('d', '2999-01-01', False),
+                 ('e', None, True)]
+        for name, due_date, is_done in items:
+            data = {'name': name}
+            if due_date:
+                data['due_date'] = due_date
+            if is_done:
+                data['is_done'] = True
+            self.client.post('/todos', data=data)
+
+        def names(**query):
+            resp = self.client.get('/todos', query_string=query)
+            self.assertEqual(resp.status_code, 200)
+            return [todo['name'] for todo in json.loads(resp.data)]
+
+        self.assertEqual(['a', 'b', 'd'], names(is_done='false'))
+        self.assertEqual(['c', 'e'], names(is_done='true'))
+        self.assertEqual(['a'], names(overdue='true'))
+        self.assertEqual(['a', 'c'], names(due_after='2019-02-10',
+                                           due_before='2019-02-20'))
+        self.assertEqual(['b', 'e', 'c', 'a', 'd'], names(sort='due_date'))
+        self.assertEqual(['d', 'a', 'c', 'e', 'b'], names(sort='-due_date'))
+        self.assertEqual(['e', 'd', 'c', 'b', 'a'], names(sort='-created_at'))
+        # keyset pagination follows the sort, nulls included
+        for sort in ('due_date', '-due_date', '-created_at'):
+            paged, cursor = [], None
+            while True:
+                query = {'limit': 2, 'sort': sort}
+                if cursor:
+                    query['cursor'] = cursor
+                resp = self.client.get('/todos', query_string=query)
+                paged.extend(todo['name'] for todo in json.loads(resp.data))
+                cursor = resp.headers.get('X-Next-Cursor')
+                if not cursor:
+                    break
+            self.assertEqual(names(sort=sort), paged)
+        resp = self.client.get('/todos', query_string={'cursor': cursor_for(
+            self.client, 'due_date')})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get('/todos', query_string={'sort': 'name'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_todo_filters_use_indexes(self):
+        from datetime import date
+        from app.models import Todo
+        # is_done filters have an index per sort, sqlite would pick either
+        # (by creation order) without one
+        expected = [
+            ({'is_done': False}, 'due_date',
+             'ix_todo_user_id_is_done_due_date'),
+            ({'is_done': False}, 'created_at',
+             'ix_todo_user_id_is_done_created_at_id'),
+            ({'overdue': True}, 'due_date',
+             'ix_todo_user_id_is_done_due_date'),
+            ({'overdue': True}, '-created_at',
+             'ix_todo_user_id_is_done_created_at_id'),
+            ({'due_after': date(2019, 1, 1)}, None,
+             'ix_todo_user_id_due_date'),
+            ({'due_before': date(2019, 1, 1)}, None,
+             'ix_todo_user_id_due_date'),
+        ]
+        with self.app.app_context():
+            for filters, sort, index in expected:
+                query = Todo.filter_by_user_id(1, **filters)
+                if sort is not None:
+                    query = Todo.order_query(query, sort)
+                plan = query_plan(query)
+                self.assertIn('USING INDEX %s' % index, plan)
+                self.assertNotIn('SCAN', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+            query = Todo.order_query(Todo.filter_by_user_id(1), '-due_date')
+            plan = query_plan(query)
+            self.assertIn('USING INDEX ix_todo_user_id_due_date', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+            # both sides of the union are merged in index order
+            source = Todo.including_archived(1)
+            query = Todo.order_query(Todo.filter_by_user_id(
+                1, source=source), 'created_at', source=source)
+            plan = query_plan(query)
+            self.assertIn('USING INDEX ix_todo_archive_user_id_created_at_id',
+                          plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
     def test_get_todo_by_id(self):
         """Test API can get a single todo by using it's id."""
         resp = self.client.post('/todos', data=self.todo_item)
@@ -115,6 +305,151 @@ class TodoTestCase(unittest.TestCase):
         resp = self.client.get('/todos/%s' % todo_id)
         self.assertEqual(resp.status_code, 404)
 
+    def test_batch_operations(self):
+        resp = self.client.post('/todos', data=self.todo_item)
+        first_id = json.loads(resp.data)['id']
+        resp = self.client.post('/todos', data=self.todo_item)
+        second_id = json.loads(resp.data)['id']
+        operations = [
+            {'op': 'create', 'name': 'batch item', 'due_date': '2019-02-20'},
+            {'op': 'update', 'id': first_id, 'is_done': True},
+            {'op': 'delete', 'id': second_id},
+            {'op': 'create'},
+            {'op': 'update', 'id': 12345, 'name': 'missing'},
+            {'op': 'rename'},
+            {'op': 'delete', 'id': 'abc'},
+            {'op': 'update', 'name': 'no id'},
+        ]
+        resp = self.client.post('/todos/batch',
+                                json={'operations': operations})
+        self.assertEqual(resp.status_code, 200)
+        results = json.loads(resp.data)['results']
+        self.assertEqual([201, 200, 204, 400, 404, 400, 400, 400],
+                         [result['status'] for result in results])
+        self.assertEqual('batch item', results[0]['todo']['name'])
+        self.assertTrue(results[1]['todo']['is_done'])
+        self.assertEqual({'name': 'name can not be blank'},
+                         results[3]['message'])
+        self.assertEqual("Todo 12345 doesn't exist", results[4]['message'])
+        for result in results[6:]:
+            self.assertEqual({'id': 'id should be an integer'},
+                             result['message'])
+
+        todos = json.loads(self.client.get('/todos').data)
+        self.assertEqual([first_id, results[0]['todo']['id']],
+                         [todo['id'] for todo in todos])
+        self.assertIsNotNone(todos[0]['completed_date'])
+
+        resp = self.client.post('/todos/batch', json={'operations': 'x'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_todo_arguments(self):
+        resp = self.client.post('/todos', data={'name': 'form',
+                                                'is_done': 'false',
+                                                'due_date': '2019-02-20'})
+        self.assertEqual(resp.status_code, 201)
+        todo = json.loads(resp.data)
+        self.assertFalse(todo['is_done'])
+        self.assertIsNone(todo['completed_date'])
+        self.assertTrue(todo['due_date'].startswith('2019-02-20'))
+        resp = self.client.put('/todos/%s' % todo['id'],
+                               json={'is_done': True, 'due_date': '2019-3-1'})
+        todo = json.loads(resp.data)
+        self.assertTrue(todo['is_done'])
+        self.assertTrue(todo['due_date'].startswith('2019-03-01'))
+        # the json body wins over the query string
+        resp = self.client.post('/todos', query_string={'name': 'args'},
+                                json={'name': 'json', 'is_done': 'on'})
+        self.assertEqual('json', json.loads(resp.data)['name'])
+        self.assertTrue(json.loads(resp.data)['is_done'])
+        # json numbers 1 and 0 are booleans too
+        resp = self.client.put('/todos/%s' % todo['id'], json={'is_done': 0})
+        self.assertFalse(json.loads(resp.data)['is_done'])
+        resp = self.client.put('/todos/%s' % todo['id'], json={'is_done': 1})
+        self.assertTrue(json.loads(resp.data)['is_done'])
+
+        for data, message in (
+                ({}, {'name': 'name can not be blank'}),
+                ({'name': 'a', 'is_done': 'maybe'},
+                 {'is_done': 'is_done should be boolean(true/false)'}),
+                ({'name': 'a', 'is_done': 2},
+                 {'is_done': 'is_done should be boolean(true/false)'}),
+                ({'name': 'a', 'is_done': 1.0},
+                 {'is_done': 'is_done should be boolean(true/false)'}),
+                ({'name': 'a', 'due_date': '2019-02-30'},
+                 {'due_date': 'Due date should be %Y-%m-%d formatted'}),
+                ({'name': 'a', 'due_date': 20190220},
+                 {'due_date': 'Due date should be %Y-%m-%d formatted'})):
+            resp = self.client.post('/todos', json=data)
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual({'message': message}, json.loads(resp.data))
+        resp = self.client.post('/login', json={'username': 'x'})
+        self.assertEqual(
+            {'message': {'password': 'password can not be blank'}},
+            json.loads(resp.data))
+
+    def test_serializer_matches_marshal(self):
+        from flask_restful import marshal
+        from app.models import Todo
+        from app.resources import todo_fields, todo_serializer, todo_columns
+        self.client.post('/todos', data=self.todo_item)
+        self.client.post('/todos', data={'name': 'done', 'is_done': True,
+                                         'due_date': '2019-02-20'})
+        with self.app.app_context():
+            todos = Todo.query.all()
+            rows = Todo.get_items_by_user_id(todos[0].user_id,
+                                             columns=todo_columns)
+            expected = json.dumps(marshal(todos, todo_fields))
+            self.assertEqual(expected, json.dumps(todo_serializer.many(todos)))
+            self.assertEqual(expected, json.dumps(todo_serializer.many(rows)))
+
+    def test_get_todos_conditional(self):
+        resp = self.client.get('/todos')
+        etag = resp.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        resp = self.client.get('/todos', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(etag, resp.headers['ETag'])
+        # other query parameters, other representation
+        resp = self.client.get('/todos', query_string={'limit': 1},
+                               headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        # every write changes the etag
+        resp = self.client.post('/todos', data=self.todo_item)
+        todo_id = json.loads(resp.data)['id']
+        resp = self.client.get('/todos', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        etag = resp.headers['ETag']
+        self.client.put('/todos/%s' % todo_id, data={'name': 'renamed'})
+        resp = self.client.get('/todos', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_get_overdue_todos_conditional(self):
+        from datetime import date, timedelta
+        today = date.today().isoformat()
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+        query = {'overdue': 'true'}
+        etag = self.client.get('/todos', query_string=query).headers['ETag']
+        self.assertIn(today, etag)
+        resp = self.client.get('/todos', query_string=query,
+                               headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        # the list cached yesterday may miss todos which became overdue
+        resp = self.client.get('/todos', query_string=query, headers={
+            'If-None-Match': etag.replace(today, yesterday)})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_get_todo_conditional(self):
+        resp = self.client.post('/todos', data=self.todo_item)
+        url = '/todos/%s' % json.loads(resp.data)['id']
+        etag = self.client.get(url).headers['ETag']
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.client.put(url, data={'name': 'renamed'})
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(etag, resp.headers['ETag'])
+
     def test_another_users_todo_access(self):
         # create todo object with main_test_username
         resp = self.client.post('/todos', data=self.todo_item)
@@ -161,6 +496,844 @@ class TodoTestCase(unittest.TestCase):
         json_resp = json.loads(resp.data)
         self.assertEqual('Token has been revoked', json_resp['msg'])
 
+    def test_logout_all(self):
+        other = json.loads(self.login('main_test_username',
+                                      'main_test_password').data)
+        resp = self.client.post('/logout/all')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual('All tokens have been revoked',
+                         json.loads(resp.data)['message'])
+        # every token issued before is revoked, the access and refresh
+        # tokens of the other login included
+        for token in (self.access_token, other['access_token']):
+            resp = self.client.get('/todos', headers={
+                'Authorization': 'Bearer %s' % token})
+            self.assertEqual(resp.status_code, 401)
+            self.assertEqual('Token has been revoked',
+                             json.loads(resp.data)['msg'])
+        resp = self.client.post('/token/refresh', headers={
+            'Authorization': 'Bearer %s' % other['refresh_token']})
+        self.assertEqual(resp.status_code, 401)
+        # new logins get tokens of the new generation
+        token = json.loads(self.login('main_test_username',
+                                      'main_test_password').data)
+        resp = self.client.post('/token/refresh', headers={
+            'Authorization': 'Bearer %s' % token['refresh_token']})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.client.get('/todos', headers={
+            'Authorization': 'Bearer %s' % json.loads(
+                resp.data)['access_token']})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_token_generation_claim(self):
+        from flask_jwt_extended import decode_token
+        with self.app.app_context():
+            claims = decode_token(self.access_token)['user_claims']
+            refresh_claims = decode_token(self.refresh_token)['user_claims']
+        self.assertEqual({'generation': 0}, claims)
+        self.assertEqual({'generation': 0}, refresh_claims)
+
+    def test_token_generation_of_stale_cached_user(self):
+        from flask_jwt_extended import decode_token
+        self.client.get('/todos')
+        # another worker logged out everywhere, the cache of this one
+        # still has generation 0
+        with self.app.app_context():
+            db.session.execute('UPDATE user SET token_generation = 1')
+            db.session.commit()
+        data = json.loads(self.login('main_test_username',
+                                     'main_test_password').data)
+        with self.app.app_context():
+            claims = decode_token(data['access_token'])['user_claims']
+        self.assertEqual({'generation': 1}, claims)
+        resp = self.client.get('/todos', headers={
+            'Authorization': 'Bearer %s' % data['access_token']})
+        self.assertEqual(resp.status_code, 200)
+        # the new token reloaded the user, old tokens are revoked now
+        resp = self.client.get('/todos')
+        self.assertEqual(resp.status_code, 401)
+        resp = self.client.post('/token/refresh', headers={
+            'Authorization': 'Bearer %s' % data['refresh_token']})
+        with self.app.app_context():
+            claims = decode_token(json.loads(
+                resp.data)['access_token'])['user_claims']
+        self.assertEqual({'generation': 1}, claims)
+
+    def test_revoked_token_cache_skips_db(self):
+        # valid tokens are answered by the bloom filter without SQL
+        self.client.get('/todos')
+        self.client.get('/todos')
+        stats = self.revoked_tokens.stats()
+        self.assertEqual(2, stats['bloom_negative'])
+        self.assertEqual(0, stats['db_hit'] + stats['db_miss'])
+        # revoked token is served from the cache after logout
+        self.logout_access()
+        resp = self.client.get('/todos')
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(1, self.revoked_tokens.stats()['cache_hit'])
+
+    def test_revoked_token_cache_warms_from_db(self):
+        self.logout_access()
+        # drop in process state, revocation must be loaded from the db
+        self.revoked_tokens.clear()
+        resp = self.client.get('/todos')
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(1, self.revoked_tokens.stats()['db_hit'])
+
+    def test_revoked_token_cache_syncs_late_commits(self):
+        from app.models import RevokedTokenModel
+        self.add_revoked_tokens(first=60)
+        with self.app.app_context():
+            self.revoked_tokens.warm()
+            self.assertEqual({}, self.revoked_tokens.gaps)
+            # id 2 is allocated by a transaction committing after id 3
+            db.session.add(RevokedTokenModel(id=3, jti='early'))
+            db.session.commit()
+            self.revoked_tokens.sync()
+            self.assertEqual({2}, set(self.revoked_tokens.gaps))
+            db.session.add(RevokedTokenModel(id=2, jti='late'))
+            db.session.commit()
+            self.revoked_tokens.sync()
+            self.assertIn('late', self.revoked_tokens.bloom)
+            self.assertEqual({}, self.revoked_tokens.gaps)
+            # a rolled back id is given up after the timeout
+            db.session.add(RevokedTokenModel(id=5, jti='after gap'))
+            db.session.commit()
+            self.app.config.update(REVOKED_TOKEN_SYNC_GAP_TIMEOUT=0)
+            try:
+                self.revoked_tokens.sync()
+            finally:
+                self.app.config.update(REVOKED_TOKEN_SYNC_GAP_TIMEOUT=300)
+        self.assertEqual({}, self.revoked_tokens.gaps)
+        self.assertEqual(5, self.revoked_tokens.last_id)
+
+    def test_logout_stores_token_expiry(self):
+        from datetime import datetime
+        from flask_jwt_extended import decode_token
+        from app.models import RevokedTokenModel
+        self.logout_access()
+        with self.app.app_context():
+            exp = decode_token(self.access_token)['exp']
+            revoked = RevokedTokenModel.query.one()
+        self.assertEqual(datetime.utcfromtimestamp(exp), revoked.expires_at)
+
+    def add_revoked_tokens(self, **expires_in):
+        """Inserts revoked tokens expiring in given seconds, None never"""
+        from datetime import datetime, timedelta
+        from app.models import RevokedTokenModel
+        with self.app.app_context():
+            for jti, seconds in expires_in.items():
+                expires_at = None if seconds is None else \
+                    datetime.utcnow() + timedelta(seconds=seconds)
+                db.session.add(RevokedTokenModel(jti=jti,
+                                                 expires_at=expires_at))
+            db.session.commit()
+
+    def test_expired_revoked_tokens_are_ignored(self):
+        from app.models import RevokedTokenModel
+        self.add_revoked_tokens(expired=-1, valid=60, forever=None)
+        with self.app.app_context():
+            self.assertFalse(RevokedTokenModel.is_jti_blacklisted('expired'))
+            self.assertTrue(RevokedTokenModel.is_jti_blacklisted('valid'))
+            self.assertTrue(RevokedTokenModel.is_jti_blacklisted('forever'))
+            self.revoked_tokens.warm()
+        self.assertNotIn('expired', self.revoked_tokens.bloom)
+        self.assertIn('valid', self.revoked_tokens.bloom)
+
+    def test_prune_revoked_tokens(self):
+        from app.models import RevokedTokenModel
+        self.add_revoked_tokens(valid=60, forever=None, **{
+            'expired%s' % i: -1 for i in range(5)})
+        result = self.app.test_cli_runner().invoke(
+            args=['prune-revoked-tokens', '--batch-size', '2'])
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn('Deleted 5 expired revoked tokens', result.output)
+        with self.app.app_context():
+            self.assertEqual({'valid', 'forever'}, {
+                token.jti for token in RevokedTokenModel.query})
+
+    def test_revoked_token_pruner_thread(self):
+        import time
+        from app.models import RevokedTokenModel
+        from app.pruning import pruner
+        self.add_revoked_tokens(expired=-1, valid=60)
+        self.app.config['REVOKED_TOKEN_PRUNE_INTERVAL'] = 0.01
+        pruner.start(self.app)
+        try:
+            with self.app.app_context():
+                for _ in range(200):
+                    if RevokedTokenModel.query.count() == 1:
+                        break
+                    time.sleep(0.01)
+                self.assertEqual(['valid'], [
+                    token.jti for token in RevokedTokenModel.query])
+        finally:
+            pruner.stop()
+            self.app.config['REVOKED_TOKEN_PRUNE_INTERVAL'] = 0
+
+    def test_user_cache(self):
+        from app.models import User
+        with self.app.app_context():
+            cached = self.user_cache.get('main_test_username')
+            self.assertEqual('main_test_username', cached.username)
+            user = User.find_by_username('main_test_username')
+            self.assertEqual(user.id, cached.id)
+            # served from the cache while the db row changes elsewhere
+            User.query.filter_by(id=user.id).update({'username': 'renamed'})
+            self.assertIs(cached, self.user_cache.get('main_test_username'))
+            # changes through the ORM invalidate the cached record
+            user = User.find_by_username('renamed')
+            user.username = 'main_test_username'
+            user.save()
+            self.assertIsNot(cached, self.user_cache.get('main_test_username'))
+            self.assertIsNone(self.user_cache.get('unknown_username'))
+
+    def test_metrics(self):
+        self.client.get('/todos')
+        text = self.client.get('/metrics').data.decode()
+        self.assertIn('todo_http_requests_total{endpoint="todos",'
+                      'method="GET",status="200"}', text)
+        self.assertIn('todo_sql_statements_per_request_count'
+                      '{endpoint="todos"}', text)
+        self.assertIn('todo_phase_duration_seconds_count{endpoint="todos",'
+                      'phase="jwt"}', text)
+        self.assertIn('todo_phase_duration_seconds_count{endpoint="todos",'
+                      'phase="serialize"}', text)
+
+    def test_metrics_aggregate_workers(self):
+        import tempfile
+        from app import metrics
+        directory = tempfile.mkdtemp()
+        other_worker = {'counters': [['todo_http_requests_total', {
+            'endpoint': 'todos', 'method': 'GET', 'status': '200'}, 1000]],
+            'histograms': []}
+        with open(os.path.join(directory, '1.json'), 'w') as f:
+            json.dump(other_worker, f)
+        self.client.get('/todos')
+        key = ('todo_http_requests_total', (
+            ('endpoint', 'todos'), ('method', 'GET'), ('status', '200')))
+        with self.app.app_context():
+            counters, _ = metrics.collect(None)
+            own = counters[key]
+            counters, _ = metrics.collect(directory)
+        self.assertEqual(own + 1000, counters[key])
+
+    def assert_stats_consistent(self):
+        """
+        Compares the TodoStats counters with a GROUP BY over todos and
+        archived todos
+        """
+        from app.models import ArchivedTodo, Todo, TodoStats
+        expected = {}
+        with self.app.app_context():
+            for model in (Todo, ArchivedTodo):
+                done = db.func.sum(db.case(
+                    [(model.is_done == db.true(), 1)], else_=0))
+                for user_id, total, done in db.session.query(
+                        model.user_id, db.func.count(model.id),
+                        done).group_by(model.user_id):
+                    counts = expected.get(user_id, (0, 0))
+                    expected[user_id] = (counts[0] + total, counts[1] + done)
+            counters = {stats.user_id: (stats.total, stats.done)
+                        for stats in TodoStats.query
+                        if stats.total or stats.done}
+        self.assertEqual(expected, counters)
+
+    def test_todo_stats(self):
+        resp = self.client.get('/todos/stats')
+        self.assertEqual({'total': 0, 'open': 0, 'done': 0, 'overdue': 0,
+                          'completion_rate': 0.0}, json.loads(resp.data))
+        ids = [json.loads(self.client.post('/todos', data=dict(
+            name='stats %s' % i, due_date='2000-01-01')).data)['id']
+            for i in range(4)]
+        self.client.put('/todos/%s' % ids[0], data={'is_done': True})
+        self.client.put('/todos/%s' % ids[0], data={'name': 'renamed'})
+        self.client.delete('/todos/%s' % ids[1])
+        self.client.post('/todos/batch', json={'operations': [
+            {'op': 'create', 'name': 'batch', 'is_done': True},
+            {'op': 'update', 'id': ids[2], 'is_done': True},
+            {'op': 'delete', 'id': ids[3]},
+        ]})
+        resp = self.client.get('/todos/stats')
+        self.assertEqual({'total': 3, 'open': 0, 'done': 3, 'overdue': 0,
+                          'completion_rate': 1.0}, json.loads(resp.data))
+        self.client.post('/todos', data=dict(name='late',
+                                             due_date='2000-01-01'))
+        stats = json.loads(self.client.get('/todos/stats').data)
+        self.assertEqual((4, 1, 1, 0.75), (
+            stats['total'], stats['open'], stats['overdue'],
+            stats['completion_rate']))
+        self.assert_stats_consistent()
+
+    def test_todo_stats_upsert(self):
+        from app.models import TodoStats, User
+        self.register('other', 'other')
+        with self.app.app_context():
+            ids = [User.find_by_username(name).id
+                   for name in ('main_test_username', 'other')]
+            for deltas in ({ids[0]: (2, 1), ids[1]: (0, 0)},
+                           {ids[0]: (1, 0), ids[1]: (1, 1)}):
+                TodoStats.apply_deltas(db.session.connection(), deltas)
+            db.session.commit()
+            self.assertEqual([(ids[0], 3, 1), (ids[1], 1, 1)], [
+                (stats.user_id, stats.total, stats.done)
+                for stats in TodoStats.query.order_by(TodoStats.user_id)])
+
+    def test_rebuild_stats_command(self):
+        from app.models import Todo, TodoStats
+        for i in range(3):
+            self.client.post('/todos', data=dict(name='stats %s' % i))
+        with self.app.app_context():
+            # writes bypassing the ORM leave the counters stale
+            Todo.query.filter(Todo.name == 'stats 0').update(
+                {'is_done': True})
+            TodoStats.query.delete()
+            db.session.commit()
+        result = self.app.test_cli_runner().invoke(args=['rebuild-stats'])
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assert_stats_consistent()
+        stats = json.loads(self.client.get('/todos/stats').data)
+        self.assertEqual((3, 1), (stats['total'], stats['done']))
+
+    def test_export_import_todos(self):
+        self.client.post('/todos', data={'name': 'first milk',
+                                         'due_date': '2019-02-20'})
+        self.client.post('/todos', json={'name': 'second', 'is_done': True})
+        resp = self.client.get('/todos/export')
+        self.assertEqual('application/x-ndjson', resp.mimetype)
+        exported = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual(json.loads(self.client.get('/todos').data),
+                         exported)
+
+        self.register('other', 'password')
+        headers = {'Authorization': 'Bearer %s' % json.loads(
+            self.login('other', 'password').data)['access_token']}
+        etag = self.client.get('/todos', headers=headers).headers['ETag']
+        body = resp.data + b'\n[1]\n{"is_done": true}\n{"name": "third"}\n'
+        self.app.config.update(TODO_IMPORT_CHUNK_SIZE=2)
+        try:
+            resp = self.client.post('/todos/import', data=body,
+                                    content_type='application/x-ndjson',
+                                    headers=headers)
+        finally:
+            self.app.config.update(TODO_IMPORT_CHUNK_SIZE=1000)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual({'lines': 6, 'imported': 3, 'failed': 2, 'errors': [
+            {'line': 4, 'message': 'line should be a json object'},
+            {'line': 5, 'message': {'name': 'name can not be blank'}}]},
+            json.loads(resp.data))
+
+        resp = self.client.get('/todos', headers=headers)
+        self.assertNotEqual(etag, resp.headers['ETag'])
+        imported = json.loads(resp.data)
+        self.assertEqual(
+            [{key: todo[key] for key in todo if key != 'id'}
+             for todo in exported],
+            [{key: todo[key] for key in todo if key != 'id'}
+             for todo in imported[:2]])
+        self.assertEqual('third', imported[2]['name'])
+        self.assertFalse(imported[2]['is_done'])
+        stats = json.loads(self.client.get('/todos/stats',
+                                           headers=headers).data)
+        self.assertEqual((3, 1), (stats['total'], stats['done']))
+        self.assert_stats_consistent()
+        resp = self.client.get('/todos/search', query_string={'q': 'milk'},
+                               headers=headers)
+        self.assertEqual(['first milk'],
+                         [todo['name'] for todo in json.loads(resp.data)])
+        resp = self.client.get('/todos/changes', headers=headers)
+        self.assertEqual(
+            [('create', todo['id']) for todo in imported],
+            [(change['op'], change['id'])
+             for change in json.loads(resp.data)['changes']])
+
+    def test_export_import_todos_commands(self):
+        self.client.post('/todos', data={'name': 'first'})
+        self.client.post('/todos', data={'name': 'second', 'is_done': True})
+        self.register('other', 'password')
+        runner = self.app.test_cli_runner(mix_stderr=False)
+        result = runner.invoke(args=['export-todos', 'main_test_username'])
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertEqual(2, len(result.output.splitlines()))
+        result = runner.invoke(args=['import-todos', 'other',
+                                     '--chunk-size', '1'],
+                               input=result.output + 'invalid\n')
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertEqual('Imported 2 todos, skipped 1 invalid lines\n',
+                         result.output)
+        self.assertIn('Line 3: line should be a json object', result.stderr)
+        result = runner.invoke(args=['import-todos', 'missing'], input='')
+        self.assertEqual(2, result.exit_code)
+        self.assert_stats_consistent()
+        from app.models import Todo, User
+        with self.app.app_context():
+            other = User.find_by_username('other')
+            self.assertEqual(2, other.todo_version)
+            self.assertEqual(
+                ['first', 'second'],
+                [todo.name for todo in Todo.get_items_by_user_id(other.id)])
+
+    def changes(self, since=0, **query):
+        resp = self.client.get('/todos/changes',
+                               query_string=dict(query, since=since))
+        self.assertEqual(200, resp.status_code)
+        return json.loads(resp.data)
+
+    def test_todo_changes(self):
+        self.assertEqual({'seq': 0, 'more': False, 'changes': []},
+                         self.changes())
+        first, second = [json.loads(self.client.post(
+            '/todos', data={'name': name}).data) for name in ('a', 'b')]
+        page = self.changes()
+        self.assertEqual([('create', first['id'], first),
+                          ('create', second['id'], second)],
+                         [(change['op'], change['id'], change['todo'])
+                          for change in page['changes']])
+        seq = page['seq']
+        self.assertEqual(page['changes'][-1]['seq'], seq)
+        self.assertEqual({'seq': seq, 'more': False, 'changes': []},
+                         self.changes(seq))
+
+        self.client.put('/todos/%s' % first['id'], data={'name': 'a2'})
+        self.client.put('/todos/%s' % first['id'], data={'is_done': True})
+        resp = self.client.post('/todos/batch', json={'operations': [
+            {'op': 'create', 'name': 'c'}]})
+        third = json.loads(resp.data)['results'][0]['todo']
+        self.client.delete('/todos/%s' % second['id'])
+        page = self.changes(seq)
+        self.assertEqual([('update', first['id']), ('create', third['id']),
+                          ('delete', second['id'])],
+                         [(change['op'], change['id'])
+                          for change in page['changes']])
+        self.assertEqual(('a2', True), (page['changes'][0]['todo']['name'],
+                                        page['changes'][0]['todo']['is_done']))
+        self.assertIsNone(page['changes'][2]['todo'])
+
+        page = self.changes(seq, limit=2)
+        self.assertTrue(page['more'])
+        self.assertEqual([('update', first['id'])],
+                         [(change['op'], change['id'])
+                          for change in page['changes']])
+        self.assertEqual([('create', third['id']), ('delete', second['id'])],
+                         [(change['op'], change['id']) for change in
+                          self.changes(page['seq'])['changes']])
+        resp = self.client.get('/todos/changes', query_string={'since': -1})
+        self.assertEqual(400, resp.status_code)
+
+    def test_todo_changes_stream(self):
+        todo_id = json.loads(self.client.post(
+            '/todos', data={'name': 'a'}).data)['id']
+        self.client.put('/todos/%s' % todo_id, data={'name': 'b'})
+        self.app.config.update(TODO_CHANGES_STREAM_TIMEOUT=0)
+        try:
+            resp = self.client.get('/todos/changes',
+                                   headers={'Accept': 'text/event-stream'})
+            self.assertEqual('text/event-stream', resp.mimetype)
+            events = resp.data.decode().split('\n\n')
+            resp.close()
+            self.assertEqual('', events.pop())
+            self.assertEqual(['retry: 5000'], events[:1])
+            self.assertEqual(2, len(events))
+            seq, event, data = events[1].split('\n')
+            self.assertEqual('event: change', event)
+            change = json.loads(data[len('data: '):])
+            self.assertEqual('id: %s' % change['seq'], seq)
+            self.assertEqual(('update', 'b'),
+                             (change['op'], change['todo']['name']))
+            resp = self.client.get('/todos/changes', query_string={
+                'stream': 'true'}, headers={'Last-Event-ID': change['seq']})
+            self.assertEqual(b'retry: 5000\n\n', resp.data)
+            resp.close()
+        finally:
+            self.app.config.update(TODO_CHANGES_STREAM_TIMEOUT=300)
+
+    def test_todo_changes_stream_wakes_up_on_commit(self):
+        import threading
+        self.app.config.update(TODO_CHANGES_POLL_INTERVAL=30)
+        resp = self.client.get('/todos/changes',
+                               query_string={'stream': 'true'})
+        chunks = iter(resp.response)
+        self.assertEqual(b'retry: 30000\n\n', next(chunks))
+        writer = threading.Timer(0.1, self.client.post, args=('/todos',),
+                                 kwargs={'data': {'name': 'pushed'}})
+        writer.start()
+        try:
+            chunk = next(chunks)
+        finally:
+            writer.join()
+            resp.close()
+            self.app.config.update(TODO_CHANGES_POLL_INTERVAL=5)
+        change = json.loads(chunk.decode().split('data: ')[1])
+        self.assertEqual('pushed', change['todo']['name'])
+
+    def test_todo_changes_streams_capped(self):
+        from app.models import todo_change_notifier
+        self.app.config.update(TODO_CHANGES_MAX_STREAMS=1)
+        resp = self.client.get('/todos/changes', buffered=False,
+                               query_string={'stream': 'true'})
+        try:
+            self.assertEqual(200, resp.status_code)
+            busy = self.client.get('/todos/changes',
+                                   query_string={'stream': 'true'})
+            self.assertEqual(503, busy.status_code)
+            self.assertEqual('5', busy.headers['Retry-After'])
+            # the json changes are still served
+            self.assertEqual(200, self.client.get('/todos/changes')
+                             .status_code)
+        finally:
+            resp.close()
+        self.assertEqual(0, todo_change_notifier.streams)
+        # the slot of a closed stream is free again
+        self.app.config.update(TODO_CHANGES_STREAM_TIMEOUT=0)
+        try:
+            resp = self.client.get('/todos/changes',
+                                   query_string={'stream': 'true'})
+            self.assertEqual(b'retry: 5000\n\n', resp.data)
+            resp.close()
+        finally:
+            self.app.config.update(TODO_CHANGES_STREAM_TIMEOUT=300,
+                                   TODO_CHANGES_MAX_STREAMS=4)
+        self.assertEqual(0, todo_change_notifier.streams)
+
+    def test_compact_todo_changes(self):
+        from app.models import TodoChange
+        ids = [json.loads(self.client.post(
+            '/todos', data={'name': name}).data)['id'] for name in 'abc']
+        for name in ('a2', 'a3'):
+            self.client.put('/todos/%s' % ids[0], data={'name': name})
+        self.client.delete('/todos/%s' % ids[1])
+        expected = self.changes()
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['compact-todo-changes'])
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn('Deleted 3 todo changes', result.output)
+        self.assertEqual(expected, self.changes())
+
+        result = runner.invoke(args=['compact-todo-changes',
+                                     '--retention', '0'])
+        self.assertIn('Deleted 1 todo changes', result.output)
+        resp = self.client.get('/todos/changes')
+        self.assertEqual(410, resp.status_code)
+        seq = json.loads(resp.data)['seq']
+        self.assertEqual(expected['seq'], seq)
+        self.assertEqual([], self.changes(seq)['changes'])
+        with self.app.app_context():
+            self.assertEqual([('create', ids[2]), ('update', ids[0])], [
+                (change.op, change.todo_id) for change in
+                TodoChange.query.order_by(TodoChange.seq)])
+
+    def test_archive_todos(self):
+        from datetime import datetime, timedelta
+        from app.models import Todo
+        ids = [json.loads(self.client.post('/todos', data={
+            'name': name, 'is_done': name != 'open'}).data)['id']
+            for name in ('old', 'recent', 'open', 'newest')]
+        with self.app.app_context():
+            Todo.query.filter(Todo.id.in_([ids[0], ids[3]])).update(
+                {'completed_date': datetime.utcnow() - timedelta(days=100)},
+                synchronize_session=False)
+            db.session.commit()
+        etag = self.client.get('/todos').headers['ETag']
+        result = self.app.test_cli_runner().invoke(args=['archive-todos'])
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn('Archived 2 todos', result.output)
+
+        resp = self.client.get('/todos', headers={'If-None-Match': etag})
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(ids[1:3], [todo['id'] for todo in
+                                    json.loads(resp.data)])
+        resp = self.client.get('/todos/%s' % ids[0])
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual('old', json.loads(resp.data)['name'])
+        self.assertEqual(404, self.client.put(
+            '/todos/%s' % ids[0], data={'name': 'new'}).status_code)
+
+        for sort in ('created_at', '-created_at', 'due_date'):
+            paged, cursor = [], None
+            while True:
+                resp = self.client.get('/todos', query_string=dict(
+                    include_archived='true', sort=sort, limit=3,
+                    **({'cursor': cursor} if cursor else {})))
+                paged.extend(todo['id'] for todo in json.loads(resp.data))
+                cursor = resp.headers.get('X-Next-Cursor')
+                if not cursor:
+                    break
+            self.assertEqual(paged, [todo['id'] for todo in json.loads(
+                self.client.get('/todos', query_string={
+                    'include_archived': 'true', 'sort': sort}).data)])
+            self.assertEqual(sorted(ids), sorted(paged))
+        resp = self.client.get('/todos', query_string={
+            'include_archived': 'true', 'is_done': 'false'})
+        self.assertEqual([ids[2]], [todo['id'] for todo in
+                                    json.loads(resp.data)])
+
+        stats = json.loads(self.client.get('/todos/stats').data)
+        self.assertEqual((4, 3), (stats['total'], stats['done']))
+        self.assert_stats_consistent()
+        self.app.test_cli_runner().invoke(args=['rebuild-stats'])
+        self.assertEqual(stats, json.loads(
+            self.client.get('/todos/stats').data))
+        changes = {change['id']: change['todo']
+                   for change in self.changes()['changes']}
+        self.assertEqual('old', changes[ids[0]]['name'])
+        exported = self.client.get('/todos/export').data.splitlines()
+        self.assertEqual(ids, [json.loads(line)['id'] for line in exported])
+
+    def test_archived_todo_ids_are_not_reused(self):
+        from datetime import datetime, timedelta
+        from app.models import Todo
+        ids = [json.loads(self.client.post('/todos', data={
+            'name': name, 'is_done': True}).data)['id']
+            for name in ('a', 'b', 'c')]
+        with self.app.app_context():
+            Todo.query.filter(Todo.id.in_(ids[:2])).update(
+                {'completed_date': datetime.utcnow() - timedelta(days=100)},
+                synchronize_session=False)
+            db.session.commit()
+        self.app.test_cli_runner().invoke(args=['archive-todos'])
+        self.client.delete('/todos/%s' % ids[2])
+        new = json.loads(self.client.post(
+            '/todos', data={'name': 'new'}).data)
+        self.assertGreater(new['id'], max(ids))
+        listed = [todo['id'] for todo in json.loads(self.client.get(
+            '/todos', query_string={'include_archived': 'true'}).data)]
+        self.assertEqual(ids[:2] + [new['id']], listed)
+        changes = {change['id']: change['todo']
+                   for change in self.changes()['changes']}
+        self.assertIsNone(changes[new['id']]['completed_date'])
+        self.assertIsNone(changes[ids[2]])
+
+    def test_search(self):
+        for name in ('buy milk', 'buy milk and more milk', 'walk the dog',
+                     'Milk-shake'):
+            self.client.post('/todos', data=dict(name=name))
+        self.register('other', 'other')
+        token = json.loads(self.login('other', 'other').data)['access_token']
+        self.client.post('/todos', data=dict(name='buy milk'), headers={
+            'Authorization': 'Bearer %s' % token})
+        resp = self.client.get('/todos/search', query_string={'q': 'MILK'})
+        self.assertEqual(resp.status_code, 200)
+        names = [todo['name'] for todo in json.loads(resp.data)]
+        self.assertEqual(3, len(names))
+        self.assertEqual('buy milk', names[0])
+        resp = self.client.get('/todos/search',
+                               query_string={'q': 'buy "milk'})
+        self.assertEqual({'buy milk', 'buy milk and more milk'},
+                         {todo['name'] for todo in json.loads(resp.data)})
+
+    def test_search_matches_word_prefixes(self):
+        from app.models import Todo
+        from app.parsers import valid_search_query
+        names = ('buy milk', 'Milk-shake', 'buttermilk', 'milky way',
+                 'call mom/dad', 'mom_dad', 'email boss')
+        for name in names:
+            self.client.post('/todos', data=dict(name=name))
+        queries = {'milk': {'buy milk', 'Milk-shake', 'milky way'},
+                   'mil sha': {'Milk-shake'}, 'ilk': set(),
+                   'dad': {'call mom/dad', 'mom_dad'},
+                   'mom_d': {'call mom/dad', 'mom_dad'}, 'bos': {'email boss'}}
+        for q, expected in queries.items():
+            resp = self.client.get('/todos/search', query_string={'q': q})
+            self.assertEqual(expected, {todo['name'] for todo in json.loads(
+                resp.data)}, q)
+            # the LIKE fallback of other databases agrees with fts
+            with self.app.app_context():
+                todos = Todo.query.filter(Todo.name_matches(
+                    valid_search_query(q, 'q'))).all()
+            self.assertEqual(expected, {todo.name for todo in todos}, q)
+
+    def test_search_follows_updates_and_deletes(self):
+        todo_id = json.loads(self.client.post(
+            '/todos', data=dict(name='buy milk')).data)['id']
+        self.client.put('/todos/%s' % todo_id, data={'name': 'buy bread'})
+        resp = self.client.get('/todos/search', query_string={'q': 'milk'})
+        self.assertEqual([], json.loads(resp.data))
+        resp = self.client.get('/todos/search', query_string={'q': 'bread'})
+        self.assertEqual([todo_id], [t['id'] for t in json.loads(resp.data)])
+        self.client.delete('/todos/%s' % todo_id)
+        resp = self.client.get('/todos/search', query_string={'q': 'bread'})
+        self.assertEqual([], json.loads(resp.data))
+
+    def test_search_pagination(self):
+        for i in range(5):
+            self.client.post('/todos', data=dict(name='item %s' % i))
+        ids, cursor = [], None
+        while True:
+            query = {'q': 'item', 'limit': 2}
+            if cursor:
+                query['cursor'] = cursor
+            resp = self.client.get('/todos/search', query_string=query)
+            ids.extend(todo['id'] for todo in json.loads(resp.data))
+            cursor = resp.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+        self.assertEqual(5, len(set(ids)))
+        resp = self.client.get('/todos/search', query_string={'q': '%%'})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get('/todos/search', query_string={
+            'q': 'item', 'cursor': 'invalid'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_search_uses_fts_index(self):
+        from app.models import Todo, todo_fts
+        with self.app.app_context():
+            query = Todo.query.join(
+                todo_fts, todo_fts.c.rowid == Todo.id).filter(
+                db.literal_column('todo_fts').op('MATCH')('owner : "u1"'))
+            plan = query_plan(query)
+        self.assertIn('VIRTUAL TABLE INDEX', plan)
+        self.assertIn('INTEGER PRIMARY KEY', plan)
+
+    def run_concurrently(self, funcs):
+        """Runs given functions in parallel threads, returns their results"""
+        import threading
+        results = [None] * len(funcs)
+
+        def run(i):
+            with self.app.app_context():
+                try:
+                    results[i] = funcs[i]()
+                except Exception as e:
+                    results[i] = e
+                finally:
+                    self.db.session.remove()
+        threads = [threading.Thread(target=run, args=(i,))
+                   for i in range(len(funcs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_group_commit(self):
+        from app.group_commit import group_commit
+        self.app.config.update(GROUP_COMMIT_ENABLED=True,
+                               GROUP_COMMIT_WINDOW=0.05)
+        before = group_commit.stats()
+        try:
+            results = self.run_concurrently([
+                lambda: self.client.post('/todos', data=self.todo_item)
+            ] * 8)
+            resp = self.client.delete(
+                '/todos/%s' % json.loads(results[0].data)['id'])
+            self.assertEqual(resp.status_code, 204)
+        finally:
+            self.app.config.update(GROUP_COMMIT_ENABLED=False)
+        self.assertEqual([201] * 8, [resp.status_code for resp in results])
+        ids = {json.loads(resp.data)['id'] for resp in results}
+        self.assertEqual(8, len(ids))
+        resp = self.client.get('/todos')
+        self.assertEqual(7, len(json.loads(resp.data)))
+        stats = group_commit.stats()
+        self.assertEqual(9, stats['writes'] - before['writes'])
+        self.assertLess(stats['groups'] - before['groups'], 9)
+
+    def test_group_commit_isolates_errors(self):
+        from app.models import User
+        self.app.config.update(GROUP_COMMIT_ENABLED=True,
+                               GROUP_COMMIT_WINDOW=0.05)
+        try:
+            results = self.run_concurrently([
+                lambda: User(username='main_test_username').save(),
+                lambda: User(username='other').save(),
+            ])
+        finally:
+            self.app.config.update(GROUP_COMMIT_ENABLED=False)
+        self.assertIsInstance(results[0], Exception)
+        self.assertEqual('other', results[1].username)
+        self.assertIsNotNone(results[1].id)
+        with self.app.app_context():
+            self.assertEqual(results[1].id,
+                             User.find_by_username('other').id)
+
+    def enable_admission(self, **config):
+        from app import admission
+        admission.controller.clear()
+        self.addCleanup(admission.controller.clear)
+        self.addCleanup(self.app.config.update, {
+            key: self.app.config[key] for key in config})
+        self.addCleanup(self.app.config.update, ADMISSION_ENABLED=False)
+        self.app.config.update(ADMISSION_ENABLED=True, **config)
+        return admission.controller
+
+    def test_admission_rate_limits_auth_endpoints(self):
+        controller = self.enable_admission(ADMISSION_RATE_LIMITS=dict(
+            self.app.config['ADMISSION_RATE_LIMITS'], auth=(0.01, 2)))
+        self.assertEqual(200, self.login('main_test_username',
+                                         'main_test_password').status_code)
+        self.assertEqual(409, self.register('main_test_username',
+                                            'password').status_code)
+        resp = self.login('main_test_username', 'main_test_password')
+        self.assertEqual(429, resp.status_code)
+        self.assertEqual('Too many requests, retry later',
+                         json.loads(resp.data)['message'])
+        self.assertGreaterEqual(int(resp.headers['Retry-After']), 50)
+        # other endpoint classes have budgets of their own
+        self.assertEqual(200, self.client.get('/todos').status_code)
+        self.assertEqual({('auth', 'accepted'): 2,
+                          ('auth', 'rate_limited'): 1,
+                          ('list', 'accepted'): 1}, controller.stats())
+        text = self.client.get('/metrics').data.decode()
+        self.assertIn('todo_admission_requests_total{class="auth",'
+                      'outcome="rate_limited"} 1', text)
+
+    def test_admission_rate_limits_per_user(self):
+        self.register('other', 'password')
+        other_token = json.loads(
+            self.login('other', 'password').data)['access_token']
+        controller = self.enable_admission(ADMISSION_RATE_LIMITS=dict(
+            self.app.config['ADMISSION_RATE_LIMITS'], list=(0.01, 1)))
+        self.assertEqual(200, self.client.get('/todos').status_code)
+        self.assertEqual(429, self.client.get('/todos').status_code)
+        resp = self.client.get('/todos', headers={
+            'Authorization': 'Bearer %s' % other_token})
+        self.assertEqual(200, resp.status_code)
+        # writes are not list GETs
+        resp = self.client.post('/todos', data=self.todo_item)
+        self.assertEqual(201, resp.status_code)
+        self.assertEqual(1, controller.stats()[('default', 'accepted')])
+
+    def test_admission_caches_token_identities(self):
+        controller = self.enable_admission()
+        self.assertEqual(200, self.client.get('/todos').status_code)
+        self.assertEqual(200, self.client.get('/todos').status_code)
+        self.assertEqual(1, len(controller.identities))
+        # tokens failing the signature check are not cached
+        resp = self.client.get('/todos', headers={
+            'Authorization': 'Bearer %s' % self.access_token[:-2]})
+        self.assertEqual(422, resp.status_code)
+        self.assertEqual(1, len(controller.identities))
+        self.assertEqual(3, controller.stats()[('list', 'accepted')])
+
+    def test_admission_sheds_over_in_flight_limit(self):
+        controller = self.enable_admission(ADMISSION_MAX_IN_FLIGHT=1,
+                                           ADMISSION_QUEUE_TIMEOUT=0.01)
+        with self.app.app_context():
+            slots = controller.setup()
+        self.assertTrue(slots.acquire(blocking=False))
+        try:
+            resp = self.client.get('/todos')
+        finally:
+            slots.release()
+        self.assertEqual(503, resp.status_code)
+        self.assertEqual('Server is busy, retry later',
+                         json.loads(resp.data)['message'])
+        self.assertEqual('1', resp.headers['Retry-After'])
+        self.assertEqual(200, self.client.get('/todos').status_code)
+        self.assertEqual({('list', 'shed'): 1, ('list', 'accepted'): 1},
+                         controller.stats())
+
+    def test_admission_holds_slot_until_stream_closes(self):
+        controller = self.enable_admission(ADMISSION_MAX_IN_FLIGHT=1,
+                                           ADMISSION_QUEUE_TIMEOUT=0.01)
+        resp = self.client.get('/todos/export', buffered=False)
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(503, self.client.get('/todos').status_code)
+        resp.close()
+        self.assertEqual(200, self.client.get('/todos').status_code)
+        self.assertEqual({('list', 'shed'): 1, ('list', 'accepted'): 2},
+                         controller.stats())
+
     def tearDown(self):
         """teardown all initialized variables."""
         with self.app.app_context():
@@ -169,6 +1342,398 @@ class TodoTestCase(unittest.TestCase):
             self.db.drop_all()
 
 
+def cursor_for(client, sort):
+    """Returns the first X-Next-Cursor of GET /todos with given sort"""
+    resp = client.get('/todos', query_string={'limit': 1, 'sort': sort})
+    return resp.headers['X-Next-Cursor']
+
+
+def query_plan(query):
+    """Returns sqlite EXPLAIN QUERY PLAN output of given query"""
+    statement = str(query.statement.compile(
+        db.engine, compile_kwargs={'literal_binds': True}))
+    rows = db.session.execute('EXPLAIN QUERY PLAN ' + statement)
+    return '\n'.join(row[-1] for row in rows)
+
+
+class EngineProfileTestCase(unittest.TestCase):
+    """This class represents the production engine profile test case"""
+
+    def setUp(self):
+        import tempfile
+        from flask import Flask
+        from config import ProductionConfig
+        self.app = Flask(__name__)
+        self.app.config.from_object(ProductionConfig)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
+            os.path.join(tempfile.mkdtemp(), 'profile.db')
+        db.init_app(self.app)
+
+    def test_sqlite_pragmas(self):
+        from sqlalchemy.pool import QueuePool
+        with self.app.app_context():
+            pragmas = {name: db.session.execute(
+                'PRAGMA %s' % name).scalar() for name in (
+                'journal_mode', 'synchronous', 'busy_timeout', 'cache_size',
+                'mmap_size')}
+            self.assertIsInstance(db.engine.pool, QueuePool)
+            db.session.remove()
+            db.get_engine(self.app).dispose()
+        self.assertEqual({'journal_mode': 'wal', 'synchronous': 1,
+                          'busy_timeout': 5000, 'cache_size': -65536,
+                          'mmap_size': 268435456}, pragmas)
+
+    def test_pool_options_of_other_databases(self):
+        from sqlalchemy.engine.url import make_url
+        options = {}
+        db.apply_driver_hacks(self.app, make_url(
+            'postgresql://localhost/todo'), options)
+        self.assertEqual({'pool_size': 10, 'max_overflow': 20,
+                          'pool_timeout': 10, 'pool_recycle': 1800,
+                          'pool_pre_ping': True}, options)
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """
+    This class represents the replica routing test case, with two sqlite
+    files and a file copy standing in for replication
+    """
+
+    def setUp(self):
+        import tempfile
+        from app import create_app, models
+        directory = tempfile.mkdtemp()
+        self.primary = os.path.join(directory, 'primary.db')
+        self.replica = os.path.join(directory, 'replica.db')
+        self.app = create_app('testing')
+        self.app.config.update(
+            SQLALCHEMY_DATABASE_URI='sqlite:///' + self.primary,
+            SQLALCHEMY_BINDS={'replica_0': 'sqlite:///' + self.replica},
+            SQLALCHEMY_REPLICA_BINDS=['replica_0'])
+        models.user_cache.clear()
+        models.revoked_tokens.clear()
+        with self.app.app_context():
+            db.create_all()
+        self.client = self.app.test_client()
+        self.client.post('/registration', data={'username': 'reader',
+                                                'password': 'password'})
+        self.client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer %s' % \
+            self.login('reader')
+        self.replicate()
+
+    def tearDown(self):
+        from app import models
+        models.user_cache.clear()
+        models.revoked_tokens.clear()
+
+    def login(self, username):
+        resp = self.client.post('/login', data={'username': username,
+                                                'password': 'password'})
+        return json.loads(resp.data)['access_token']
+
+    def replicate(self):
+        """Copies the primary db file over the replica"""
+        with self.app.app_context():
+            db.session.remove()
+            for bind in (None, 'replica_0'):
+                db.get_engine(self.app, bind).dispose()
+        shutil.copyfile(self.primary, self.replica)
+
+    def execute(self, path, statement):
+        """Runs given statement on given sqlite file, bypassing the app"""
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.execute(statement)
+        connection.close()
+
+    def names(self, **kwargs):
+        resp = self.client.get('/todos', **kwargs)
+        self.assertEqual(200, resp.status_code)
+        return [todo['name'] for todo in json.loads(resp.data)]
+
+    def test_reads_replica_which_has_the_writes(self):
+        todo_id = json.loads(self.client.post(
+            '/todos', data={'name': 'primary'}).data)['id']
+        self.replicate()
+        # changes which don't bump todo_version go unnoticed
+        self.execute(self.replica, "UPDATE todo SET name = 'replica'")
+        self.assertEqual(['replica'], self.names())
+        self.assertEqual(['replica'], self.names(
+            query_string={'stream': 'true'}))
+        self.assertEqual(['replica'], self.names(
+            query_string={'limit': 10}))
+        resp = self.client.get('/todos/%s' % todo_id)
+        self.assertEqual('replica', json.loads(resp.data)['name'])
+        # writes go to the primary
+        self.client.put('/todos/%s' % todo_id, data={'is_done': True})
+        connection = sqlite3.connect(self.primary)
+        self.assertEqual([('primary', 1)], connection.execute(
+            'SELECT name, is_done FROM todo').fetchall())
+        connection.close()
+
+    def test_reads_own_writes_until_replicated(self):
+        todo_id = json.loads(self.client.post(
+            '/todos', data={'name': 'not replicated'}).data)['id']
+        self.assertEqual(['not replicated'], self.names())
+        resp = self.client.get('/todos/%s' % todo_id)
+        self.assertEqual(200, resp.status_code)
+        self.client.put('/todos/%s' % todo_id, data={'name': 'renamed'})
+        self.assertEqual(['renamed'], self.names())
+
+    def test_users_registered_after_replication(self):
+        self.client.post('/registration', data={'username': 'late',
+                                                'password': 'password'})
+        headers = {'Authorization': 'Bearer %s' % self.login('late')}
+        self.assertEqual([], self.names(headers=headers))
+        self.client.post('/todos', data={'name': 'late'}, headers=headers)
+        self.assertEqual(['late'], self.names(headers=headers))
+        self.assertEqual([], self.names())
+
+    def test_logout_all_while_replica_lags(self):
+        headers = {'Authorization': 'Bearer %s' % self.login('reader')}
+        resp = self.client.post('/logout/all')
+        self.assertEqual(200, resp.status_code)
+        # the replica still has the old token generation
+        resp = self.client.get('/todos', headers=headers)
+        self.assertEqual(401, resp.status_code)
+        self.client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer %s' % \
+            self.login('reader')
+        self.assertEqual([], self.names())
+
+
+# seconds a fresh worker may take to import the app and serve a request
+STARTUP_TIME_BUDGET = 1.5
+
+
+class StartupTestCase(unittest.TestCase):
+    """This class represents the cold start test case"""
+
+    def run_fresh(self, script):
+        """Runs given script in a new interpreter, returns its output"""
+        import subprocess
+        import sys
+        env = dict(os.environ, FLASK_ENV='testing')
+        env.pop('FLASK_RUN_FROM_CLI', None)
+        return subprocess.check_output(
+            [sys.executable, '-c', script], env=env,
+            cwd=os.path.dirname(basedir), stderr=subprocess.DEVNULL)
+
+    def test_startup_time_budget(self):
+        elapsed = min(float(self.run_fresh(
+            'import time\n'
+            'start = time.perf_counter()\n'
+            'import todo\n'
+            'todo.app.test_client().get("/todos")\n'
+            'print(time.perf_counter() - start)')) for _ in range(3))
+        self.assertLess(elapsed, STARTUP_TIME_BUDGET)
+
+    def test_migrations_are_not_loaded_by_workers(self):
+        output = self.run_fresh(
+            'import sys, todo\n'
+            'print("alembic" in sys.modules, "todos" in [\n'
+            '    rule.endpoint for rule in todo.app.url_map.iter_rules()])')
+        self.assertEqual(b'False True', output.strip())
+
+
+class QueryPlanTestCase(unittest.TestCase):
+    """
+    This class represents the query plan regression test case: every
+    statement issued while serving each endpoint and running each
+    maintenance command over synthetic data is explained, none may scan
+    a whole table or index, nor sort todos it could read in index order.
+    Without ANALYZE stats sqlite plans for big tables, so the plans are
+    the ones of a large database.
+    """
+
+    # statements reading every row by design: rebuild-stats recounts the
+    # todos and archived todos of all users and reports the users count
+    EXPECTED_SCANS = ('INSERT INTO todo_stats (user_id, total, done) SELECT',
+                      'SELECT count(*) AS count_1 FROM (SELECT todo_stats.')
+    # statements sorting their rows by design: search ranks the matches,
+    # and a due date range can't share an index with the created order
+    # (the range on (user_id, due_date) bounds the sorted rows)
+    EXPECTED_SORTS = (r'todo_fts MATCH|'
+                      r'due_date [<>]= \? .*ORDER BY \w+\.created_at ')
+
+    def setUp(self):
+        os.environ['FLASK_ENV'] = 'testing'
+        import todo
+        from app import synthetic
+        self.app = todo.app
+        self.app.config.update(REVOKED_TOKEN_SYNC_INTERVAL=0)
+        todo.models.revoked_tokens.clear()
+        todo.models.user_cache.clear()
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.drop_all()
+            db.create_all()
+            self.generated = synthetic.generate(
+                users=20, todos=2000, revoked_tokens=200,
+                password='password', chunk_size=500)
+            # the user owning most todos has several pages of everything
+            username = db.session.query(todo.models.User.username).join(
+                todo.models.TodoStats).order_by(
+                todo.models.TodoStats.total.desc()).limit(1).scalar()
+        resp = self.client.post('/login', data={'username': username,
+                                                'password': 'password'})
+        self.client.environ_base['HTTP_AUTHORIZATION'] = 'Bearer %s' % \
+            json.loads(resp.data)['access_token']
+        self.refresh_token = json.loads(resp.data)['refresh_token']
+
+    def tearDown(self):
+        self.app.config.update(REVOKED_TOKEN_SYNC_INTERVAL=1)
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_generate_data(self):
+        from app import synthetic
+        from app.models import RevokedTokenModel, Todo, TodoStats
+        self.assertEqual({'users': 20, 'todos': 2000,
+                          'revoked_tokens': 200}, self.generated)
+        with self.app.app_context():
+            todos = Todo.query.order_by(Todo.id).all()
+            self.assertEqual(sorted(todos, key=lambda todo: todo.created_at),
+                             todos)
+            done = [todo for todo in todos if todo.is_done]
+            self.assertTrue(0.4 < len(done) / len(todos) < 0.8)
+            self.assertTrue(all(todo.completed_date >= todo.created_at
+                                for todo in done))
+            self.assertTrue(0.3 < sum(todo.due_date is not None
+                                      for todo in todos) / len(todos) < 0.7)
+            self.assertEqual(2000, db.session.query(
+                db.func.sum(TodoStats.total)).scalar())
+            self.assertTrue(RevokedTokenModel.query.filter(
+                RevokedTokenModel.expires_at.is_(None)).count())
+            names = [todo.name for todo in todos]
+            db.drop_all()
+            db.create_all()
+            synthetic.generate(20, 2000, 0, 'password', chunk_size=500)
+            self.assertEqual(names, [todo.name for todo in
+                                     Todo.query.order_by(Todo.id)])
+
+    def test_generated_ids_grow_with_created_at(self):
+        from datetime import datetime, timedelta
+        from random import Random
+        from app import synthetic
+        # todos a second apart, as over the history of millions of todos
+        self.addCleanup(setattr, synthetic, 'HISTORY', synthetic.HISTORY)
+        synthetic.HISTORY = timedelta(seconds=1000)
+        created_at = [row['created_at'] for row in synthetic.todo_rows(
+            Random(0), [1], 1000, datetime.utcnow())]
+        self.assertEqual(sorted(set(created_at)), created_at)
+
+    def exercise(self):
+        """Calls every endpoint and maintenance command"""
+        client = self.client
+        ids = [json.loads(client.post('/todos', data={
+            'name': 'plan %s' % i, 'due_date': '2019-02-20'}).data)['id']
+            for i in range(3)]
+        client.put('/todos/%s' % ids[0], data={'is_done': True})
+        client.delete('/todos/%s' % ids[1])
+        client.get('/todos/%s' % ids[0])
+        client.post('/todos/batch', json={'operations': [
+            {'op': 'create', 'name': 'batch'},
+            {'op': 'update', 'id': ids[0], 'name': 'renamed'},
+            {'op': 'delete', 'id': ids[2]}]})
+        client.post('/todos/import', data=b'{"name": "imported"}\n')
+        filters = [{}, {'is_done': 'false'}, {'is_done': 'true'},
+                   {'overdue': 'true'}, {'due_after': '2019-01-01'},
+                   {'due_before': '2030-01-01'},
+                   {'is_done': 'false', 'due_after': '2019-01-01',
+                    'due_before': '2030-01-01'}]
+        for include_archived in ('false', 'true'):
+            for sort in ('created_at', '-created_at', 'due_date',
+                         '-due_date'):
+                for query in filters:
+                    query = dict(query, sort=sort, limit=5,
+                                 include_archived=include_archived)
+                    resp = client.get('/todos', query_string=query)
+                    if 'X-Next-Cursor' in resp.headers:
+                        client.get('/todos', query_string=dict(
+                            query, cursor=resp.headers['X-Next-Cursor']))
+            client.get('/todos', query_string={
+                'stream': 'true', 'include_archived': include_archived})
+        client.get('/todos/search', query_string={'q': 'buy milk'})
+        client.get('/todos/stats')
+        client.get('/todos/export')
+        client.get('/todos/changes', query_string={'limit': 2})
+        runner = self.app.test_cli_runner()
+        for args in (['archive-todos', '--age', '0'], ['rebuild-stats'],
+                     ['compact-todo-changes', '--retention', '0'],
+                     ['prune-revoked-tokens']):
+            result = runner.invoke(args=args)
+            self.assertEqual(0, result.exit_code, result.output)
+        client.get('/todos/%s' % ids[0])
+        client.get('/todos/changes')
+        client.post('/token/refresh', headers={
+            'Authorization': 'Bearer %s' % self.refresh_token})
+        client.post('/logout/refresh', headers={
+            'Authorization': 'Bearer %s' % self.refresh_token})
+        client.post('/logout/all')
+
+    def test_queries_use_indexes(self):
+        import re
+        from sqlalchemy import event
+        statements = []
+
+        def capture(connection, cursor, statement, parameters, context,
+                    executemany):
+            statements.append((statement, parameters[0] if executemany
+                               else parameters))
+
+        with self.app.app_context():
+            engine = db.engine
+            tables = set(db.metadata.tables)
+        event.listen(engine, 'before_cursor_execute', capture)
+        try:
+            self.exercise()
+        finally:
+            event.remove(engine, 'before_cursor_execute', capture)
+        connection = engine.raw_connection()
+        try:
+            scans = {}
+            for statement, parameters in statements:
+                statement = ' '.join(statement.split())
+                if not re.match(r'(SELECT|INSERT|UPDATE|DELETE|WITH)\b',
+                                statement, re.IGNORECASE) or \
+                        statement.startswith(self.EXPECTED_SCANS):
+                    continue
+                rows = connection.cursor().execute(
+                    'EXPLAIN QUERY PLAN ' + statement, parameters)
+                for row in rows:
+                    # full table or index scans, of aliased tables too
+                    scan = re.match(r'SCAN (\w+?)(_\d+)? ', row[-1] + ' ')
+                    if scan and scan.group(1) in tables or \
+                            row[-1] == 'USE TEMP B-TREE FOR ORDER BY' and \
+                            not re.search(self.EXPECTED_SORTS, statement):
+                        scans[statement] = row[-1]
+        finally:
+            connection.close()
+        self.assertGreater(len(statements), 100)
+        self.maxDiff = None
+        self.assertEqual({}, scans)
+
+
+class BloomFilterTestCase(unittest.TestCase):
+    """This class represents the BloomFilter test case"""
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = ['jti-%s' % i for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        for key in keys:
+            self.assertIn(key, bloom)
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom.add('jti-%s' % i)
+        false_positives = sum('other-%s' % i in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,97 @@
+"""
+Newline delimited json (NDJSON) export and import of a user's todos,
+shared by GET /todos/export, POST /todos/import and the flask cli
+"""
+
+import json
+from werkzeug.exceptions import HTTPException
+from app import parsers
+from app.models import Todo
+
+
+def export_lines(user_id, batch_size, serializer):
+    """
+    Serializes the todos of given user in id order, archived ones
+    included, one json object per line, rows are fetched batch_size at a
+    time (server side cursor where the driver supports it)
+
+    Args:
+        user_id(int): user id
+        batch_size(int): rows fetched and serialized per chunk
+        serializer(Serializer): todo serializer, its columns are selected
+    Returns:
+        (generator): text chunks of batch_size lines
+    """
+    chunk = []
+    for todo in Todo.iter_items_by_user_id(
+            user_id, batch_size, columns=serializer.columns(Todo),
+            include_archived=True):
+        chunk.append(json.dumps(serializer(todo)) + '\n')
+        if len(chunk) >= batch_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def parse_line(line):
+    """
+    Parses one import line
+
+    Args:
+        line(bytes): json object of todo_import_parser fields
+    Returns:
+        (dict): todo row, see Todo.insert_many
+    Raises:
+        ValueError: with the error message if the line is not valid
+    """
+    try:
+        item = json.loads(line)
+    except ValueError:
+        item = None
+    if not isinstance(item, dict):
+        raise ValueError('line should be a json object')
+    try:
+        return parsers.parse_item(parsers.todo_import_parser, item)
+    except HTTPException as e:
+        raise ValueError(e.data['message'])
+
+
+def import_lines(user_id, lines, chunk_size, max_errors):
+    """
+    Validates and inserts given lines for given user in chunks, one
+    transaction per chunk, invalid lines are reported and skipped; memory
+    use doesn't grow with the number of lines
+
+    Args:
+        user_id(int): user id
+        lines(iterable): NDJSON lines, blank ones are ignored
+        chunk_size(int): rows inserted per transaction
+        max_errors(int): number of invalid lines reported
+    Returns:
+        (generator): progress after every committed chunk, dict of lines
+            read, imported and failed counts and the reported errors
+    """
+    progress = {'lines': 0, 'imported': 0, 'failed': 0, 'errors': []}
+    rows = []
+    for number, line in enumerate(lines, 1):
+        progress['lines'] = number
+        if not line.strip():
+            continue
+        try:
+            rows.append(parse_line(line))
+        except ValueError as e:
+            progress['failed'] += 1
+            if len(progress['errors']) < max_errors:
+                progress['errors'].append({'line': number,
+                                           'message': e.args[0]})
+            continue
+        if len(rows) >= chunk_size:
+            Todo.insert_many(user_id, rows)
+            progress['imported'] += len(rows)
+            rows = []
+            yield progress
+    if rows:
+        Todo.insert_many(user_id, rows)
+        progress['imported'] += len(rows)
+    yield progress
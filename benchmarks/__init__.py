@@ -0,0 +1,75 @@
+"""
+Benchmarks for the todo api
+
+Each module is runnable on its own, e.g.
+    python -m benchmarks.revoked_tokens --rows 1000000
+and prints its results as json.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+
+def load_app(database_path=None, config_name='production', database_url=None):
+    """
+    Imports the todo app against a standalone database
+
+    Args:
+        database_path(str): sqlite file path, temporary file if None
+        config_name(str): configuration name(production e.g.)
+        database_url(str): any database url, overrides database_path
+    Returns:
+        (module): todo module with app, db and models
+    """
+    if database_path is None:
+        database_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = database_url or 'sqlite:///' + database_path
+    os.environ['FLASK_ENV'] = config_name
+    import todo
+    with todo.app.app_context():
+        todo.db.create_all()
+    return todo
+
+
+def timed(func, *args, **kwargs):
+    """
+    Calls func with given arguments
+
+    Returns:
+        (float): elapsed seconds
+    """
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def summarize(samples):
+    """
+    Summarizes latency samples
+
+    Args:
+        samples(list): elapsed seconds
+    Returns:
+        (dict): count, mean and p50/p95/p99 latency in microseconds
+    """
+    ordered = sorted(samples)
+
+    def percentile(p):
+        index = min(int(round(p / 100.0 * (len(ordered) - 1))),
+                    len(ordered) - 1)
+        return round(ordered[index] * 1e6, 1)
+
+    return {
+        'count': len(ordered),
+        'mean_us': round(sum(ordered) / len(ordered) * 1e6, 1),
+        'p50_us': percentile(50),
+        'p95_us': percentile(95),
+        'p99_us': percentile(99),
+    }
+
+
+def report(results):
+    """Prints benchmark results as json"""
+    print(json.dumps(results, indent=2, sort_keys=True))
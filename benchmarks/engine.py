@@ -0,0 +1,66 @@
+"""
+Mixed read/write throughput with and without the production engine profile
+
+Runs the load test workload (list, create, update, delete todos and
+refresh tokens from concurrent clients) once with SQLite defaults
+(rollback journal, no pool) and once with the ProductionConfig profile
+(WAL, pragmas, pooled connections), each in a fresh subprocess on its own
+database, and reports throughput and errors.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from benchmarks import load, load_app, report
+
+
+def measure(profile, users, todos_per_user, clients, iterations):
+    """Runs the load test workload with given engine profile"""
+    if profile == 'default':
+        from config import ProductionConfig
+        ProductionConfig.SQLITE_ENGINE_OPTIONS = {}
+        ProductionConfig.SQLITE_PRAGMAS = {'journal_mode': 'DELETE'}
+    todo = load_app()
+    usernames = load.seed(todo, users, todos_per_user)
+    result = load.run(todo, usernames, clients, iterations)
+    endpoints = result['endpoints']
+    requests = sum(endpoint['count'] for endpoint in endpoints.values())
+    return {
+        'throughput_rps': round(requests / result['elapsed_s'], 1),
+        'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+        'p95_us': {name: endpoint['p95_us']
+                   for name, endpoint in endpoints.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--todos-per-user', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--profile', choices=('default', 'production'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        print(json.dumps(measure(args.profile, args.users,
+                                 args.todos_per_user, args.clients,
+                                 args.iterations)))
+        return
+
+    results = {'clients': args.clients}
+    for profile in ('default', 'production'):
+        output = subprocess.check_output([
+            sys.executable, '-m', 'benchmarks.engine', '--profile', profile,
+            '--users', str(args.users),
+            '--todos-per-user', str(args.todos_per_user),
+            '--clients', str(args.clients),
+            '--iterations', str(args.iterations)])
+        results[profile] = json.loads(output.decode().splitlines()[-1])
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
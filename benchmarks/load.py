@@ -0,0 +1,206 @@
+"""
+Load test of every endpoint with concurrent clients
+
+Serves the app on a local threaded http server, seeds users and todos,
+then every client logs in and repeatedly lists, creates, updates and
+deletes todos and refreshes its access token. Reports throughput and
+p50/p95/p99 latency per endpoint as json; with --baseline it exits with
+status 1 if any endpoint regressed beyond --threshold.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from datetime import datetime
+from http.client import HTTPConnection
+from urllib.parse import urlencode
+from werkzeug.serving import WSGIRequestHandler, make_server
+from benchmarks import load_app, summarize
+
+PASSWORD = 'bench-password'
+
+
+def seed(todo, users, todos_per_user, chunk_size=50000):
+    """
+    Bulk loads users sharing one password and their todos
+
+    Returns:
+        (list): usernames
+    """
+    models = todo.models
+    usernames = ['bench-user-%s' % i for i in range(users)]
+    with todo.app.app_context():
+        password = models.User.generate_password_hash(PASSWORD)
+        todo.db.session.execute(models.User.__table__.insert(), [
+            {'username': username, 'password': password}
+            for username in usernames])
+        user_ids = [user_id for user_id, in todo.db.session.query(
+            models.User.id).filter(models.User.username.in_(usernames))]
+        rows = ({'user_id': user_id, 'name': 'todo item %s' % i,
+                 'is_done': i % 3 == 0, 'created_at': datetime.utcnow()}
+                for user_id in user_ids for i in range(todos_per_user))
+        while True:
+            chunk = [row for _, row in zip(range(chunk_size), rows)]
+            if not chunk:
+                break
+            todo.db.session.execute(models.Todo.__table__.insert(), chunk)
+        todo.db.session.commit()
+    return usernames
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    """Request handler without per request access log lines"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class Client:
+    """One simulated api client on its own keep-alive connection"""
+
+    def __init__(self, port, username, samples, errors, lock):
+        self.connection = HTTPConnection('127.0.0.1', port)
+        self.username = username
+        # shared by all clients, updated under lock
+        self.samples = samples
+        self.errors = errors
+        self.lock = lock
+        self.tokens = {}
+
+    def request(self, name, method, url, form=None, token='access'):
+        headers = {}
+        if token in self.tokens:
+            headers['Authorization'] = 'Bearer %s' % self.tokens[token]
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        start = time.perf_counter()
+        self.connection.request(method, url, body=body, headers=headers)
+        resp = self.connection.getresponse()
+        data = resp.read()
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples.setdefault(name, []).append(elapsed)
+            if resp.status >= 400:
+                self.errors[name] = self.errors.get(name, 0) + 1
+        if resp.status >= 400:
+            return None
+        return json.loads(data) if data else None
+
+    def run(self, iterations):
+        data = self.request('login', 'POST', '/login', form={
+            'username': self.username, 'password': PASSWORD})
+        if data is not None and 'access_token' not in data:
+            # e.g. unknown user, answered with 200
+            with self.lock:
+                self.errors['login'] = self.errors.get('login', 0) + 1
+        if data is None or 'access_token' not in data:
+            self.connection.close()
+            return
+        self.tokens = {'access': data['access_token'],
+                       'refresh': data['refresh_token']}
+        for i in range(iterations):
+            self.request('list_todos', 'GET', '/todos?limit=100')
+            created = self.request('create_todo', 'POST', '/todos',
+                                   form={'name': 'load test %s' % i})
+            if created:
+                url = '/todos/%s' % created['id']
+                self.request('update_todo', 'PUT', url,
+                             form={'is_done': 'true'})
+                self.request('delete_todo', 'DELETE', url)
+            refreshed = self.request('refresh_token', 'POST',
+                                     '/token/refresh', token='refresh')
+            if refreshed:
+                self.tokens['access'] = refreshed['access_token']
+        self.connection.close()
+
+
+def run(todo, usernames, clients, iterations):
+    """Runs given number of concurrent clients, returns the report"""
+    server = make_server('127.0.0.1', 0, todo.app, threaded=True,
+                         request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    samples, errors, lock = {}, {}, threading.Lock()
+    workers = [
+        threading.Thread(target=Client(
+            server.server_port, usernames[i % len(usernames)],
+            samples, errors, lock).run, args=(iterations,))
+        for i in range(clients)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    endpoints = {}
+    for name, latencies in sorted(samples.items()):
+        endpoints[name] = summarize(latencies)
+        endpoints[name]['errors'] = errors.get(name, 0)
+        endpoints[name]['throughput_rps'] = round(len(latencies) / elapsed, 1)
+    return {'clients': clients, 'iterations': iterations,
+            'elapsed_s': round(elapsed, 2), 'endpoints': endpoints}
+
+
+def compare(report, baseline, threshold):
+    """
+    Compares a report with a baseline report
+
+    Returns:
+        (list): regressions, latency or throughput worse than threshold
+    """
+    regressions = []
+    for name, current in report['endpoints'].items():
+        previous = baseline['endpoints'].get(name)
+        if previous is None:
+            continue
+        for key in ('p50_us', 'p95_us', 'p99_us'):
+            if current[key] > previous[key] * (1 + threshold):
+                regressions.append('%s %s: %s -> %s' % (
+                    name, key, previous[key], current[key]))
+        if current['throughput_rps'] < \
+                previous['throughput_rps'] * (1 - threshold):
+            regressions.append('%s throughput_rps: %s -> %s' % (
+                name, previous['throughput_rps'], current['throughput_rps']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--todos-per-user', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--database', help='sqlite file, temporary if unset')
+    parser.add_argument('--database-url', help='any database url, e.g. '
+                        'postgresql://localhost/todo_bench')
+    parser.add_argument('--output', help='write the report to this file')
+    parser.add_argument('--baseline', help='report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative regression')
+    args = parser.parse_args()
+
+    todo = load_app(args.database, database_url=args.database_url)
+    usernames = seed(todo, args.users, args.todos_per_user)
+    report = run(todo, usernames, args.clients, args.iterations)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for regression in regressions:
+            print('REGRESSION %s' % regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
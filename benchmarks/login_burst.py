@@ -0,0 +1,94 @@
+"""
+Login burst against steady /todos traffic
+
+Measures /todos latency alone, then again while a burst of concurrent
+logins runs, together with login throughput. Run it with different
+--hash-workers/--hash-concurrency (0 workers hashes inline) to compare.
+"""
+
+import argparse
+import threading
+import time
+from werkzeug.serving import make_server
+from benchmarks import load_app, report, summarize
+from benchmarks.load import Client, QuietRequestHandler, seed
+
+# guards the samples shared by the clients
+samples_lock = threading.Lock()
+
+
+def poll_todos(port, username, samples, stop):
+    """Lists todos in a loop until stop is set"""
+    client = Client(port, username, samples, {}, samples_lock)
+    client.run(0)  # login only
+    while not stop.is_set():
+        client.request('list_todos', 'GET', '/todos?limit=100')
+
+
+def login(port, username, samples, count):
+    """Logs in count times"""
+    client = Client(port, username, samples, {}, samples_lock)
+    for _ in range(count):
+        client.run(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hash-workers', type=int, default=2)
+    parser.add_argument('--hash-concurrency', type=int, default=4)
+    parser.add_argument('--pollers', type=int, default=4)
+    parser.add_argument('--login-clients', type=int, default=16)
+    parser.add_argument('--logins-per-client', type=int, default=5)
+    parser.add_argument('--quiet-seconds', type=float, default=3)
+    parser.add_argument('--database', help='sqlite file, temporary if unset')
+    args = parser.parse_args()
+
+    todo = load_app(args.database)
+    todo.app.config.update(PASSWORD_HASH_WORKERS=args.hash_workers,
+                           PASSWORD_HASH_CONCURRENCY=args.hash_concurrency,
+                           PASSWORD_HASH_QUEUE_TIMEOUT=60)
+    usernames = seed(todo, args.pollers + args.login_clients, 100)
+    server = make_server('127.0.0.1', 0, todo.app, threaded=True,
+                         request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+
+    quiet, burst, logins = {}, {}, {}
+    stop = threading.Event()
+    pollers = [threading.Thread(target=poll_todos,
+                                args=(port, usernames[i], quiet, stop))
+               for i in range(args.pollers)]
+    for poller in pollers:
+        poller.start()
+    time.sleep(args.quiet_seconds)
+    # switch pollers over to the burst samples
+    with samples_lock:
+        quiet_samples = quiet.pop('list_todos', [])
+        quiet['list_todos'] = burst.setdefault('list_todos', [])
+
+    start = time.perf_counter()
+    bursters = [threading.Thread(target=login, args=(
+        port, usernames[args.pollers + i], logins, args.logins_per_client))
+        for i in range(args.login_clients)]
+    for burster in bursters:
+        burster.start()
+    for burster in bursters:
+        burster.join()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for poller in pollers:
+        poller.join()
+    server.shutdown()
+
+    report({
+        'hash_workers': args.hash_workers,
+        'hash_concurrency': args.hash_concurrency,
+        'login': dict(summarize(logins['login']), throughput_rps=round(
+            len(logins['login']) / elapsed, 1)),
+        'list_todos_quiet': summarize(quiet_samples),
+        'list_todos_during_burst': summarize(burst['list_todos']),
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Overload of a single gunicorn worker with and without admission control
+
+Starts gunicorn.conf.py with one worker of --threads threads, then more
+--clients than threads export their todos in a loop, once with
+ADMISSION_ENABLED=false and once with true. Reports the responses per
+status and their latency: without admission the excess requests wait in
+gunicorn's accept queue, with it the spare threads shed them with 503.
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+from benchmarks import load_app, report, summarize
+from benchmarks.load import seed
+
+
+def free_port():
+    """Returns a local tcp port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(port, threads, admission):
+    """Starts a single worker gunicorn, returns it once it accepts"""
+    env = dict(os.environ, GUNICORN_WORKERS='1', GUNICORN_THREADS=str(threads),
+               ADMISSION_ENABLED='true' if admission else 'false')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         '-b', '127.0.0.1:%s' % port, 'todo:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('gunicorn did not start')
+
+
+def export(port, token, seconds, samples, lock):
+    """Exports todos until seconds have passed, samples per status"""
+    connection = HTTPConnection('127.0.0.1', port)
+    headers = {'Authorization': 'Bearer %s' % token}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        connection.request('GET', '/todos/export', headers=headers)
+        resp = connection.getresponse()
+        resp.read()
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples.setdefault(resp.status, []).append(elapsed)
+        if resp.status == 503:
+            # a client honouring Retry-After would back off longer
+            time.sleep(0.05)
+    connection.close()
+
+
+def measure(port, tokens, threads, admission, seconds):
+    server = start_gunicorn(port, threads, admission)
+    samples, lock = {}, threading.Lock()
+    try:
+        clients = [threading.Thread(target=export, args=(
+            port, token, seconds, samples, lock)) for token in tokens]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return {str(status): summarize(status_samples)
+            for status, status_samples in sorted(samples.items())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--todos-per-user', type=int, default=2000)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--database', help='sqlite file, temporary if unset')
+    args = parser.parse_args()
+
+    todo = load_app(args.database)
+    from flask_jwt_extended import create_access_token
+    usernames = seed(todo, args.clients, args.todos_per_user)
+    with todo.app.app_context():
+        # tokens made here, logging in would hit the auth rate limit
+        users = todo.models.User.query.filter(
+            todo.models.User.username.in_(usernames))
+        tokens = [create_access_token(identity=user) for user in users]
+
+    port = free_port()
+    report({
+        'threads': args.threads,
+        'clients': args.clients,
+        'admission_disabled': measure(port, tokens, args.threads, False,
+                                      args.seconds),
+        'admission_enabled': measure(port, tokens, args.threads, True,
+                                     args.seconds),
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Todo argument parsing, flask_restful reqparse vs the compiled Schema
+
+Parses the same json and form bodies with a RequestParser equivalent to
+todo_insert_parser and with todo_insert_parser itself, and checks both
+produce the same arguments.
+"""
+
+import argparse
+from flask_restful import reqparse
+from benchmarks import load_app, report, summarize, timed
+
+BODIES = {
+    'json': {'json': {'name': 'todo item', 'is_done': True,
+                      'due_date': '2019-02-20'}},
+    'form': {'data': {'name': 'todo item', 'is_done': 'true',
+                      'due_date': '2019-02-20'}},
+}
+
+
+def request_parser():
+    """Returns the reqparse parser todo_insert_parser replaced"""
+    from app.parsers import valid_boolean, valid_date
+    parser = reqparse.RequestParser()
+    parser.add_argument('name', help='name can not be blank', required=True)
+    parser.add_argument('is_done', help='is_done should be boolean',
+                        type=valid_boolean)
+    parser.add_argument('due_date', help='Due date should be %Y-%m-%d',
+                        type=valid_date)
+    return parser
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=10000)
+    args = parser.parse_args()
+
+    todo = load_app()
+    from app.parsers import todo_insert_parser
+    parsers = {'reqparse': request_parser(), 'schema': todo_insert_parser}
+    results = {}
+    for body, kwargs in BODIES.items():
+        outputs = []
+        for name, argument_parser in parsers.items():
+            with todo.app.test_request_context('/todos', method='POST',
+                                               **kwargs):
+                samples = [timed(argument_parser.parse_args)
+                           for _ in range(args.repeat)]
+                outputs.append(dict(argument_parser.parse_args()))
+            results['%s_%s' % (name, body)] = summarize(samples)
+        results['%s_identical_output' % body] = outputs[0] == outputs[1]
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Revoked token check latency with a large RevokedTokenModel table
+
+Compares the plain SQL lookup (RevokedTokenModel.is_jti_blacklisted) with
+the cached check (revoked_tokens.is_revoked) and measures a full
+authenticated GET /todos request on top of it.
+"""
+
+import argparse
+import json
+import uuid
+from benchmarks import load_app, report, summarize, timed
+
+
+def seed_revoked_tokens(todo, rows, chunk_size=50000):
+    """Bulk inserts given number of revoked tokens, returns some of them"""
+    table = todo.models.RevokedTokenModel.__table__
+    sample = []
+    with todo.app.app_context():
+        for start in range(0, rows, chunk_size):
+            chunk = [{'jti': str(uuid.uuid4())}
+                     for _ in range(min(chunk_size, rows - start))]
+            todo.db.session.execute(table.insert(), chunk)
+            sample.extend(row['jti'] for row in chunk[:10])
+        todo.db.session.commit()
+    return sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--checks', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--database', help='sqlite file, temporary if unset')
+    args = parser.parse_args()
+
+    todo = load_app(args.database)
+    models = todo.models
+    revoked = seed_revoked_tokens(todo, args.rows)
+    unknown = [str(uuid.uuid4()) for _ in range(args.checks)]
+    results = {'rows': args.rows}
+
+    with todo.app.app_context():
+        results['warm_ms'] = round(timed(models.revoked_tokens.warm) * 1e3, 1)
+        results['sql_not_revoked'] = summarize(
+            [timed(models.RevokedTokenModel.is_jti_blacklisted, jti)
+             for jti in unknown])
+        results['cached_not_revoked'] = summarize(
+            [timed(models.revoked_tokens.is_revoked, jti) for jti in unknown])
+        results['sql_revoked'] = summarize(
+            [timed(models.RevokedTokenModel.is_jti_blacklisted, jti)
+             for jti in revoked])
+        results['cached_revoked'] = summarize(
+            [timed(models.revoked_tokens.is_revoked, jti) for jti in revoked])
+        results['cache_stats'] = models.revoked_tokens.stats()
+
+    client = todo.app.test_client()
+    credentials = {'username': 'bench', 'password': 'bench'}
+    resp = client.post('/registration', data=credentials)
+    token = json.loads(resp.data)['access_token']
+    headers = {'Authorization': 'Bearer %s' % token}
+    results['get_todos_request'] = summarize(
+        [timed(client.get, '/todos', headers=headers)
+         for _ in range(args.requests)])
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+GET /todos/search latency with a large todo table
+
+Seeds todos with random names spread over many users and times
+Todo.search for common and rare words, through the FTS5 index and through
+the LIKE fallback used on other databases.
+"""
+
+import argparse
+import random
+from unittest import mock
+from benchmarks import load_app, report, summarize, timed
+
+WORDS = ['buy', 'milk', 'call', 'mom', 'pay', 'rent', 'fix', 'bike', 'read',
+         'book', 'walk', 'dog', 'clean', 'house', 'write', 'report', 'plan',
+         'trip', 'water', 'plants'] + ['word%s' % i for i in range(5000)]
+
+
+def seed_todos(todo, rows, users, chunk_size=50000):
+    """Bulk inserts given number of todos owned by given number of users"""
+    table = todo.models.Todo.__table__
+    rng = random.Random(0)
+    with todo.app.app_context():
+        for start in range(0, rows, chunk_size):
+            todo.db.session.execute(table.insert(), [
+                {'user_id': rng.randint(1, users), 'is_done': False,
+                 'name': ' '.join(rng.choice(WORDS[:20]) if rng.random() < .7
+                                  else rng.choice(WORDS) for _ in range(4))}
+                for _ in range(min(chunk_size, rows - start))])
+        todo.db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--searches', type=int, default=500)
+    parser.add_argument('--database', help='sqlite file, temporary if unset')
+    args = parser.parse_args()
+
+    todo = load_app(args.database)
+    seed_todos(todo, args.rows, args.users)
+    Todo = todo.models.Todo
+    rng = random.Random(1)
+    queries = {
+        'common_word': lambda: [rng.choice(WORDS[:20])],
+        'two_words': lambda: rng.sample(WORDS[:20], 2),
+        'rare_word': lambda: [rng.choice(WORDS[20:])],
+    }
+    results = {'rows': args.rows, 'users': args.users}
+    with todo.app.app_context():
+        for name, terms in queries.items():
+            results['fts_' + name] = summarize([
+                timed(Todo.search, rng.randint(1, args.users), terms(), 20)
+                for _ in range(args.searches)])
+            with mock.patch.object(todo.db.engine.dialect, 'name', 'other'):
+                results['like_' + name] = summarize([
+                    timed(Todo.search, rng.randint(1, args.users), terms(), 20)
+                    for _ in range(args.searches)])
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Todo list serialization, flask_restful marshal vs the compiled Serializer
+
+Serializes the same rows with marshal over ORM objects, the Serializer
+over ORM objects and the Serializer over column only query rows, and
+checks all three produce byte identical json.
+"""
+
+import argparse
+import json
+from datetime import datetime
+from flask_restful import marshal
+from benchmarks import load_app, report, summarize, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--database', help='sqlite file, temporary if unset')
+    args = parser.parse_args()
+
+    todo = load_app(args.database)
+    from app.resources import todo_fields, todo_serializer, todo_columns
+    Todo = todo.models.Todo
+    with todo.app.app_context():
+        todo.db.session.execute(Todo.__table__.insert(), [
+            {'user_id': 1, 'name': 'todo item %s' % i, 'is_done': i % 2 == 0,
+             'created_at': datetime.utcnow(),
+             'due_date': datetime(2019, 2, 20).date() if i % 3 else None,
+             'completed_date': datetime.utcnow() if i % 2 == 0 else None}
+            for i in range(args.rows)
+        ])
+        todo.db.session.commit()
+
+        def query_objects():
+            todo.db.session.expunge_all()
+            return Todo.get_items_by_user_id(1)
+
+        def query_rows():
+            return Todo.get_items_by_user_id(1, columns=todo_columns)
+
+        paths = {
+            'marshal_objects': (query_objects,
+                                lambda items: marshal(items, todo_fields)),
+            'serializer_objects': (query_objects, todo_serializer.many),
+            'serializer_rows': (query_rows, todo_serializer.many),
+        }
+        results = {'rows': args.rows}
+        outputs = set()
+        for name, (query, serialize) in paths.items():
+            query_samples, serialize_samples = [], []
+            for _ in range(args.repeat):
+                query_samples.append(timed(query))
+                items = query()
+                serialize_samples.append(timed(serialize, items))
+            outputs.add(json.dumps(serialize(query())))
+            results[name] = {'query': summarize(query_samples),
+                             'serialize': summarize(serialize_samples)}
+        results['identical_output'] = len(outputs) == 1
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
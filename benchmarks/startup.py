@@ -0,0 +1,54 @@
+"""
+Cold start time of the todo app
+
+Times fresh interpreters importing todo (building the app) and serving
+their first request, the time a new worker takes before it is useful.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from benchmarks import report, summarize
+
+SCRIPT = '''
+import time
+start = time.perf_counter()
+import todo
+imported = time.perf_counter()
+todo.app.test_client().get('/todos')
+print(imported - start, time.perf_counter() - start)
+'''
+
+
+def measure(config_name='testing'):
+    """
+    Starts a fresh interpreter importing todo and serving one request
+
+    Returns:
+        (tuple): seconds to import todo, seconds until the first response
+    """
+    env = dict(os.environ, FLASK_ENV=config_name)
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    output = subprocess.check_output(
+        [sys.executable, '-c', SCRIPT], env=env,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stderr=subprocess.DEVNULL)
+    imported, first_request = output.split()
+    return float(imported), float(first_request)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--config', default='testing')
+    args = parser.parse_args()
+    samples = [measure(args.config) for _ in range(args.runs)]
+    report({
+        'import': summarize([imported for imported, _ in samples]),
+        'first_request': summarize([first for _, first in samples]),
+    })
+
+
+if __name__ == '__main__':
+    main()
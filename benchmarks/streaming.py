@@ -0,0 +1,91 @@
+"""
+GET /todos memory and time to first byte, marshal_with vs streaming
+
+Seeds one user with many todos, then runs each mode in a fresh
+subprocess so their peak RSS can be compared.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from benchmarks import load_app, report
+
+CREDENTIALS = {'username': 'bench', 'password': 'bench'}
+
+
+def seed_todos(todo, count, chunk_size=50000):
+    """Creates the benchmark user with given number of todos"""
+    client = todo.app.test_client()
+    client.post('/registration', data=CREDENTIALS)
+    with todo.app.app_context():
+        user = todo.models.User.find_by_username(CREDENTIALS['username'])
+        table = todo.models.Todo.__table__
+        for start in range(0, count, chunk_size):
+            todo.db.session.execute(table.insert(), [
+                {'user_id': user.id, 'name': 'todo item %s' % i,
+                 'is_done': i % 3 == 0, 'created_at': datetime.utcnow(),
+                 'due_date': datetime(2019, 2, 20).date()}
+                for i in range(start, min(start + chunk_size, count))
+            ])
+        todo.db.session.commit()
+
+
+def measure(database, stream):
+    """Requests the whole todo list once, returns timings and peak RSS"""
+    todo = load_app(database)
+    client = todo.app.test_client()
+    resp = client.post('/login', data=CREDENTIALS)
+    headers = {
+        'Authorization': 'Bearer %s' % json.loads(resp.data)['access_token']}
+    query = {'stream': 'true'} if stream else {}
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    resp = client.get('/todos', headers=headers, query_string=query,
+                      buffered=False)
+    body = iter(resp.response)
+    size = len(next(body))
+    first_byte = time.perf_counter() - start
+    for chunk in body:
+        size += len(chunk)
+    total = time.perf_counter() - start
+    resp.close()
+    return {
+        'ttfb_ms': round(first_byte * 1e3, 1),
+        'total_ms': round(total * 1e3, 1),
+        'body_bytes': size,
+        'peak_rss_growth_kb':
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--todos', type=int, default=100000)
+    parser.add_argument('--database', help='sqlite file, temporary if unset')
+    parser.add_argument('--mode', choices=('marshal', 'stream'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(measure(args.database, args.mode == 'stream')))
+        return
+
+    database = args.database or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    seed_todos(load_app(database), args.todos)
+    results = {'todos': args.todos}
+    for mode in ('marshal', 'stream'):
+        output = subprocess.check_output([
+            sys.executable, '-m', 'benchmarks.streaming',
+            '--database', database, '--mode', mode])
+        results[mode] = json.loads(output)
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
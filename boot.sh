@@ -1,6 +1,4 @@
 #!/usr/bin/env bash
 source venv/bin/activate
-flask db init
-flask db migrate
-flask db upgrade
-exec gunicorn -b :5000 --access-logfile - --error-logfile - todo:app
\ No newline at end of file
+flask upgrade-if-needed
+exec gunicorn -c gunicorn.conf.py todo:app
@@ -7,12 +7,130 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'todo.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # comma separated replica urls, read only GET endpoints and the jwt
+    # loaders query a random replica bind (see db.SQLAlchemy.reading)
+    SQLALCHEMY_BINDS = {
+        'replica_%s' % i: url for i, url in enumerate(filter(None, (
+            os.environ.get('DATABASE_REPLICA_URLS') or '').split(',')))
+    }
+    SQLALCHEMY_REPLICA_BINDS = sorted(SQLALCHEMY_BINDS)
+    # create_engine options and per connection pragmas (see db.SQLAlchemy),
+    # SQLALCHEMY_ENGINE_OPTIONS apply to databases other than SQLite
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    SQLITE_ENGINE_OPTIONS = {}
+    SQLITE_PRAGMAS = {}
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'secret-key'
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-key'
     JWT_BLACKLIST_ENABLED = True
+    # refresh tokens carry the token generation claim too, see /logout/all
+    JWT_CLAIMS_IN_REFRESH_TOKEN = True
     PROPAGATE_EXCEPTIONS = True
     DEBUG = False
     CSRF_ENABLED = True
+    # threads of a gunicorn worker (see gunicorn.conf.py), the limits on
+    # requests and streams held at once by a worker stay below it
+    GUNICORN_THREADS = int(os.environ.get('GUNICORN_THREADS') or 16)
+    # revoked token cache (see app.models.RevokedTokenCache)
+    REVOKED_TOKEN_BLOOM_CAPACITY = 100000
+    REVOKED_TOKEN_BLOOM_ERROR_RATE = 0.001
+    REVOKED_TOKEN_CACHE_SIZE = 10000
+    REVOKED_TOKEN_SYNC_INTERVAL = 1
+    # ids allocated by uncommitted revocations are looked up again until
+    # they commit, within GAP_WINDOW ids of the latest one and for
+    # GAP_TIMEOUT seconds (longer than any transaction)
+    REVOKED_TOKEN_SYNC_GAP_WINDOW = 1000
+    REVOKED_TOKEN_SYNC_GAP_TIMEOUT = 300
+    # delete expired revoked tokens every REVOKED_TOKEN_PRUNE_INTERVAL
+    # seconds in each worker, 0 leaves it to `flask prune-revoked-tokens`
+    REVOKED_TOKEN_PRUNE_INTERVAL = int(
+        os.environ.get('REVOKED_TOKEN_PRUNE_INTERVAL') or 0)
+    REVOKED_TOKEN_PRUNE_BATCH_SIZE = 1000
+    REVOKED_TOKEN_PRUNE_PAUSE = 0.05
+    # jwt user loader cache (see app.models.UserCache)
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 60
+    # GET /todos page size when paginated, limit parameter is capped by max
+    TODO_PAGE_SIZE = 100
+    TODO_PAGE_MAX_SIZE = 1000
+    # rows fetched and serialized per chunk by GET /todos?stream=true
+    TODO_STREAM_BATCH_SIZE = 500
+    # max operations accepted by one POST /todos/batch
+    TODO_BATCH_MAX_OPERATIONS = 1000
+    # GET /todos/changes page size, streams poll for changes of other
+    # workers every POLL_INTERVAL seconds and end after STREAM_TIMEOUT;
+    # each stream holds a thread, a worker serves MAX_STREAMS at once and
+    # answers more with 503 so its other threads keep serving requests
+    TODO_CHANGES_PAGE_SIZE = 1000
+    TODO_CHANGES_POLL_INTERVAL = 5
+    TODO_CHANGES_STREAM_TIMEOUT = 300
+    TODO_CHANGES_MAX_STREAMS = int(
+        os.environ.get('TODO_CHANGES_MAX_STREAMS') or
+        max(GUNICORN_THREADS // 4, 1))
+    # change log compaction (see app.models.TodoChange.compact) every
+    # TODO_CHANGES_COMPACT_INTERVAL seconds in each worker, 0 leaves it to
+    # `flask compact-todo-changes`; deletions are kept RETENTION seconds
+    TODO_CHANGES_COMPACT_INTERVAL = int(
+        os.environ.get('TODO_CHANGES_COMPACT_INTERVAL') or 0)
+    TODO_CHANGES_RETENTION = 7 * 24 * 3600
+    TODO_CHANGES_COMPACT_BATCH_SIZE = 1000
+    TODO_CHANGES_COMPACT_PAUSE = 0.05
+    # archival of completed todos (see app.models.ArchivedTodo.archive)
+    # every TODO_ARCHIVE_INTERVAL seconds in each worker, 0 leaves it to
+    # `flask archive-todos`; todos completed AGE seconds ago are moved
+    TODO_ARCHIVE_INTERVAL = int(os.environ.get('TODO_ARCHIVE_INTERVAL') or 0)
+    TODO_ARCHIVE_AGE = 90 * 24 * 3600
+    TODO_ARCHIVE_BATCH_SIZE = 1000
+    TODO_ARCHIVE_PAUSE = 0.05
+    # NDJSON import rows committed per transaction and invalid lines
+    # reported by POST /todos/import and `flask import-todos`
+    TODO_IMPORT_CHUNK_SIZE = 1000
+    TODO_IMPORT_MAX_ERRORS = 100
+    # password hashing (see app.passwords), method must include the cost
+    # (iterations), stored hashes with other parameters are rehashed on login;
+    # WORKERS and CONCURRENCY are per gunicorn worker
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_CONCURRENCY = 4
+    PASSWORD_HASH_QUEUE_TIMEOUT = 5
+    PASSWORD_HASH_RETRY_AFTER = 1
+    # request instrumentation and /metrics endpoint (see app.metrics),
+    # METRICS_DIR must be shared by all gunicorn workers of the app
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED') == 'true'
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = 1
+    METRICS_SLOW_REQUEST_SECONDS = 0.5
+    # commit concurrent BaseModel.save/delete calls arriving within
+    # GROUP_COMMIT_WINDOW seconds in one transaction (see app.group_commit)
+    GROUP_COMMIT_ENABLED = os.environ.get('GROUP_COMMIT_ENABLED') == 'true'
+    GROUP_COMMIT_WINDOW = 0.002
+    # admission control of the api resources (see app.admission): per
+    # client (rate per second, burst) token buckets of each endpoint class
+    # and max requests served at once per worker, others are shed with 503;
+    # every gunicorn worker enforces them on its own
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED') == 'true'
+    ADMISSION_ENDPOINT_CLASSES = {
+        'userlogin': 'auth',
+        'userregistration': 'auth',
+        'GET todos': 'list',
+        'GET todo_search': 'list',
+        'GET todo_export': 'list',
+    }
+    ADMISSION_RATE_LIMITS = {
+        'auth': (1, 10),
+        'list': (20, 40),
+        'default': (50, 100),
+    }
+    ADMISSION_MAX_CLIENTS = 100000
+    # verified access tokens whose identity is kept by a worker
+    ADMISSION_TOKEN_CACHE_SIZE = 10000
+    # the in-flight limit stays below GUNICORN_THREADS so spare threads
+    # answer shed requests at once instead of leaving them in gunicorn's
+    # accept queue
+    ADMISSION_MAX_IN_FLIGHT = int(
+        os.environ.get('ADMISSION_MAX_IN_FLIGHT') or
+        max(GUNICORN_THREADS * 3 // 4, 1))
+    ADMISSION_QUEUE_TIMEOUT = 0.05
+    ADMISSION_RETRY_AFTER = 1
 
 
 class DevelopmentConfig(Config):
@@ -26,12 +144,38 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir,
                                                           'test_todo.db')
     DEBUG = True
+    METRICS_ENABLED = True
+    # cheap inline hashing keeps the tests fast
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_HASH_WORKERS = 0
 
 
 class ProductionConfig(Config):
     """Configurations for Production."""
     DEBUG = False
     TESTING = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+    }
+    # WAL lets readers run alongside the writer; connections are pooled
+    # and shared by the threads of a worker one at a time
+    SQLITE_ENGINE_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 10,
+        'connect_args': {'check_same_thread': False, 'timeout': 5},
+    }
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,  # KiB
+        'busy_timeout': 5000,  # ms
+    }
 
 
 app_config = {
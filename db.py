@@ -1,3 +1,97 @@
-from flask_sqlalchemy import SQLAlchemy
+import random
+import sqlite3
+from contextlib import contextmanager
+from flask import current_app, has_app_context
+from flask_sqlalchemy import SQLAlchemy as BaseSQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import UpdateBase
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending the queries of SQLAlchemy.reading blocks to a replica
+    engine, flushes and insert/update/delete statements always go to the
+    primary
+    """
+
+    def __init__(self, db, **options):
+        self.replica = None
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replica is not None and not self._flushing and \
+                not isinstance(clause, UpdateBase):
+            return self.replica
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class SQLAlchemy(BaseSQLAlchemy):
+    """
+    Flask-SQLAlchemy creating its engines with the options of the app
+    config: SQLITE_ENGINE_OPTIONS for SQLite, SQLALCHEMY_ENGINE_OPTIONS
+    for other databases. Every new SQLite connection runs SQLITE_PRAGMAS.
+    Read only code can query the SQLALCHEMY_REPLICA_BINDS, see reading.
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        if info.drivername.startswith('sqlite'):
+            options.update(app.config['SQLITE_ENGINE_OPTIONS'])
+            if options.get('pool_size'):
+                # file databases get a NullPool otherwise
+                options.setdefault('poolclass', QueuePool)
+        else:
+            options.update(app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+
+    def pick_replica(self):
+        """
+        Returns the engine of a random replica bind, None without replicas
+        or once the session has pending writes, which must be read back
+        from the primary
+        """
+        replicas = current_app.config['SQLALCHEMY_REPLICA_BINDS']
+        session = self.session()
+        if not replicas or session.new or session.dirty or session.deleted:
+            return None
+        return self.get_engine(bind=random.choice(replicas))
+
+    @contextmanager
+    def reading(self, replica):
+        """
+        Routes the queries of the block to given replica engine, they may
+        not see the latest writes (replication lag)
+
+        Args:
+            replica(Engine): replica engine, see pick_replica, the block
+                reads the primary if None
+        """
+        session = self.session()
+        previous = session.replica
+        if replica is not None:
+            session.replica = replica
+        try:
+            yield
+        finally:
+            session.replica = previous
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Runs SQLITE_PRAGMAS of the current app on new SQLite connections"""
+    if not isinstance(dbapi_connection, sqlite3.Connection) or \
+            not has_app_context():
+        return
+    pragmas = current_app.config.get('SQLITE_PRAGMAS')
+    if pragmas:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
 
 db = SQLAlchemy()
@@ -0,0 +1,31 @@
+"""
+gunicorn settings, e.g. `gunicorn -c gunicorn.conf.py todo:app`
+
+The app is imported once by the master and workers fork from it, so a
+new worker starts serving without importing and building the app again.
+"""
+import os
+from config import Config
+
+bind = ':5000'
+workers = int(os.environ.get('GUNICORN_WORKERS') or 2)
+# change feed streams hold a thread for up to TODO_CHANGES_STREAM_TIMEOUT
+# seconds (at most TODO_CHANGES_MAX_STREAMS per worker); a thread worker
+# keeps notifying the master from its main loop, so timeout only kills
+# hung workers, not long responses, and GUNICORN_THREADS should stay
+# below the db pool size plus overflow
+worker_class = 'gthread'
+threads = Config.GUNICORN_THREADS
+timeout = int(os.environ.get('GUNICORN_TIMEOUT') or 30)
+preload_app = True
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """Drops db connections inherited from the master, a connection must
+    not be shared by processes"""
+    from db import db
+    from todo import app
+    with app.app_context():
+        db.engine.dispose()
@@ -0,0 +1,58 @@
+"""todo autoincrement ids
+
+Revision ID: 4b7e2d9c1a63
+Revises: e688138d208e
+Create Date: 2026-10-18 12:31:40.216904
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e2d9c1a63'
+down_revision = 'e688138d208e'
+branch_labels = None
+depends_on = None
+
+# dropping the todo table while it is rebuilt drops its triggers
+TODO_FTS_TRIGGERS = (
+    "CREATE TRIGGER todo_fts_insert AFTER INSERT ON todo BEGIN "
+    "INSERT INTO todo_fts (rowid, name, owner) "
+    "VALUES (new.id, new.name, 'u' || new.user_id); END",
+    "CREATE TRIGGER todo_fts_delete AFTER DELETE ON todo BEGIN "
+    "INSERT INTO todo_fts (todo_fts, rowid, name, owner) "
+    "VALUES ('delete', old.id, old.name, 'u' || old.user_id); END",
+    "CREATE TRIGGER todo_fts_update AFTER UPDATE OF name, user_id ON todo "
+    "BEGIN INSERT INTO todo_fts (todo_fts, rowid, name, owner) "
+    "VALUES ('delete', old.id, old.name, 'u' || old.user_id); "
+    "INSERT INTO todo_fts (rowid, name, owner) "
+    "VALUES (new.id, new.name, 'u' || new.user_id); END",
+)
+
+
+def rebuild_todo(autoincrement):
+    with op.batch_alter_table('todo', recreate='always', table_kwargs={
+            'sqlite_autoincrement': autoincrement}):
+        pass
+    for statement in TODO_FTS_TRIGGERS:
+        op.execute(statement)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        # other databases never reuse ids
+        return
+    rebuild_todo(True)
+    # new ids start above every id an archived or logged todo holds
+    op.execute("DELETE FROM sqlite_sequence WHERE name = 'todo'")
+    op.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'todo', max("
+        "(SELECT coalesce(max(id), 0) FROM todo), "
+        "(SELECT coalesce(max(id), 0) FROM todo_archive), "
+        "(SELECT coalesce(max(todo_id), 0) FROM todo_change))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    rebuild_todo(False)
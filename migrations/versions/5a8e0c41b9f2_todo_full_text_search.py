@@ -0,0 +1,49 @@
+"""todo full text search
+
+Revision ID: 5a8e0c41b9f2
+Revises: 3f1c9a2d7e45
+Create Date: 2026-10-18 10:04:12.918345
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5a8e0c41b9f2'
+down_revision = '3f1c9a2d7e45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        # other databases search with LIKE, see Todo.search
+        return
+    op.execute(
+        "CREATE VIRTUAL TABLE todo_fts USING fts5(name, owner, content='')")
+    op.execute(
+        "CREATE TRIGGER todo_fts_insert AFTER INSERT ON todo BEGIN "
+        "INSERT INTO todo_fts (rowid, name, owner) "
+        "VALUES (new.id, new.name, 'u' || new.user_id); END")
+    op.execute(
+        "CREATE TRIGGER todo_fts_delete AFTER DELETE ON todo BEGIN "
+        "INSERT INTO todo_fts (todo_fts, rowid, name, owner) "
+        "VALUES ('delete', old.id, old.name, 'u' || old.user_id); END")
+    op.execute(
+        "CREATE TRIGGER todo_fts_update AFTER UPDATE OF name, user_id ON todo "
+        "BEGIN INSERT INTO todo_fts (todo_fts, rowid, name, owner) "
+        "VALUES ('delete', old.id, old.name, 'u' || old.user_id); "
+        "INSERT INTO todo_fts (rowid, name, owner) "
+        "VALUES (new.id, new.name, 'u' || new.user_id); END")
+    op.execute(
+        "INSERT INTO todo_fts (rowid, name, owner) "
+        "SELECT id, name, 'u' || user_id FROM todo")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute('DROP TRIGGER todo_fts_update')
+    op.execute('DROP TRIGGER todo_fts_delete')
+    op.execute('DROP TRIGGER todo_fts_insert')
+    op.execute('DROP TABLE todo_fts')